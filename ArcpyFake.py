@@ -0,0 +1,882 @@
+"""
+#-------------------------------------------------------------------------------
+# Name:        arcapi.ArcpyFake
+# Purpose:     In-memory stand-in for arcpy tables and arcpy.da cursors.
+#
+# Authors:     Filip Kral, Caleb Mackey
+#
+# Created:     18/10/2026
+# Licence:     LGPL v3
+#-------------------------------------------------------------------------------
+#
+# ArcpyMockup only allows arcapi to be imported without arcpy. This module
+# keeps tables in memory so that functions based on cursors can run, and can be
+# tested and profiled, on computers without ArcGIS.
+#
+# Supported are arcpy.da.SearchCursor, UpdateCursor, and InsertCursor with
+# where clauses, ORDER BY, DISTINCT, TOP, and field projection, arcpy.da.Walk
+# over real folders (file geodatabases list the fake tables), and functions
+# ListFields, Describe, Exists, GetCount, CreateTable, AddField, Copy, Delete,
+# CreateFileGDB, ValidateFieldName, ValidateTableName, GetInstallInfo, and
+# CheckOutExtension, CheckInExtension, and CheckExtension. Anything else behaves like ArcpyMockup.
+#
+# Where clauses support comparisons (=, <>, !=, <, <=, >, >=), IS [NOT] NULL,
+# [NOT] IN, [NOT] LIKE, [NOT] BETWEEN, AND, OR, NOT, parentheses, UPPER, LOWER,
+# DATE literals, and field names quoted as "name" or [name].
+#
+# Latency of real data sources like SDE or network shares can be imitated by
+# call_latency (seconds added to each call) and row_latency (seconds added to
+# each row read or written by a cursor).
+#
+# import arcapi as ap
+# from ArcpyFake import ArcpyFake
+# ap.arcpy = ArcpyFake(call_latency=0.05, row_latency=0.0001)
+# ap.tlist_to_table([(1, 'a'), (2, 'b')], 'in_memory\\t', ['ID:LONG', 'NM:TEXT'])
+# ap.values('in_memory\\t', 'NM', 'ID > 1') # [u'b']
+#
+#-------------------------------------------------------------------------------
+"""
+
+import os
+import re
+import copy
+import time
+import fnmatch
+import operator
+import datetime
+import tempfile
+import threading
+from itertools import islice
+from operator import itemgetter
+from collections import OrderedDict
+from types import ModuleType
+from ArcpyMockup import ArcpyMockup
+
+
+class ExecuteError(Exception):
+    """Raised by fake geoprocessing tools like arcpy.ExecuteError"""
+    pass
+
+
+_field_types = {
+    'SHORT': 'SmallInteger', 'SMALLINTEGER': 'SmallInteger',
+    'LONG': 'Integer', 'INTEGER': 'Integer',
+    'FLOAT': 'Single', 'SINGLE': 'Single', 'DOUBLE': 'Double',
+    'TEXT': 'String', 'STRING': 'String', 'DATE': 'Date',
+    'BLOB': 'Blob', 'GUID': 'Guid', 'GEOMETRY': 'Geometry'
+}
+"""Field types accepted by AddField and types reported by ListFields"""
+
+_field_lengths = {
+    'OID': 4, 'SmallInteger': 2, 'Integer': 4, 'Single': 4, 'Double': 8,
+    'String': 255, 'Date': 8, 'Guid': 38
+}
+"""Default lengths of fields by type"""
+
+_walk_extensions = ('.shp', '.dbf', '.csv', '.txt', '.tif', '.img', '.jpg', '.png', '.lyr', '.mxd')
+"""Files reported by da.Walk, .dbf only if it is not part of a shapefile"""
+
+_casts = {
+    'SmallInteger': int, 'Integer': int, 'Single': float, 'Double': float,
+    'String': unicode
+}
+"""Functions converting values written to fields by type"""
+
+
+class Field(object):
+    """Field of a fake table, mimics arcpy.Field"""
+
+    def __init__(self, name, type='String', length=None, precision=0, scale=0,
+                 aliasName=None, isNullable=True, required=False, domain=''):
+        self.name = name
+        self.baseName = name
+        self.aliasName = aliasName or name
+        self.type = type
+        self.length = length or _field_lengths.get(type, 0)
+        self.precision = precision
+        self.scale = scale
+        self.isNullable = isNullable
+        self.required = required
+        self.editable = type != 'OID'
+        self.domain = domain
+
+    def __repr__(self):
+        return '<Field %s (%s)>' % (self.name, self.type)
+
+
+class Table(object):
+    """In-memory table with object id field OBJECTID and rows in insert order.
+
+    Rows are lists of values of all fields, object id first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fields = [Field('OBJECTID', 'OID', isNullable=False, required=True)]
+        self.rows = OrderedDict()
+        self.next_oid = 1
+        self.lock = threading.Lock()
+
+    def index(self, name):
+        """Return index of field name (case insensitive) or raise RuntimeError"""
+        n = str(name).strip().upper()
+        if n == 'OID@':
+            n = 'OBJECTID'
+        elif n.startswith('SHAPE@'):
+            n = 'SHAPE'
+        for i, f in enumerate(self.fields):
+            if f.name.upper() == n:
+                return i
+        raise RuntimeError('Cannot find field %s' % name)
+
+    def caster(self, i):
+        """Return function that validates and converts values for field i"""
+        f = self.fields[i]
+        cast = _casts.get(f.type, None)
+        def c(v):
+            if v is None:
+                if not f.isNullable:
+                    raise RuntimeError('Field %s is not nullable' % f.name)
+                return None
+            if cast is not None:
+                try:
+                    v = cast(v)
+                except (ValueError, TypeError):
+                    raise RuntimeError('The value type is incompatible with the field type. [%s]' % f.name)
+                if cast is unicode and len(v) > f.length:
+                    raise RuntimeError('The value is too long for field %s' % f.name)
+            return v
+        return c
+
+    def insert(self, row):
+        """Store row (list) under a new object id and return the object id"""
+        with self.lock:
+            oid = self.next_oid
+            self.next_oid += 1
+            row[0] = oid
+            self.rows[oid] = row
+        return oid
+
+    def copy(self, path):
+        """Return a copy of this table under new path"""
+        t = Table(path)
+        t.fields = copy.deepcopy(self.fields)
+        t.rows = OrderedDict((o, list(r)) for o, r in self.rows.iteritems())
+        t.next_oid = self.next_oid
+        return t
+
+
+_token = re.compile(r"""\s*(?:
+    (?P<str>'(?:[^']|'')*')|
+    (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|
+    (?P<qid>"[^"]+"|\[[^\]]+\])|
+    (?P<op><>|!=|<=|>=|=|<|>|\(|\)|,|-)|
+    (?P<word>[A-Za-z_][\w@.]*)
+    )""", re.X)
+
+_keywords = frozenset(['AND', 'OR', 'NOT', 'IS', 'NULL', 'IN', 'LIKE',
+                       'BETWEEN', 'DATE', 'TIMESTAMP', 'UPPER', 'LOWER'])
+
+_comparisons = {
+    '=': operator.eq, '<>': operator.ne, '!=': operator.ne, '<': operator.lt,
+    '<=': operator.le, '>': operator.gt, '>=': operator.ge
+}
+
+
+def _tokenize(clause):
+    """Split where clause into list of tuples (kind, value)"""
+    tokens = []
+    pos, end = 0, len(clause.rstrip())
+    while pos < end:
+        m = _token.match(clause, pos)
+        if m is None or m.end() == pos:
+            raise RuntimeError('Invalid where clause near: %s' % clause[pos:])
+        pos = m.end()
+        kind = m.lastgroup
+        v = m.group(kind)
+        if kind == 'str':
+            tokens.append(('lit', unicode(v[1:-1].replace("''", "'"))))
+        elif kind == 'num':
+            tokens.append(('lit', float(v) if ('.' in v or 'e' in v.lower()) else int(v)))
+        elif kind == 'qid':
+            tokens.append(('id', v[1:-1]))
+        elif kind == 'op':
+            tokens.append(('op', v))
+        elif v.upper() in _keywords:
+            tokens.append(('kw', v.upper()))
+        else:
+            tokens.append(('id', v))
+    return tokens
+
+
+def _like(pattern):
+    """Compile SQL LIKE pattern into a regular expression"""
+    rx = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+    return re.compile(rx + r'\Z', re.S)
+
+
+def _date(s):
+    """Parse date literal like '2014-01-31' or '2014-01-31 12:30:00'"""
+    for tf in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(s.strip(), tf)
+        except ValueError:
+            pass
+    raise RuntimeError('Invalid date literal %s' % s)
+
+
+def _not(g):
+    """Negate three-valued predicate g"""
+    def f(row):
+        v = g(row)
+        return None if v is None else not v
+    return f
+
+
+class _Where(object):
+    """Recursive descent parser that compiles where clause into a predicate.
+
+    The predicate takes a row (list of values of all fields of a table) and
+    returns True, False, or None (unknown) as in SQL three-valued logic.
+    """
+
+    def __init__(self, clause, index):
+        self.tokens = _tokenize(clause)
+        self.pos = 0
+        self.index = index
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self):
+        t = self.peek()
+        if t[0] is None:
+            raise RuntimeError('Unexpected end of where clause')
+        self.pos += 1
+        return t
+
+    def accept(self, kind, value):
+        if self.peek() == (kind, value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind, value):
+        if not self.accept(kind, value):
+            raise RuntimeError('Expected %s in where clause, got %s' % (value, self.peek()[1]))
+
+    def parse(self):
+        f = self.disjunction()
+        if self.pos < len(self.tokens):
+            raise RuntimeError('Invalid where clause near: %s' % self.peek()[1])
+        return f
+
+    def disjunction(self):
+        fs = [self.conjunction()]
+        while self.accept('kw', 'OR'):
+            fs.append(self.conjunction())
+        if len(fs) == 1:
+            return fs[0]
+        def f(row):
+            r = False
+            for g in fs:
+                v = g(row)
+                if v:
+                    return True
+                if v is None:
+                    r = None
+            return r
+        return f
+
+    def conjunction(self):
+        fs = [self.negation()]
+        while self.accept('kw', 'AND'):
+            fs.append(self.negation())
+        if len(fs) == 1:
+            return fs[0]
+        def f(row):
+            r = True
+            for g in fs:
+                v = g(row)
+                if v is None:
+                    r = None
+                elif not v:
+                    return False
+            return r
+        return f
+
+    def negation(self):
+        if self.accept('kw', 'NOT'):
+            return _not(self.negation())
+        return self.predicate()
+
+    def predicate(self):
+        if self.accept('op', '('):
+            f = self.disjunction()
+            self.expect('op', ')')
+            return f
+        a = self.operand()
+        if self.accept('kw', 'IS'):
+            isnot = self.accept('kw', 'NOT')
+            self.expect('kw', 'NULL')
+            return lambda row: (a(row) is None) != isnot
+        negate = self.accept('kw', 'NOT')
+        kind, v = self.peek()
+        if kind == 'op' and v in _comparisons and not negate:
+            self.take()
+            b = self.operand()
+            cmp = _comparisons[v]
+            def f(row):
+                x, y = a(row), b(row)
+                if x is None or y is None:
+                    return None
+                return cmp(x, y)
+        elif self.accept('kw', 'IN'):
+            self.expect('op', '(')
+            vals = [self.literal()]
+            while self.accept('op', ','):
+                vals.append(self.literal())
+            self.expect('op', ')')
+            vals = set(vals)
+            def f(row):
+                x = a(row)
+                return None if x is None else x in vals
+        elif self.accept('kw', 'LIKE'):
+            rx = _like(unicode(self.literal()))
+            def f(row):
+                x = a(row)
+                return None if x is None else rx.match(unicode(x)) is not None
+        elif self.accept('kw', 'BETWEEN'):
+            lo = self.operand()
+            self.expect('kw', 'AND')
+            hi = self.operand()
+            def f(row):
+                x, l, h = a(row), lo(row), hi(row)
+                if x is None or l is None or h is None:
+                    return None
+                return l <= x <= h
+        else:
+            raise RuntimeError('Invalid where clause near: %s' % v)
+        return _not(f) if negate else f
+
+    def operand(self):
+        kind, v = self.peek()
+        if kind == 'id':
+            self.take()
+            return itemgetter(self.index(v))
+        if kind == 'kw' and v in ('UPPER', 'LOWER'):
+            self.take()
+            self.expect('op', '(')
+            g = self.operand()
+            self.expect('op', ')')
+            fn = unicode.upper if v == 'UPPER' else unicode.lower
+            def f(row):
+                x = g(row)
+                return None if x is None else fn(unicode(x))
+            return f
+        c = self.literal()
+        return lambda row: c
+
+    def literal(self):
+        kind, v = self.take()
+        if kind == 'lit':
+            return v
+        if kind == 'kw' and v == 'NULL':
+            return None
+        if (kind, v) == ('op', '-'):
+            kind, v = self.take()
+            if kind == 'lit' and not isinstance(v, basestring):
+                return -v
+        elif kind == 'kw' and v in ('DATE', 'TIMESTAMP'):
+            kind, v = self.take()
+            if kind == 'lit' and isinstance(v, basestring):
+                return _date(v)
+        raise RuntimeError('Invalid literal in where clause: %s' % v)
+
+
+def _order(postfix, index):
+    """Parse ORDER BY clause into list of tuples (field index, descending)"""
+    m = re.match(r'\s*ORDER\s+BY\s+(.+)$', postfix, re.I | re.S)
+    if m is None:
+        raise RuntimeError('Unsupported sql clause: %s' % postfix)
+    order = []
+    for part in m.group(1).split(','):
+        bits = part.split()
+        desc = False
+        if len(bits) > 1 and bits[-1].upper() in ('ASC', 'DESC'):
+            desc = bits.pop().upper() == 'DESC'
+        order.append((index(' '.join(bits).strip('"[]')), desc))
+    return order
+
+
+def _prefix(prefix):
+    """Parse sql prefix into tuple (distinct, top)"""
+    m = re.match(r'\s*(DISTINCT)?\s*(?:TOP\s+(\d+))?\s*$', prefix, re.I)
+    if m is None:
+        raise RuntimeError('Unsupported sql clause: %s' % prefix)
+    return (m.group(1) is not None, None if m.group(2) is None else int(m.group(2)))
+
+
+class _Cursor(object):
+    """Base class of fake arcpy.da cursors"""
+
+    def __init__(self, fake, in_table, field_names):
+        fake._call()
+        self._fake = fake
+        self._table = fake._table(in_table, RuntimeError)
+        if isinstance(field_names, basestring):
+            field_names = [field_names]
+        field_names = list(field_names)
+        if field_names == ['*']:
+            field_names = [f.name for f in self._table.fields]
+        self.fields = tuple(field_names)
+        self._idx = [self._table.index(f) for f in field_names]
+
+    def _select(self, where_clause, sql_clause):
+        """Return object ids of rows matching where_clause ordered by sql_clause"""
+        table = self._table
+        rows = table.rows
+        if where_clause:
+            test = _Where(where_clause, table.index).parse()
+            oids = [o for o, r in rows.iteritems() if test(r)]
+        else:
+            oids = list(rows)
+        postfix = (sql_clause or (None, None))[1]
+        if postfix:
+            for i, desc in reversed(_order(postfix, table.index)):
+                oids.sort(key=lambda o: rows[o][i], reverse=desc)
+        return oids
+
+    def _project(self, row):
+        return tuple(row[i] for i in self._idx)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __iter__(self):
+        return self
+
+
+class SearchCursor(_Cursor):
+    """Fake arcpy.da.SearchCursor, rows are returned as tuples"""
+
+    def __init__(self, fake, in_table, field_names, where_clause=None, sql_clause=(None, None)):
+        _Cursor.__init__(self, fake, in_table, field_names)
+        self._where_clause = where_clause
+        self._sql_clause = sql_clause or (None, None)
+        self.reset()
+
+    def _rows(self):
+        rows = self._table.rows
+        fake = self._fake
+        for o in self._select(self._where_clause, self._sql_clause):
+            row = rows.get(o, None)
+            if row is not None:
+                fake._row()
+                yield self._project(row)
+
+    def reset(self):
+        it = self._rows()
+        prefix = self._sql_clause[0]
+        if prefix:
+            distinct, top = _prefix(prefix)
+            if distinct:
+                it = self._distinct(it)
+            if top is not None:
+                it = islice(it, top)
+        self._it = it
+
+    @staticmethod
+    def _distinct(it):
+        seen = set()
+        for row in it:
+            if row not in seen:
+                seen.add(row)
+                yield row
+
+    def next(self):
+        return next(self._it)
+
+
+class UpdateCursor(_Cursor):
+    """Fake arcpy.da.UpdateCursor, rows are returned as lists"""
+
+    def __init__(self, fake, in_table, field_names, where_clause=None, sql_clause=(None, None)):
+        _Cursor.__init__(self, fake, in_table, field_names)
+        self._casts = [(i, self._table.caster(i)) for i in self._idx]
+        self._where_clause = where_clause
+        self._sql_clause = sql_clause or (None, None)
+        self.reset()
+
+    def reset(self):
+        if self._sql_clause[0]:
+            raise RuntimeError('Unsupported sql clause for UpdateCursor: %s' % self._sql_clause[0])
+        self._oids = iter(self._select(self._where_clause, self._sql_clause))
+        self._oid = None
+
+    def next(self):
+        rows = self._table.rows
+        for o in self._oids:
+            row = rows.get(o, None)
+            if row is not None:
+                self._fake._row()
+                self._oid = o
+                return list(self._project(row))
+        self._oid = None
+        raise StopIteration
+
+    def _current(self):
+        row = self._table.rows.get(self._oid, None) if self._oid is not None else None
+        if row is None:
+            raise RuntimeError('No current row')
+        return row
+
+    def updateRow(self, row):
+        current = self._current()
+        if len(row) != len(self._idx):
+            raise RuntimeError('Row has %s values, expected %s' % (len(row), len(self._idx)))
+        self._fake._row()
+        for (i, cast), v in zip(self._casts, row):
+            if i != 0:
+                current[i] = cast(v)
+
+    def deleteRow(self):
+        self._current()
+        self._fake._row()
+        del self._table.rows[self._oid]
+        self._oid = None
+
+
+class InsertCursor(_Cursor):
+    """Fake arcpy.da.InsertCursor"""
+
+    def __init__(self, fake, in_table, field_names):
+        _Cursor.__init__(self, fake, in_table, field_names)
+        self._casts = [(i, self._table.caster(i)) for i in self._idx]
+
+    def insertRow(self, row):
+        if len(row) != len(self._idx):
+            raise RuntimeError('Row has %s values, expected %s' % (len(row), len(self._idx)))
+        self._fake._row()
+        new = [None] * len(self._table.fields)
+        for (i, cast), v in zip(self._casts, row):
+            if i != 0:
+                new[i] = cast(v)
+        return self._table.insert(new)
+
+
+class _DataAccess(ModuleType):
+    """Fake arcpy.da module"""
+
+    def __init__(self, fake):
+        ModuleType.__init__(self, 'arcpy.da')
+        self._fake = fake
+
+    def SearchCursor(self, in_table, field_names, where_clause=None, spatial_reference=None, explode_to_points=False, sql_clause=(None, None)):
+        return SearchCursor(self._fake, in_table, field_names, where_clause, sql_clause)
+
+    def UpdateCursor(self, in_table, field_names, where_clause=None, spatial_reference=None, explode_to_points=False, sql_clause=(None, None)):
+        return UpdateCursor(self._fake, in_table, field_names, where_clause, sql_clause)
+
+    def InsertCursor(self, in_table, field_names):
+        return InsertCursor(self._fake, in_table, field_names)
+
+    def Walk(self, top, topdown=True, onerror=None, followlinks=False, datatype=None, type=None):
+        """Walk real folders, datatype and type are ignored"""
+        fake = self._fake
+        for dirpath, dirnames, filenames in os.walk(top, topdown, onerror, followlinks):
+            fake._call()
+            if dirpath.lower().endswith('.gdb'):
+                k = fake._key(dirpath)
+                del dirnames[:]
+                filenames = sorted(os.path.basename(t.path.replace('\\', '/')) for kt, t in fake.tables.items() if os.path.dirname(kt) == k)
+            else:
+                dirnames.sort()
+                shps = set(os.path.splitext(f)[0].lower() for f in filenames if f.lower().endswith('.shp'))
+                filenames = sorted(
+                    f for f in filenames if os.path.splitext(f)[1].lower() in _walk_extensions and
+                    not (f.lower().endswith('.dbf') and os.path.splitext(f)[0].lower() in shps)
+                )
+            yield dirpath, dirnames, filenames
+
+
+class _Management(ModuleType):
+    """Fake arcpy.management module"""
+
+    def __init__(self, fake):
+        ModuleType.__init__(self, 'arcpy.management')
+        self._fake = fake
+
+    def CreateTable(self, *args, **kwargs):
+        return self._fake.CreateTable_management(*args, **kwargs)
+
+    def AddField(self, *args, **kwargs):
+        return self._fake.AddField_management(*args, **kwargs)
+
+    def GetCount(self, *args, **kwargs):
+        return self._fake.GetCount_management(*args, **kwargs)
+
+    def Copy(self, *args, **kwargs):
+        return self._fake.Copy_management(*args, **kwargs)
+
+    def CreateFileGDB(self, *args, **kwargs):
+        return self._fake.CreateFileGDB_management(*args, **kwargs)
+
+    def Delete(self, *args, **kwargs):
+        return self._fake.Delete_management(*args, **kwargs)
+
+
+class _Result(object):
+    """Result of a fake geoprocessing tool, mimics arcpy.Result"""
+
+    def __init__(self, *outputs):
+        self._outputs = outputs
+        self.outputCount = len(outputs)
+
+    def getOutput(self, index):
+        return self._outputs[index]
+
+    def __getitem__(self, index):
+        return self._outputs[index]
+
+    def __str__(self):
+        return str(self._outputs[0])
+
+
+class _Env(object):
+    """Fake arcpy.env"""
+
+    def __init__(self):
+        self.workspace = None
+        self.scratchWorkspace = 'in_memory'
+        self.scratchGDB = 'in_memory'
+        self.scratchFolder = tempfile.gettempdir()
+        self.overwriteOutput = False
+
+
+class _Describe(object):
+    """Result of Describe on a fake table or workspace"""
+
+    def __init__(self, path, table=None):
+        base = os.path.basename(path.replace('\\', '/'))
+        self.catalogPath = path
+        self.name = base
+        self.file = base
+        self.baseName, self.extension = os.path.splitext(base)
+        self.extension = self.extension.lstrip('.')
+        self.path = path[:len(path) - len(base)].rstrip('\\/')
+        if table is None:
+            self.dataType = 'Workspace'
+            self.workspaceType = 'LocalDatabase'
+        else:
+            self.dataType = 'DbaseTable' if self.extension.lower() == 'dbf' else 'Table'
+            self.datasetType = 'Table'
+            self.dataElementType = 'DETable'
+            self.hasOID = True
+            self.OIDFieldName = table.fields[0].name
+            self.fields = copy.deepcopy(table.fields)
+            self.indexes = []
+
+
+class ArcpyFake(ArcpyMockup):
+    """Object that looks like the arcpy module and keeps tables in memory.
+
+    Tables can be created, filled, read, and updated by the supported
+    functions and cursors. Functions that are not supported behave as in
+    ArcpyMockup, they print a WARNING message and return None.
+
+    Optional:
+    call_latency -- seconds to sleep in each call, including cursor creation
+    row_latency -- seconds to sleep for each row read or written by a cursor
+
+    Example:
+    >>> fake = ArcpyFake(call_latency=0.01)
+    >>> fake.CreateTable_management('in_memory', 't')
+    >>> fake.AddField_management('in_memory\\t', 'X', 'LONG')
+    """
+
+    def __init__(self, call_latency=0.0, row_latency=0.0):
+        """Create fake arcpy module with no tables"""
+        ModuleType.__init__(self, 'arcpy')
+        ArcpyMockup.__init__(self)
+        self.call_latency = call_latency
+        self.row_latency = row_latency
+        self.tables = {}
+        self.workspaces = set()
+        self.licences = set(['Spatial', '3D', 'Network'])
+        self.checked_out = set()
+        self.env = _Env()
+        self.ExecuteError = ExecuteError
+        self.da = _DataAccess(self)
+        self.management = _Management(self)
+
+    def _call(self):
+        if self.call_latency > 0:
+            time.sleep(self.call_latency)
+
+    def _row(self):
+        if self.row_latency > 0:
+            time.sleep(self.row_latency)
+
+    def _path(self, x):
+        """Return x prefixed by env.workspace if x has no directory"""
+        x = str(x)
+        if not os.path.dirname(x.replace('\\', '/')) and self.env.workspace:
+            x = os.path.join(self.env.workspace, x)
+        return x
+
+    def _norm(self, x):
+        return os.path.normpath(str(x).replace('\\', '/')).lower()
+
+    def _key(self, x):
+        return self._norm(self._path(x))
+
+    def _table(self, x, error=IOError):
+        t = self.tables.get(self._key(x), None)
+        if t is None:
+            raise error('"%s" does not exist' % x)
+        return t
+
+    def _is_workspace(self, x):
+        if self._norm(x) in ('in_memory', self._norm(self.env.scratchGDB)):
+            return True
+        if self._key(x) in self.workspaces:
+            return True
+        k = self._key(x)
+        return any(os.path.dirname(t) == k for t in self.tables)
+
+    def AddError(self, m):
+        print m
+
+    def GetInstallInfo(self):
+        return {'Version': '10.1', 'ProductName': 'ArcpyFake', 'InstallDir': ''}
+
+    def ValidateFieldName(self, name, workspace=None):
+        n = re.sub(r'\W', '_', str(name))
+        if not n or n[0].isdigit():
+            n = '_' + n
+        return n[:64]
+
+    def ValidateTableName(self, name, workspace=None):
+        return self.ValidateFieldName(name, workspace)
+
+    def CheckExtension(self, name):
+        self._call()
+        return 'Available' if name in self.licences else 'NotLicensed'
+
+    def CheckOutExtension(self, name):
+        self._call()
+        if name not in self.licences:
+            return 'NotLicensed'
+        self.checked_out.add(name)
+        return 'CheckedOut'
+
+    def CheckInExtension(self, name):
+        self._call()
+        self.checked_out.discard(name)
+        return 'CheckedIn'
+
+    def Exists(self, x):
+        self._call()
+        return self._key(x) in self.tables or self._is_workspace(x)
+
+    def Describe(self, x):
+        self._call()
+        t = self.tables.get(self._key(x), None)
+        if t is None:
+            if not self._is_workspace(x):
+                raise IOError('"%s" does not exist' % x)
+            return _Describe(self._path(x))
+        return _Describe(t.path, t)
+
+    def ListFields(self, dataset, wild_card=None, field_type=None):
+        self._call()
+        flds = self._table(dataset).fields
+        if wild_card not in (None, '', '*'):
+            flds = [f for f in flds if fnmatch.fnmatch(f.name.lower(), wild_card.lower())]
+        if field_type not in (None, '', 'All'):
+            flds = [f for f in flds if f.type.lower() == field_type.lower()]
+        return [copy.copy(f) for f in flds]
+
+    def GetCount_management(self, in_rows):
+        self._call()
+        return _Result(unicode(len(self._table(in_rows, ExecuteError).rows)))
+
+    def CreateTable_management(self, out_path, out_name, template=None, config_keyword=None):
+        self._call()
+        if out_path in (None, '', '#'):
+            out_path = self.env.workspace or ''
+        path = os.path.join(str(out_path), str(out_name))
+        if self._key(path) in self.tables:
+            if not self.env.overwriteOutput:
+                raise ExecuteError('ERROR 000258: Output %s already exists' % path)
+            del self.tables[self._key(path)]
+        t = Table(path)
+        if template not in (None, '', '#'):
+            t.fields += copy.deepcopy(self._table(template, ExecuteError).fields[1:])
+        self.tables[self._key(path)] = t
+        return _Result(path)
+
+    def AddField_management(self, in_table, field_name, field_type, field_precision=None,
+                            field_scale=None, field_length=None, field_alias=None,
+                            field_is_nullable=None, field_is_required=None, field_domain=None):
+        self._call()
+        t = self._table(in_table, ExecuteError)
+        ftype = _field_types.get(str(field_type).upper(), None)
+        if ftype is None:
+            raise ExecuteError('ERROR 000800: Invalid field type %s' % field_type)
+        if any(f.name.lower() == str(field_name).lower() for f in t.fields):
+            raise ExecuteError('ERROR 000012: %s already exists' % field_name)
+        dflt = lambda v, d: d if v in (None, '', '#') else v
+        f = Field(
+            str(field_name), ftype,
+            length=int(dflt(field_length, 0)) or None,
+            precision=int(dflt(field_precision, 0)),
+            scale=int(dflt(field_scale, 0)),
+            aliasName=dflt(field_alias, None),
+            isNullable=str(dflt(field_is_nullable, 'NULLABLE')).upper() != 'NON_NULLABLE',
+            required=str(dflt(field_is_required, 'NON_REQUIRED')).upper() == 'REQUIRED',
+            domain=dflt(field_domain, '')
+        )
+        with t.lock:
+            t.fields.append(f)
+            for row in t.rows.itervalues():
+                row.append(None)
+        return _Result(t.path)
+
+    def CreateFileGDB_management(self, out_folder_path, out_name, out_version=None):
+        self._call()
+        if not out_name.lower().endswith('.gdb'):
+            out_name += '.gdb'
+        path = os.path.join(str(out_folder_path), out_name)
+        if self._key(path) in self.workspaces:
+            raise ExecuteError('ERROR 000258: Output %s already exists' % path)
+        self.workspaces.add(self._key(path))
+        return _Result(path)
+
+    def Copy_management(self, in_data, out_data, data_type=None):
+        self._call()
+        t = self._table(in_data, ExecuteError)
+        if self._key(out_data) in self.tables and not self.env.overwriteOutput:
+            raise ExecuteError('ERROR 000258: Output %s already exists' % out_data)
+        out_data = self._path(out_data)
+        self.tables[self._key(out_data)] = t.copy(out_data)
+        return _Result(out_data)
+
+    def Delete_management(self, in_data, data_type=None):
+        self._call()
+        k = self._key(in_data)
+        if k in self.tables:
+            del self.tables[k]
+        elif self._is_workspace(in_data):
+            for t in [t for t in self.tables if os.path.dirname(t) == k]:
+                del self.tables[t]
+            self.workspaces.discard(k)
+        else:
+            raise ExecuteError('ERROR 000732: Input Data Element: Dataset %s does not exist or is not supported' % in_data)
+        return _Result(True)
@@ -0,0 +1,414 @@
+"""
+#-------------------------------------------------------------------------------
+# Name:        ArcpyFake_test
+# Purpose:     Tests for ArcpyFake module.
+#
+# Author:      Filip Kral, Caleb Mackey
+#
+# Created:     18/10/2026
+# Licence:     LGPL v3
+#-------------------------------------------------------------------------------
+# Unlike arcapi_test.py, these tests do not need arcpy nor testing data and
+# can run on any computer with Python 2.
+#
+# The last test case runs selected arcapi functions against ArcpyFake.
+#-------------------------------------------------------------------------------
+"""
+
+import os
+import time
+import unittest
+import arcapi as ap
+from ArcpyFake import ArcpyFake, ExecuteError
+
+
+def _pmap_probe(tbl):
+    """Function for pmap tests, must be picklable"""
+    if tbl is None:
+        raise ValueError('no table')
+    return (ap.nrow(tbl), ap.arcpy.env.workspace, ap.swsp())
+
+
+class TestArcpyFake(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = ArcpyFake()
+        self.t = 'in_memory\\t'
+        self.fake.CreateTable_management('in_memory', 't')
+        self.fake.AddField_management(self.t, 'ID', 'LONG')
+        self.fake.AddField_management(self.t, 'NAME', 'TEXT', '#', '#', 10)
+        self.fake.AddField_management(self.t, 'VAL', 'DOUBLE')
+        rows = [(1, 'eggs', 1.5), (2, 'spam', None), (3, "ham's", -2.0),
+                (4, 'eggs', 10.0), (5, None, 3.0)]
+        with self.fake.da.InsertCursor(self.t, ['ID', 'NAME', 'VAL']) as ic:
+            for r in rows:
+                ic.insertRow(r)
+
+    def ids(self, w=None, sql_clause=(None, None)):
+        with self.fake.da.SearchCursor(self.t, 'ID', w, sql_clause=sql_clause) as sc:
+            return [r[0] for r in sc]
+
+    def testSearchCursor(self):
+        with self.fake.da.SearchCursor(self.t, ['NAME', 'OID@']) as sc:
+            rows = list(sc)
+            fields = sc.fields
+        self.assertEqual(rows[0], (u'eggs', 1))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(fields, ('NAME', 'OID@'))
+        with self.fake.da.SearchCursor(self.t, '*') as sc:
+            self.assertEqual(sc.next(), (1, 1, u'eggs', 1.5))
+        self.assertRaises(RuntimeError, self.fake.da.SearchCursor, self.t, ['NOPE'])
+        self.assertRaises(RuntimeError, self.fake.da.SearchCursor, 'in_memory\\nope', ['ID'])
+        pass
+
+    def testWhereClause(self):
+        self.assertEqual(self.ids('ID > 2'), [3, 4, 5])
+        self.assertEqual(self.ids('"ID" <= 2 OR [VAL] < 0'), [1, 2, 3])
+        self.assertEqual(self.ids("NAME = 'eggs' AND NOT VAL > 5"), [1])
+        self.assertEqual(self.ids("NAME = 'ham''s'"), [3])
+        self.assertEqual(self.ids('VAL IS NULL'), [2])
+        self.assertEqual(self.ids('VAL IS NOT NULL AND NAME IS NOT NULL'), [1, 3, 4])
+        self.assertEqual(self.ids("NAME IN ('spam', 'ham''s')"), [2, 3])
+        self.assertEqual(self.ids("NAME NOT IN ('eggs')"), [2, 3])
+        self.assertEqual(self.ids("NAME LIKE 'e%'"), [1, 4])
+        self.assertEqual(self.ids("NAME NOT LIKE '_pam'"), [1, 3, 4])
+        self.assertEqual(self.ids('VAL BETWEEN -2.5 AND 1.5'), [1, 3])
+        self.assertEqual(self.ids("(ID = 1 OR ID = 4) AND (VAL > 2)"), [4])
+        self.assertEqual(self.ids("UPPER(NAME) = 'SPAM'"), [2])
+        # comparison with null is unknown, and so is its negation
+        self.assertEqual(self.ids('NOT VAL > 2'), [1, 3])
+        self.assertEqual(self.ids(''), [1, 2, 3, 4, 5])
+        self.assertRaises(RuntimeError, self.ids, 'ID >')
+        self.assertRaises(RuntimeError, self.ids, 'ID = 1 2')
+        pass
+
+    def testSqlClause(self):
+        self.assertEqual(self.ids(sql_clause=(None, 'ORDER BY VAL DESC')), [4, 5, 1, 3, 2])
+        self.assertEqual(self.ids(sql_clause=(None, 'ORDER BY "NAME", ID DESC')), [5, 4, 1, 3, 2])
+        self.assertEqual(self.ids(sql_clause=('TOP 2', 'ORDER BY ID DESC')), [5, 4])
+        with self.fake.da.SearchCursor(self.t, 'NAME', sql_clause=('DISTINCT', None)) as sc:
+            self.assertEqual(len(list(sc)), 4)
+        self.assertRaises(RuntimeError, self.ids, sql_clause=(None, 'GROUP BY ID'))
+        pass
+
+    def testUpdateCursor(self):
+        with self.fake.da.UpdateCursor(self.t, ['ID', 'VAL'], 'ID < 3') as uc:
+            for row in uc:
+                if row[0] == 1:
+                    row[1] = 100
+                    uc.updateRow(row)
+                else:
+                    uc.deleteRow()
+        self.assertEqual(self.ids('VAL = 100'), [1])
+        self.assertEqual(self.ids(), [1, 3, 4, 5])
+        with self.fake.da.UpdateCursor(self.t, ['NAME']) as uc:
+            row = uc.next()
+            row[0] = 'far too long a name'
+            self.assertRaises(RuntimeError, uc.updateRow, row)
+        pass
+
+    def testInsertCursor(self):
+        with self.fake.da.InsertCursor(self.t, ['ID', 'VAL']) as ic:
+            oid = ic.insertRow(('6', 7))
+            self.assertRaises(RuntimeError, ic.insertRow, ('x', 1))
+            self.assertRaises(RuntimeError, ic.insertRow, (1,))
+        self.assertEqual(oid, 6)
+        with self.fake.da.SearchCursor(self.t, ['ID', 'VAL', 'NAME'], 'OBJECTID = 6') as sc:
+            self.assertEqual(sc.next(), (6, 7.0, None))
+        pass
+
+    def testListFields(self):
+        flds = self.fake.ListFields(self.t)
+        self.assertEqual([f.name for f in flds], ['OBJECTID', 'ID', 'NAME', 'VAL'])
+        self.assertEqual([f.type for f in flds], ['OID', 'Integer', 'String', 'Double'])
+        self.assertEqual(flds[2].length, 10)
+        self.assertEqual(len(self.fake.ListFields(self.t, 'n*')), 1)
+        self.assertEqual(len(self.fake.ListFields(self.t, None, 'Double')), 1)
+        pass
+
+    def testDescribe(self):
+        d = self.fake.Describe(self.t)
+        self.assertEqual(d.OIDFieldName, 'OBJECTID')
+        self.assertEqual(d.catalogPath, os.path.join('in_memory', 't'))
+        self.assertEqual(d.baseName, 't')
+        self.assertEqual(d.dataType, 'Table')
+        self.assertEqual(self.fake.Describe('in_memory').dataType, 'Workspace')
+        self.assertRaises(IOError, self.fake.Describe, 'in_memory\\nope')
+        pass
+
+    def testGetCount(self):
+        self.assertEqual(int(self.fake.GetCount_management(self.t).getOutput(0)), 5)
+        self.assertEqual(int(self.fake.management.GetCount(self.t)[0]), 5)
+        pass
+
+    def testCopyDelete(self):
+        out = self.fake.management.Copy(self.t, 'in_memory\\t2').getOutput(0)
+        with self.fake.da.UpdateCursor(out, ['ID']) as uc:
+            for row in uc:
+                uc.deleteRow()
+        self.assertEqual(len(self.ids()), 5)
+        self.assertRaises(ExecuteError, self.fake.CreateTable_management, 'in_memory', 't2')
+        self.fake.Delete_management(out)
+        self.assertFalse(self.fake.Exists(out))
+        self.assertRaises(ExecuteError, self.fake.Delete_management, out)
+        pass
+
+    def testLatency(self):
+        self.fake.call_latency = 0.02
+        self.fake.row_latency = 0.01
+        t = time.time()
+        self.ids()
+        self.assertTrue(time.time() - t >= 0.02 + 5 * 0.01)
+        pass
+
+
+class TestArcapiOnFake(unittest.TestCase):
+
+    def setUp(self):
+        self.arcpy = ap.arcpy
+        ap.arcpy = self.fake = ArcpyFake()
+        self.t = ap.tlist_to_table(
+            [(1, 'a', 1.0), (2, 'b', None), (3, 'a', 2.0)],
+            'in_memory\\t', ['ID:LONG', 'CAT:TEXT:5', ('NUM', 'DOUBLE')]
+        )
+
+    def tearDown(self):
+        ap.arcpy = self.arcpy
+
+    def testtlist_to_table(self):
+        t = ap.tlist_to_table([(1, None, None), (None, 'b', 2.0)], 'in_memory\\t2',
+                              ['ID:LONG', 'CAT:TEXT', 'NUM:DOUBLE'], -1, 'NA')
+        self.assertEqual(ap.values(t, 'ID;CAT;NUM'), [(1, u'NA', -1.0), (-1, u'b', 2.0)])
+        pass
+
+    def testvalues(self):
+        self.assertEqual(ap.values(self.t, 'ID', 'NUM IS NOT NULL', 'ID DESC'), [3, 1])
+        self.assertEqual(ap.values(self.t, 'ID;CAT')[1], (2, u'b'))
+        pass
+
+    def testdistinct(self):
+        self.assertEqual(sorted(ap.distinct(self.t, 'CAT')), [u'a', u'b'])
+        pass
+
+    def testnrow(self):
+        self.assertEqual(ap.nrow(self.t), 3)
+        self.assertEqual(ap.names(self.t), ['OBJECTID', 'ID', 'CAT', 'NUM'])
+        pass
+
+    def testsummary(self):
+        s = ap.summary(self.t, ['NUM', 'CAT'], verbose=False)
+        self.assertEqual((s[0]['n'], s[0]['na'], s[0]['mean']), (2, 1, 1.5))
+        self.assertEqual(s[1]['cats'], {u'a': 2, u'b': 1})
+        pass
+
+    def testhead(self):
+        hd = ap.head(self.t, 2, verbose=False)
+        self.assertEqual(len(hd[0]), 2)
+        pass
+
+    def testupdate_col_from_dict(self):
+        n = ap.update_col_from_dict(self.t, {1: 10.0, 3: 30.0}, 'NUM', 'ID')
+        self.assertEqual(n, 3)
+        self.assertEqual(ap.values(self.t, 'NUM'), [10.0, None, 30.0])
+        pass
+
+    def testextension(self):
+        checkouts = []
+        checkout = self.fake.CheckOutExtension
+        self.fake.CheckOutExtension = lambda name: checkouts.append(name) or checkout(name)
+        with ap.extension('Spatial'):
+            for i in range(3):
+                with ap.extension('Spatial'):
+                    self.assertEqual(self.fake.checked_out, set(['Spatial']))
+        self.assertEqual(checkouts, ['Spatial'])
+        self.assertEqual(self.fake.checked_out, set())
+        with self.assertRaises(ap.ArcapiError):
+            with ap.extension('NoSuchExtension'):
+                pass
+        pass
+
+    def testscratch(self):
+        with ap.scratch() as s:
+            a = s.add(self.fake.management.Copy(self.t, 'in_memory\\a').getOutput(0))
+            b = s.add(self.fake.management.Copy(self.t, 'c:\\temp\\b').getOutput(0))
+            s.add('in_memory\\never_created')
+            ap._discard(self.fake.management.Copy(self.t, 'c:\\temp\\c').getOutput(0))
+            self.assertTrue(self.fake.Exists(a) and self.fake.Exists(b))
+            self.assertEqual(len(s.items), 4)
+        self.assertFalse(self.fake.Exists(a) or self.fake.Exists(b))
+        self.assertFalse(self.fake.Exists('c:\\temp\\c'))
+        self.assertEqual(s.failed, [])
+        self.assertTrue(self.fake.Exists(self.t))
+        # without a session, temporaries are deleted straight away
+        ap._discard(a)
+        ap._discard(self.fake.management.Copy(self.t, 'in_memory\\d').getOutput(0))
+        self.assertFalse(self.fake.Exists('in_memory\\d'))
+        pass
+
+    def testscratch_pool(self):
+        import shutil
+        import tempfile
+        folder = tempfile.mkdtemp()
+        self.fake.env.scratchWorkspace = None
+        try:
+            gdbs = ap.scratch_pool(folder, 2)
+            self.assertEqual(len(gdbs), 2)
+            self.assertTrue(all([self.fake.Exists(g) for g in gdbs]))
+            self.assertEqual(ap.to_scratch('foo'), os.path.join(gdbs[0], 'foo'))
+            self.assertEqual(ap.swsp(), gdbs[0])
+            # the geodatabase is locked for other processes
+            self.assertTrue(ap._pool_try_lock(os.path.join(folder, 'scratch_0.lock')) is None)
+            lock = ap._pool_try_lock(os.path.join(folder, 'scratch_1.lock'))
+            self.assertTrue(lock is not None)
+            lock.close()
+        finally:
+            ap.scratch_pool(None)
+            shutil.rmtree(folder, True)
+        pass
+
+    def testpmap(self):
+        import shutil
+        import tempfile
+        folder = tempfile.mkdtemp()
+        self.fake.env.workspace = 'in_memory'
+        try:
+            ret = ap.pmap(_pmap_probe, [self.t, None, self.t, self.t], 2, folder)
+            self.assertEqual([r[0] for r in ret], [self.t, None, self.t, self.t])
+            self.assertEqual(ret[1][1:], (None, 'no table'))
+            self.assertEqual([r[1][:2] for r in ret if r[2] is None], [(3, 'in_memory')] * 3)
+            for r in ret:
+                if r[2] is None:
+                    self.assertEqual(os.path.dirname(r[1][2]), folder)
+            self.assertFalse('ARCAPI_SCRATCH_POOL' in os.environ)
+            # the default pool lives only as long as pmap
+            ret = ap.pmap(_pmap_probe, [self.t, self.t], 2)
+            self.assertEqual([r[2] for r in ret], [None, None])
+            self.assertFalse(os.path.exists(os.path.dirname(ret[0][1][2])))
+            # serial run in this process
+            self.assertEqual(ap.pmap(ap.nrow, [self.t], 1), [(self.t, 3, None)])
+        finally:
+            shutil.rmtree(folder, True)
+        # settings are shipped to workers
+        self.fake.env.overwriteOutput = True
+        envs = ap._pmap_envs()
+        ap.arcpy = ArcpyFake()
+        ap._pmap_init(envs, False)
+        self.assertEqual((ap.arcpy.env.workspace, ap.arcpy.env.overwriteOutput), ('in_memory', True))
+        pass
+
+    def testscan_data(self):
+        import shutil
+        import tempfile
+        top = tempfile.mkdtemp()
+        cache = top + '.json'
+        for d in ('a', os.path.join('a', 'b'), 'c', 'g.gdb'):
+            os.mkdir(os.path.join(top, d))
+        for f in ('x.shp', 'x.dbf', 'y.dbf', 'notes.doc', os.path.join('a', 'r.tif'), os.path.join('a', 'b', 'z.csv')):
+            open(os.path.join(top, f), 'w').close()
+        self.fake.management.Copy(self.t, os.path.join(top, 'g.gdb', 'tab'))
+        walked = []
+        walk = self.fake.da.Walk
+        self.fake.da.Walk = lambda d, **kw: walked.append(d) or walk(d, **kw)
+        try:
+            obs = sorted(os.path.join(top, f) for f in (
+                'x.shp', 'y.dbf', os.path.join('g.gdb', 'tab'),
+                os.path.join('a', 'r.tif'), os.path.join('a', 'b', 'z.csv')))
+            self.assertEqual(sorted(ap.scan_data(top, cache, 4)), obs)
+            self.assertEqual(sorted(ap.list_data(top)), obs)
+            self.assertEqual(len(walked), 4 + 1)
+            # only the changed folder is walked again
+            del walked[:]
+            open(os.path.join(top, 'c', 'new.csv'), 'w').close()
+            est = list(ap.scan_data(top, cache, 4))
+            self.assertEqual(walked, [os.path.join(top, 'c')])
+            self.assertEqual(sorted(est), sorted(obs + [os.path.join(top, 'c', 'new.csv')]))
+            # options of list_data
+            found = []
+            est = list(ap.scan_data(top, cache, 1, exclude_dir=lambda d: d in ('b', 'g.gdb'),
+                                    skippers=['.SHP'], exclude=lambda a: a.endswith('new.csv'), oneach=found.append))
+            self.assertEqual(sorted(est), [os.path.join(top, 'a', 'r.tif'), os.path.join(top, 'y.dbf')])
+            self.assertEqual(found, est)
+        finally:
+            shutil.rmtree(top, True)
+            os.remove(cache)
+        pass
+
+    def testgdb_inventory(self):
+        import shutil
+        import tempfile
+        top = tempfile.mkdtemp()
+        gdbs = [os.path.join(top, 'a.gdb'), os.path.join(top, 'b.gdb')]
+        for g in gdbs:
+            os.mkdir(g)
+            for fc in ('roads', 'Rivers'):
+                self.fake.management.Copy(self.t, os.path.join(g, fc))
+        walked = []
+        walk = self.fake.da.Walk
+        self.fake.da.Walk = lambda d, **kw: walked.append(d) or walk(d, **kw)
+        self.fake.env.workspace = 'c:\\temp'
+        try:
+            est = ap.gdb_inventory(gdbs, 'r*')
+            self.assertEqual(est[gdbs[1]], [os.path.join(gdbs[1], 'Rivers'), os.path.join(gdbs[1], 'roads')])
+            self.assertEqual(ap.list_all_fcs(gdbs[0], 'ro*', rel=True), ['roads'])
+            self.assertEqual(self.fake.env.workspace, 'c:\\temp')
+            # list_all_fcs does not use the cache
+            self.assertEqual(sorted(walked), [gdbs[0]] + gdbs)
+            # cached until the geodatabase changes
+            self.fake.management.Copy(self.t, os.path.join(gdbs[0], 'lakes'))
+            self.assertEqual(ap.gdb_inventory(gdbs[0], rel=True), ['Rivers', 'roads'])
+            os.utime(gdbs[0], (time.time() + 10, time.time() + 10))
+            self.assertEqual(ap.gdb_inventory(gdbs[0], rel=True), ['Rivers', 'lakes', 'roads'])
+            self.assertEqual(len(walked), 4)
+        finally:
+            shutil.rmtree(top, True)
+        pass
+
+    def testcatalog_index(self):
+        import shutil
+        import tempfile
+        top = tempfile.mkdtemp()
+        db = top + '.sqlite'
+        gdb = os.path.join(top, 'a.gdb')
+        os.mkdir(gdb)
+        for name in ('t1', 't2'):
+            self.fake.management.Copy(self.t, os.path.join(gdb, name))
+        open(os.path.join(top, 'x.csv'), 'w').close()
+        try:
+            est = ap.catalog_index(top, db)
+            self.assertEqual(est, {'added': 3, 'updated': 0, 'removed': 0, 'unchanged': 0})
+            self.assertEqual(ap.catalog_with_field(db, 'cat'), [os.path.join(gdb, 't1'), os.path.join(gdb, 't2')])
+            self.assertEqual(ap.catalog_search(db, 'Table', min_rows=3, wild='*T2'), [os.path.join(gdb, 't2')])
+            self.assertEqual(ap.catalog_search(db, min_rows=4), [])
+            self.assertEqual(ap.catalog_index(top, db)['unchanged'], 3)
+            # a change of the geodatabase updates its datasets
+            self.fake.Delete_management(os.path.join(gdb, 't1'))
+            os.utime(gdb, (time.time() + 10, time.time() + 10))
+            est = ap.catalog_index(top, db)
+            self.assertEqual(est, {'added': 0, 'updated': 1, 'removed': 1, 'unchanged': 1})
+            self.assertEqual(ap.catalog_with_field(db, 'CAT'), [os.path.join(gdb, 't2')])
+            # _ is not a wildcard, * is one only on request
+            self.assertEqual(ap.catalog_with_field(db, 'C_T'), [])
+            self.assertEqual(ap.catalog_with_field(db, 'C*', True), [os.path.join(gdb, 't2')])
+            # an edit rewrites files inside the geodatabase, not the folder itself
+            table = os.path.join(gdb, 'a00000009.gdbtable')
+            open(table, 'w').close()
+            ap.catalog_index(top, db)
+            self.fake.AddField_management(os.path.join(gdb, 't2'), 'EDITED', 'LONG')
+            os.utime(table, (time.time() + 20, time.time() + 20))
+            est = ap.catalog_index(top, db)
+            self.assertEqual(est, {'added': 0, 'updated': 1, 'removed': 0, 'unchanged': 1})
+            self.assertEqual(ap.catalog_with_field(db, 'edited'), [os.path.join(gdb, 't2')])
+        finally:
+            shutil.rmtree(top, True)
+            os.remove(db)
+        pass
+
+    def testjoin_using_dict(self):
+        j = ap.tlist_to_table([(u'a', 'Alpha'), (u'b', 'Beta')], 'in_memory\\j', ['CAT:TEXT', 'LABEL:TEXT'])
+        ap.join_using_dict(self.t, 'CAT', j, 'CAT', ['LABEL'])
+        self.assertEqual(ap.values(self.t, 'LABEL'), [u'Alpha', u'Beta', u'Alpha'])
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity = 2)
@@ -34,7 +34,7 @@ class ArcpyMockup(ModuleType):
     available so that users without arcpy can still use
     arcapi functions that do not require arcpy.
     Calls to functions that require arcpy will print
-    a WARNING message.
+    a WARNING message, once for each function.
     """
     
     def __init__(self):
@@ -49,8 +49,12 @@ class ArcpyMockup(ModuleType):
         print m
 
     def __getattr__(self, key):
-        m = 'WARNING: Arcapi loaded without arcpy, %s not available' % key
-        print m
+        # warn only once about each missing function
+        warned = self.__dict__.setdefault('_warned', set())
+        if key not in warned:
+            warned.add(key)
+            m = 'WARNING: Arcapi loaded without arcpy, %s not available' % key
+            print m
         return None
     
     __all__ = []   # support wildcard imports
@@ -42,6 +42,13 @@
 # into this module when you download new version of arcapi. That way, you
 # can access all your python helper functions via a single package - arcapi.
 #
+# Importing arcpy
+# ---------------
+# Importing arcpy takes seconds and checks out a licence, so arcapi imports it
+# only when a function first needs it. Functions that do not use arcpy, like
+# find, tstamp, or request, can be used without waiting for arcpy at all.
+# If arcpy is not available, ArcpyMockup is used instead.
+#
 # ArcGIS Extensions modules
 # -------------------------
 # Some functions use extensions modules (e.g. Spatial Analyst's arcpy.sa).
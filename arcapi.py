@@ -19,19 +19,69 @@
 import os
 import sys
 import time
-import httplib
-import urllib
-import urllib2
-import json
-import urlparse
-from contextlib import closing
-import datetime
+import threading
+import itertools
+from contextlib import closing, contextmanager
+from types import ModuleType
 
-try:
-    import arcpy
-except ImportError:
-    from ArcpyMockup import ArcpyMockup
-    arcpy = ArcpyMockup()
+
+class _LazyModule(ModuleType):
+    """Module that gets imported by loader on first access to its attributes.
+
+    Once loaded, the _LazyModule in globals of arcapi is replaced by the loaded
+    module, so later access costs nothing.
+    """
+
+    def __init__(self, name, loader):
+        ModuleType.__init__(self, name)
+        self.__dict__['_lazy_loader'] = loader
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_lock'] = threading.Lock()
+
+    def _lazy_load(self):
+        d = self.__dict__
+        if d['_lazy_module'] is None:
+            with d['_lazy_lock']:
+                if d['_lazy_module'] is None:
+                    d['_lazy_module'] = d['_lazy_loader']()
+                    g = globals()
+                    if g.get(self.__name__, None) is self:
+                        g[self.__name__] = d['_lazy_module']
+        return d['_lazy_module']
+
+    def __getattr__(self, key):
+        return getattr(self._lazy_load(), key)
+
+    def __setattr__(self, key, value):
+        setattr(self._lazy_load(), key, value)
+
+    def __delattr__(self, key):
+        delattr(self._lazy_load(), key)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+
+def _resolved(m):
+    """Return m, or the module behind m if m is a loaded _LazyModule"""
+    if isinstance(m, _LazyModule) and m.__dict__['_lazy_module'] is not None:
+        return m.__dict__['_lazy_module']
+    return m
+
+
+def _import_arcpy():
+    """Import and return arcpy, or ArcpyMockup if arcpy is not available"""
+    try:
+        import arcpy
+    except ImportError:
+        from ArcpyMockup import ArcpyMockup
+        arcpy = ArcpyMockup()
+    return arcpy
+
+
+# arcpy takes seconds to import and checks out a licence, so it is imported
+# only when an arcapi function first needs it
+arcpy = _LazyModule('arcpy', _import_arcpy)
 
 
 __version__ = '0.3.0'
@@ -383,36 +433,37 @@ def chart(x, out_file='c:\\temp\\chart.jpg', texts={}, template=None, resolution
 
     mxd = arcpy.mapping.MapDocument(template)
     if not arcpy.Exists(x):
-        x = arcpy.CopyFeatures_management(x, arcpy.CreateScratchName('tmp', workspace = 'in_memory')).getOutput(0)
+        x = arcpy.CopyFeatures_management(x, os.path.join('in_memory', unique_name('tmp'))).getOutput(0)
         todel = [x]
     dtype = arcpy.Describe(x).dataType
     df = arcpy.mapping.ListDataFrames(mxd)[0]
 
-    lr = "chart" + tstamp(tf = "%H%M%S")
+    lr = unique_name("chart")
     if arcpy.Exists(lr) and arcpy.Describe(lr).dataType in ('FeatureLayer', 'RasterLayer'):
         arcpy.Delete_management(lr)
-    if "raster" in dtype.lower():
-        arcpy.MakeRasterLayer_management(x, lr)
-    else:
-        arcpy.MakeFeatureLayer_management(x, lr)
-
-    lyr = arcpy.mapping.Layer(lr)
-    arcpy.mapping.AddLayer(df, lyr)
+    try:
+        if "raster" in dtype.lower():
+            arcpy.MakeRasterLayer_management(x, lr)
+        else:
+            arcpy.MakeFeatureLayer_management(x, lr)
 
-    # try to update text elements if any requested:
-    for tel in texts.iterkeys():
-        try:
-            texel = arcpy.mapping.ListLayoutElements(mxd, "TEXT_ELEMENT", tel)[0]
-            texel.text = str(texts[tel])
-        except Exception, e:
-            arcpy.AddMessage("Error when updating text element " + str(tel) + ": "+ str(e))
-    arcpy.RefreshActiveView()
-    arcpy.mapping.ExportToJPEG(mxd, out_file, resolution=resolution)
+        lyr = arcpy.mapping.Layer(lr)
+        arcpy.mapping.AddLayer(df, lyr)
 
-    # cleanup
-    arcpy.Delete_management(lr)
-    del mxd
-    if todel: arcpy.Delete_management(todel[0])
+        # try to update text elements if any requested:
+        for tel in texts.iterkeys():
+            try:
+                texel = arcpy.mapping.ListLayoutElements(mxd, "TEXT_ELEMENT", tel)[0]
+                texel.text = str(texts[tel])
+            except Exception, e:
+                arcpy.AddMessage("Error when updating text element " + str(tel) + ": "+ str(e))
+        arcpy.RefreshActiveView()
+        arcpy.mapping.ExportToJPEG(mxd, out_file, resolution=resolution)
+    finally:
+        # cleanup, also if the export failed
+        del mxd
+        _discard(lr)
+        if todel: _discard(todel[0])
 
     # open the chart in a browser if requested
     if openit:
@@ -422,11 +473,169 @@ def chart(x, out_file='c:\\temp\\chart.jpg', texts={}, template=None, resolution
     return arcpy.Describe(out_file).catalogPath
 
 
-def plot(x, y=None, out_file="c:\\temp\\plot.png", main="Arcapi Plot", xlab="X", ylab="Y", pch="+", color="r", openit=True):
+def chart_many(datasets, out_dir, texts={}, template=None, resolution=95, zoom=True):
+    """Export a map (JPG) of each dataset in datasets into folder out_dir.
+
+    The map document template is opened only once. The first dataset is added
+    as a layer, for the following datasets the data source of the layer is
+    replaced (if the dataset is of the same kind, feature or raster, and its
+    workspace type is supported), otherwise the layer is replaced by a new one.
+    Output files are named by datasets' base names (suffixed by index if the
+    base name was already used), e.g. 'roads.jpg'. Text elements not given
+    by texts for a dataset keep their text from the template.
+
+    Returns a list of tuples (dataset, out_file, error) in the same order as
+    datasets, out_file is None and error is the error message if the export
+    of the dataset failed, otherwise error is None.
+
+    Required:
+    datasets -- iterable of feature classes or raster datasets
+    out_dir -- folder to save the jpg files in
+
+    Optional:
+    texts -- dict of strings to include in text elements on the map (by name),
+        or a function that takes a dataset and returns such dict,
+        default is {}
+    template -- path to the .mxd to be used, default None points to mxd with
+        a single text element called "txt"
+    resolution -- output resolution in DPI (dots per inch)
+    zoom -- if True (default), zoom to the extent of each dataset
+
+    Example:
+    >>> chart_many(['c:\\foo\\bar.shp', 'c:\\foo\\eggs.shp'], 'c:\\temp')
+    >>> chart_many(list_all_fcs('c:\\foo\\spam.gdb'), 'c:\\temp', lambda a: {'txt': a})
+    """
+    import re
+    if template is None: template = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'chart.mxd')
+    if not re.findall(".mxd", template, flags=re.IGNORECASE): template += ".mxd"
+
+    mxd = arcpy.mapping.MapDocument(template)
+    df = arcpy.mapping.ListDataFrames(mxd)[0]
+    textels = dict([(t.name, t) for t in arcpy.mapping.ListLayoutElements(mxd, "TEXT_ELEMENT")])
+    templtexts = dict([(n, t.text) for n, t in textels.iteritems()])
+    wstypes = {} # cache of workspace types by workspace path
+    used = set()
+    lyr, lyrkind = None, None
+    ret = []
+
+    for x in datasets:
+        try:
+            d = arcpy.Describe(x)
+            kind = 'raster' if 'raster' in d.dataType.lower() else 'feature'
+
+            # unique name of the output file
+            nm = base = re.sub("[^0-9a-zA-Z_]", "_", d.baseName)
+            k = len(ret)
+            while nm.lower() in used:
+                nm = base + "_" + str(k)
+                k += 1
+            used.add(nm.lower())
+            out_file = os.path.join(out_dir, nm + ".jpg")
+
+            # swap data source of the layer or replace the layer
+            swapped = False
+            if lyr is not None and kind == lyrkind:
+                ws, wstype = _workspace_of(d, wstypes)
+                if wstype is not None:
+                    dsname = d.baseName if wstype == 'SHAPEFILE_WORKSPACE' else d.name
+                    try:
+                        lyr.replaceDataSource(ws, wstype, dsname, True)
+                        swapped = True
+                    except Exception:
+                        pass
+            if not swapped:
+                if lyr is not None:
+                    arcpy.mapping.RemoveLayer(df, lyr)
+                arcpy.mapping.AddLayer(df, arcpy.mapping.Layer(d.catalogPath), "TOP")
+                lyr = arcpy.mapping.ListLayers(mxd, "", df)[0]
+                lyrkind = kind
+            if zoom:
+                df.extent = lyr.getExtent()
+
+            # update text elements
+            tx = texts(x) if callable(texts) else texts
+            for tel in tx:
+                if tel not in textels:
+                    arcpy.AddMessage("Text element " + str(tel) + " not found")
+            for tel, el in textels.iteritems():
+                # elements not given for this dataset get the template text back
+                txt = str(tx[tel]) if tel in tx else templtexts[tel]
+                if el.text != txt:
+                    el.text = txt
+
+            arcpy.mapping.ExportToJPEG(mxd, out_file, resolution=resolution)
+            ret.append((x, out_file, None))
+        except Exception, e:
+            ret.append((x, None, str(e)))
+
+    del lyr, df, mxd
+    return ret
+
+
+def _workspace_of(d, cache):
+    """Return tuple (workspace path, workspace type) of a described dataset d.
+
+    Workspace type is one of the workspace_type keywords of
+    arcpy.mapping.Layer.replaceDataSource, or None if not recognized.
+    Results are remembered by path and data type of d in the dictionary cache.
+    """
+    key = (d.path, d.dataType)
+    if key not in cache:
+        ws = d.path
+        wd = arcpy.Describe(ws)
+        if getattr(wd, 'dataType', '') == 'FeatureDataset':
+            ws = os.path.dirname(ws)
+            wd = arcpy.Describe(ws)
+        wtype = str(getattr(wd, 'workspaceType', '')).lower()
+        prog = str(getattr(wd, 'workspaceFactoryProgID', ''))
+        wstype = None
+        if wtype == 'filesystem':
+            if d.dataType.lower() == 'shapefile':
+                wstype = 'SHAPEFILE_WORKSPACE'
+            elif 'raster' in d.dataType.lower():
+                wstype = 'RASTER_WORKSPACE'
+        elif wtype == 'localdatabase':
+            if 'FileGDB' in prog:
+                wstype = 'FILEGDB_WORKSPACE'
+            elif 'AccessWorkspace' in prog:
+                wstype = 'ACCESS_WORKSPACE'
+        elif wtype == 'remotedatabase':
+            wstype = 'SDE_WORKSPACE'
+        cache[key] = (ws, wstype)
+    return cache[key]
+
+
+def _figure(**kwargs):
+    """Return a new matplotlib Figure attached to the non-interactive Agg canvas.
+
+    Figures created this way do not touch the global state of matplotlib.pyplot
+    so they are safe to use in loops and worker processes.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def plot(x, y=None, out_file="c:\\temp\\plot.png", main="Arcapi Plot", xlab="X", ylab="Y", pch="+", color="r", openit=True, maxpoints=100000, lod='density', gridsize=200):
     """
     Create and display a plot (PNG) showing x (and y).
 
-    Uses matplotlib.pyplot.scatter.
+    Draws on a matplotlib Figure with the non-interactive Agg canvas (see
+    _figure), so matplotlib.pyplot state is not touched and the function can
+    run in worker processes. Up to maxpoints points are drawn one by one by
+    Axes.scatter.
+
+    If there are more than maxpoints points, the plot is drawn in a level of
+    detail mode which renders a single rasterised image, so the time it takes
+    to draw and the size of the output do not depend on the number of points:
+        density -- points are binned into a gridsize x gridsize 2D histogram
+            and drawn as an image shaded from white to color by point counts
+        hexbin -- points are binned into hexagons (matplotlib hexbin)
+        decimate -- the extent is split into gridsize x gridsize cells and
+            only the first point in each cell is drawn as a scatter plot
+    Points with missing or infinite coordinates are not drawn in these modes.
 
     Required:
     x -- values to plot on x axis
@@ -447,6 +656,11 @@ def plot(x, y=None, out_file="c:\\temp\\plot.png", main="Arcapi Plot", xlab="X",
         +: plus sign, .: dot, o: circle, *: star, p: pentagon, s:square, x: X,
         D: diamond, h: hexagon, ^: triangle
     openit -- if True (default), exported figure is opened in a webbrowser
+    maxpoints -- maximum number of points to draw one by one, default is
+        100000, use None to always draw all points individually
+    lod -- level of detail mode for more than maxpoints points:
+        'density' (default)|'hexbin'|'decimate'
+    gridsize -- number of grid cells (or hexagons) in x direction, default 200
 
     Example:
     >>> x = xrange(20)
@@ -454,6 +668,8 @@ def plot(x, y=None, out_file="c:\\temp\\plot.png", main="Arcapi Plot", xlab="X",
     >>> plot(x, out_file='c:\\temp\\pic.png')
     >>> y = xrange(50,70)
     >>> plot(x, y, 'c:\\temp\\pic.png', 'Main', 'X [m]', 'Y [m]', 'o', 'k')
+    >>> xy = values('c:\\foo\\bar.shp', 'SHAPE@X;SHAPE@Y')
+    >>> plot(*zip(*xy), lod='hexbin', gridsize=100)
     """
     import re
     if not re.findall(".png", out_file, flags=re.IGNORECASE): out_file += ".png"
@@ -467,25 +683,77 @@ def plot(x, y=None, out_file="c:\\temp\\plot.png", main="Arcapi Plot", xlab="X",
     if lx != ly:
         raise ArcapiError('x and y have different length, %s and %s' % (lx, ly))
 
-    from matplotlib import pyplot as plt
-    plt.scatter(x, y, c=color, marker=pch)
-    plt.title(str(main))
-    plt.xlabel(str(xlab))
-    plt.ylabel(str(ylab))
-    plt.savefig(out_file)
-    plt.close()
+    lods = ('density', 'hexbin', 'decimate')
+    lod = str(lod).lower()
+    if lod not in lods:
+        raise ArcapiError("lod %s not in %s" % (lod, "|".join(lods)))
+
+    fig = _figure()
+    ax = fig.add_subplot(1, 1, 1)
+    if maxpoints is None or lx <= maxpoints:
+        ax.scatter(x, y, c=color, marker=pch)
+    else:
+        _plot_lod(ax, x, y, lod, int(gridsize), color, pch)
+    ax.set_title(str(main))
+    ax.set_xlabel(str(xlab))
+    ax.set_ylabel(str(ylab))
+    fig.savefig(out_file)
     if openit:
         import webbrowser
         webbrowser.open_new_tab("file://" + out_file)
     return
 
 
+def _plot_lod(ax, x, y, lod, gridsize, color, pch):
+    """Draw large number of points x, y on axes ax in level of detail mode lod.
+
+    See plot for description of the lod modes.
+    """
+    import numpy
+    from matplotlib.colors import LinearSegmentedColormap
+
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    ok = numpy.isfinite(x) & numpy.isfinite(y)
+    x, y = x[ok], y[ok]
+    if len(x) == 0:
+        return
+    cmap = LinearSegmentedColormap.from_list('arcapi_lod', ['white', color])
+
+    if lod == 'hexbin':
+        ax.hexbin(x, y, gridsize=gridsize, mincnt=1, cmap=cmap, rasterized=True)
+        return
+
+    xmin, xmax, ymin, ymax = x.min(), x.max(), y.min(), y.max()
+    if xmin == xmax:
+        xmin, xmax = xmin - 0.5, xmax + 0.5
+    if ymin == ymax:
+        ymin, ymax = ymin - 0.5, ymax + 0.5
+
+    if lod == 'density':
+        h = numpy.histogram2d(x, y, gridsize, [[xmin, xmax], [ymin, ymax]])[0]
+        h = numpy.ma.masked_equal(h, 0)
+        ax.imshow(h.T, origin='lower', extent=[xmin, xmax, ymin, ymax],
+            aspect='auto', interpolation='nearest', cmap=cmap)
+    else:
+        # decimate, keep the first point found in each grid cell
+        ix = ((x - xmin) / (xmax - xmin) * gridsize).astype(int)
+        iy = ((y - ymin) / (ymax - ymin) * gridsize).astype(int)
+        ix = numpy.minimum(ix, gridsize - 1)
+        iy = numpy.minimum(iy, gridsize - 1)
+        keep = numpy.unique(ix * gridsize + iy, return_index=True)[1]
+        ax.scatter(x[keep], y[keep], c=color, marker=pch, rasterized=True)
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+
+
 def hist(x, out_file='c:\\temp\\hist.png', openit=True, **args):
     """
     Create and display a plot (PNG) showing histogram of x and return computed
     histogram of values, breaks, and patches.
 
-    Uses matplotlib.pyplot.hist, for details see help(matplotlib.pyplot.hist).
+    Uses Axes.hist of a matplotlib Figure with the non-interactive Agg
+    canvas, for details see help(matplotlib.axes.Axes.hist).
     Draws an empty plot if x is empty.
 
     Required:
@@ -520,15 +788,15 @@ def hist(x, out_file='c:\\temp\\hist.png', openit=True, **args):
     >>> hist(x)
     >>> hist(x, bins=20, color='r', main='A Title", xlab='Example')
     """
-    import matplotlib.pyplot as plt
-
     # sort out parameters
     extras =  ('main', 'xlab', 'ylab')
     pars = dict([(k,v) for k,v in args.iteritems() if k not in extras])
 
-    h = plt.hist(x, **pars)
+    fig = _figure()
+    ax = fig.add_subplot(1, 1, 1)
+    h = ax.hist(x, **pars)
 
-    plt.title(str(args.get('main', 'Histogram')))
+    ax.set_title(str(args.get('main', 'Histogram')))
     xlab = str(args.get('xlab', 'Value'))
     ylab = 'Count'
     if args.get('Density', False):
@@ -539,16 +807,100 @@ def hist(x, out_file='c:\\temp\\hist.png', openit=True, **args):
         xlab = ylab
         ylab = lab
 
-    plt.xlabel(str(xlab))
-    plt.ylabel(str(ylab))
-    plt.savefig(out_file)
-    plt.close()
+    ax.set_xlabel(str(xlab))
+    ax.set_ylabel(str(ylab))
+    fig.savefig(out_file)
     if openit:
         import webbrowser
         webbrowser.open_new_tab("file://" + out_file)
     return h
 
 
+def hist_table(tbl, col, bins=10, w='', out_file='c:\\temp\\hist.png', openit=True, **args):
+    """
+    Create and display a plot (PNG) showing histogram of a numeric column col
+    in table tbl and return computed histogram of values, breaks, and patches.
+
+    Unlike hist, values are never all held in memory. Rows are read with
+    a search cursor in chunks and bin counts are accumulated chunk by chunk
+    with numpy.histogram, only the counts and bin edges are passed to hist.
+    Null values are ignored. If bins is an integer and neither range nor stats
+    are specified, the table is read twice, first to find the range of values.
+
+    Required:
+    tbl -- input table or table view
+    col -- name of a numeric column in tbl
+
+    Optional:
+    bins -- int number of equal-width bins or a sequence of bin edges
+        including the rightmost edge. Default is 10.
+    w -- where clause to limit the rows of tbl considered, default is ''
+    range -- (float, float), the lower and upper range of the bins, values
+        outside the range are ignored; default is (min(col), max(col))
+    stats -- dictionary with keys 'min' and 'max', for example one item from
+        the output of summary, to be used as range without reading the table
+    chunk -- number of rows read and counted at once, default is 100000
+    out_file -- path to output file, default is 'c:\\temp\\hist.png'
+    openit -- if True (default), exported figure is opened in a webbrowser
+    other keyword arguments are passed to hist (main, xlab, color, log, etc.)
+
+    Example:
+    >>> hist_table('c:\\foo\\bar.shp', 'POP_EST')
+    >>> hist_table('c:\\foo\\bar.shp', 'POP_EST', 20, '"POP_EST" > 0', main='Population')
+    >>> st = summary('c:\\foo\\bar.shp', ['POP_EST'], verbose=False)
+    >>> hist_table('c:\\foo\\bar.shp', 'POP_EST', stats=st[0], openit=False)
+    """
+    import numbers
+    import numpy
+
+    rng = args.pop('range', None)
+    stats = args.pop('stats', None)
+    chunk = int(args.pop('chunk', 100000))
+
+    # sort out bin edges, find range of values if necessary
+    if isinstance(bins, numbers.Integral):
+        if rng is None and stats is not None:
+            rng = (stats.get('min', None), stats.get('max', None))
+            if None in rng:
+                rng = None
+        if rng is None:
+            lo, hi = None, None
+            for a in _column_chunks(tbl, col, w, chunk):
+                if len(a) > 0:
+                    amin, amax = a.min(), a.max()
+                    lo = amin if lo is None else min(lo, amin)
+                    hi = amax if hi is None else max(hi, amax)
+            rng = (0.0, 1.0) if lo is None else (lo, hi)
+        lo, hi = float(rng[0]), float(rng[1])
+        if lo == hi:
+            lo, hi = lo - 0.5, hi + 0.5
+        edges = numpy.linspace(lo, hi, int(bins) + 1)
+    else:
+        edges = numpy.asarray(bins, dtype=float)
+
+    # accumulate counts
+    counts = numpy.zeros(len(edges) - 1)
+    for a in _column_chunks(tbl, col, w, chunk):
+        counts += numpy.histogram(a, edges)[0]
+
+    args['bins'] = edges
+    args['weights'] = counts
+    return hist(edges[:-1], out_file, openit, **args)
+
+
+def _column_chunks(tbl, col, w='', chunk=100000):
+    """Yield non-null values of column col in table tbl as numpy float arrays
+    of at most chunk elements.
+    """
+    import numpy
+    with arcpy.da.SearchCursor(tbl, [col], where_clause = w) as sc:
+        while True:
+            rows = list(itertools.islice(sc, chunk))
+            if not rows:
+                break
+            yield numpy.fromiter((r[0] for r in rows if r[0] is not None), float)
+
+
 def bars(x, out_file='c:\\temp\\hist.png', openit=True, **args):
     """
     Create and display a plot (PNG) showing barchart of x.
@@ -588,9 +940,6 @@ def bars(x, out_file='c:\\temp\\hist.png', openit=True, **args):
     >>> bars(x)
     >>> bars(x, labels=lb, color='r', main='A Title', orientation='vertical')
     """
-    import matplotlib.pyplot as plt
-    import numpy
-
     width = 1.0
     # unpack arguments
     bpars = ['width', 'color', 'edgecolor', 'linewidth', 'xerr', 'yerr',
@@ -602,7 +951,8 @@ def bars(x, out_file='c:\\temp\\hist.png', openit=True, **args):
     barpars['width'] = width
     orientation = barpars.get('orientation', 'vertical')
 
-    fig, ax = plt.subplots()
+    fig = _figure()
+    ax = fig.add_subplot(1, 1, 1)
     fig.canvas.draw()
 
     # the orientation parameter seems to have no effect on pyplot.bar, therefore
@@ -610,9 +960,9 @@ def bars(x, out_file='c:\\temp\\hist.png', openit=True, **args):
     if orientation == 'horizontal':
         a = barpars.pop('width', None)
         a = barpars.pop('orientation', None)
-        plt.barh(center, x, **barpars)
+        ax.barh(center, x, **barpars)
     else:
-        plt.bar(center, x, **barpars)
+        ax.bar(center, x, **barpars)
 
     xlab = str(args.get('xlab', 'Item'))
     ylab = str(args.get('ylab', 'Value'))
@@ -629,8 +979,7 @@ def bars(x, out_file='c:\\temp\\hist.png', openit=True, **args):
     ax.set_xlabel(xlab)
     ax.set_ylabel(str(ylab))
     ax.set_title(str(args.get('main', 'Barplot')))
-    plt.savefig(out_file)
-    plt.close()
+    fig.savefig(out_file)
     if openit:
         import webbrowser
         webbrowser.open_new_tab("file://" + out_file)
@@ -642,7 +991,8 @@ def pie(x, y=None, **kwargs):
     """
     Create and display a plot (PNG) showing pie chart of x.
 
-    Uses matplotlib.pyplot.pie, draws an empty plot if x is empty.
+    Uses Axes.pie of a matplotlib Figure with the non-interactive Agg canvas,
+    draws an empty plot if x is empty.
     The fractional area of each wedge is given by x/sum(x).  If sum(x) <= 1,
     then the values of x will be used as the fractional area directly.
 
@@ -679,8 +1029,6 @@ def pie(x, y=None, **kwargs):
     >>> pie([1,2,3,4,5,6,7], y=[1,1,2,2,3,3,3], autopct='%1.1f%%')
     >>> pie([1,2,3,4,5,6], y=[(1,'a'),(1,'a'),2,2,'b','b'], autopct='%1.1f%%')
     """
-    import matplotlib.pyplot as plt
-
     # unpack arguments
     #y = kwargs.get('y', None) # more convenient to get as a named argument
     out_file =kwargs.get('out_file', 'c:\\temp\\hist.png')
@@ -744,9 +1092,9 @@ def pie(x, y=None, **kwargs):
         else:
             colors = [colors] * n
 
-    plt.figure(1)
-    plt.subplot(1,1,1)
-    pieresult = plt.pie(
+    fig = _figure()
+    ax = fig.add_subplot(1, 1, 1)
+    pieresult = ax.pie(
         x,
         explode=explode,
         labels=labels,
@@ -761,22 +1109,21 @@ def pie(x, y=None, **kwargs):
 
     # add title
     if main is not None:
-        plt.title(main, bbox=mainbox)
+        ax.set_title(main, bbox=mainbox)
 
     # add legend
     if legend:
         if labels is None:
             labels = map(str, x)
-            plt.legend(patches, labels, loc=legloc)
+            ax.legend(patches, labels, loc=legloc)
 
     # make output square and tight
-    plt.axis('equal')
+    ax.axis('equal')
     if tight:
-        plt.tight_layout()
+        fig.tight_layout()
 
     # save and display
-    plt.savefig(out_file)
-    plt.close()
+    fig.savefig(out_file)
     if openit:
         import webbrowser
         webbrowser.open_new_tab("file://" + out_file)
@@ -784,6 +1131,75 @@ def pie(x, y=None, **kwargs):
     return
 
 
+def plot_many(specs, workers=None, chunksize=1):
+    """Render many charts in a pool of processes and return their outcomes.
+
+    Each chart is described by a dictionary (spec) with the key 'kind', which
+    is one of 'plot'|'hist'|'bars'|'pie', the key 'x' with the input data,
+    and any other keyword arguments accepted by the respective function,
+    for example 'out_file', 'main', or 'bins'.
+    Charts are drawn on explicit Agg figures (no matplotlib.pyplot state) and
+    are never opened in a webbrowser. Specs must be picklable to be sent to
+    the worker processes.
+
+    Returns a list of tuples (out_file, error) in the same order as specs,
+    where error is None if the chart was rendered, otherwise error message.
+
+    On Windows, call this function from within if __name__ == '__main__':
+
+    Required:
+    specs -- list (or other iterable) of dictionaries describing the charts
+
+    Optional:
+    workers -- number of worker processes, default is None for cpu count,
+        0 or 1 renders all charts in the current process
+    chunksize -- number of specs sent to a worker at once, default is 1
+
+    Example:
+    >>> specs = [
+    ...     {'kind': 'hist', 'x': [1,2,2,3], 'out_file': 'c:\\temp\\h.png'},
+    ...     {'kind': 'pie', 'x': [1,2,3], 'out_file': 'c:\\temp\\p.png'}
+    ... ]
+    >>> plot_many(specs, 4) # [('c:\\temp\\h.png', None), ('c:\\temp\\p.png', None)]
+    """
+    import multiprocessing
+
+    specs = list(specs)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(int(workers), len(specs))
+
+    if workers <= 1:
+        return [_plot_one(spec) for spec in specs]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        ret = pool.map(_plot_one, specs, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+    return ret
+
+
+def _plot_one(spec):
+    """Render one chart spec for plot_many, return tuple (out_file, error)."""
+    spec = dict(spec)
+    kind = str(spec.pop('kind', 'plot')).lower()
+    out_file = spec.get('out_file', None)
+    plotters = {'plot': plot, 'hist': hist, 'bars': bars, 'pie': pie}
+    try:
+        if kind not in plotters:
+            raise ArcapiError("kind %s not in 'plot'|'hist'|'bars'|'pie'" % kind)
+        if out_file is None:
+            raise ArcapiError("out_file must be specified for each chart")
+        x = spec.pop('x')
+        spec['openit'] = False
+        plotters[kind](x, **spec)
+    except Exception, e:
+        return (out_file, str(e))
+    return (out_file, None)
+
+
 def rename_col(tbl, col, newcol, alias = ''):
     """Rename column in table tbl and return the new name of the column.
 
@@ -847,21 +1263,34 @@ def tlist_to_table(x, out_tbl, cols, nullNumber=None, nullText=None):
     """
     # decode column names, types, and lengths
     cols = [tuple(c.split(":")) if type(c) not in (tuple, list) else c for c in cols]
-    # remember what indexes to replace if values are null
-    replaceNumbers, replacesText = [], []
+    # remember what to put instead of null values at each index
+    nulls = {}
     for i in range(len(cols)):
         if cols[i][1].upper() in ('TEXT', 'STRING'):
-            replacesText.append(i)
-        else:
-            replaceNumbers.append(i)
+            if nullText is not None:
+                nulls[i] = nullText
+        elif nullNumber is not None:
+            nulls[i] = nullNumber
+
+    out_tbl = _create_table(out_tbl, cols)
+    # rewrite all tuples
+    fields = [c[0] for c in cols]
+    _insert_rows(out_tbl, fields, x, nulls)
+    return out_tbl
 
-    doReplaceNumber = False if nullNumber is None else True
-    doReplaceText = False if nullText is None else True
-    doReplace = doReplaceNumber or doReplaceText
 
+def _create_table(out_tbl, cols, geometry_type=None, sr=None):
+    """Create table (or feature class if geometry_type is given) with columns cols.
+
+    Columns are tuples (name, type) or (name, type, length) as in
+    tlist_to_table. Returns catalog path to the new table.
+    """
     dname = os.path.dirname(out_tbl)
     if dname in('', u''): dname = arcpy.env.workspace
-    r = arcpy.CreateTable_management(dname, os.path.basename(out_tbl))
+    if geometry_type is None:
+        r = arcpy.CreateTable_management(dname, os.path.basename(out_tbl))
+    else:
+        r = arcpy.CreateFeatureclass_management(dname, os.path.basename(out_tbl), geometry_type, spatial_reference=sr)
     out_tbl = r.getOutput(0)
     # add the specified fields
     for f in cols:
@@ -871,22 +1300,33 @@ def tlist_to_table(x, out_tbl, cols, nullNumber=None, nullText=None):
         if len(f) > 2:
             flength = int(f[2]) if str(f[2]).isdigit() else '#'
         arcpy.AddField_management(out_tbl, fname, ftype, '#', '#', flength)
-    # rewrite all tuples
-    fields = [c[0] for c in cols]
+    return out_tbl
 
-    with arcpy.da.InsertCursor(out_tbl, fields) as ic:
-        for rw in x:
-            if doReplace:
-                rw = list(rw)
-                if i in replaceNumbers:
-                    if rw[i] is None:
-                        rw[i] = nullNumber
-                if i in replacesText:
-                    if rw[i] is None:
-                        rw[i] = nullText
-                rw = tuple(rw)
+
+def _insert_rows(tbl, fields, rows, nulls=None, ic=None):
+    """Insert rows into fields of tbl, return number of rows inserted.
+
+    Values None at index i are replaced by nulls[i] if nulls has key i.
+    Rows are written by insert cursor ic if given, otherwise by a new one.
+    """
+    if ic is None:
+        with arcpy.da.InsertCursor(tbl, fields) as ic:
+            return _insert_rows(tbl, fields, rows, nulls, ic)
+    n = 0
+    if nulls:
+        nulls = nulls.items()
+        for rw in rows:
+            rw = list(rw)
+            for i, v in nulls:
+                if rw[i] is None:
+                    rw[i] = v
             ic.insertRow(rw)
-    return out_tbl
+            n += 1
+    else:
+        for rw in rows:
+            ic.insertRow(rw)
+            n += 1
+    return n
 
 
 def docu(x, n = None):
@@ -1063,6 +1503,11 @@ def msg(x, timef='%Y-%m-%d %H:%M:%S', verbose=True, log=None, level='message'):
 
     If log file does not exist, it is created, otherwise message is appended.
 
+    If a background logger was started by start_logger, the message is only
+    put on the logger's queue and printed and written by the logger's thread.
+    If the logger is stopping, or was inherited by a forked process without
+    its thread, the message is printed and written directly.
+
     Required:
     x -- content of the message
 
@@ -1080,6 +1525,25 @@ def msg(x, timef='%Y-%m-%d %H:%M:%S', verbose=True, log=None, level='message'):
     x = str(x)
     level = str(level).lower()
     doexit = False
+
+    logger = _logger
+    if logger is not None:
+        lvl = _msg_levels.get(level, level)
+        if verbose and lvl not in ('message', 'warning', 'error'):
+            em = "Level %s not in 'message'|'warning'|'error'|0|1|2." % (lvl)
+            raise ArcapiError(em)
+        if logger.put((time.time(), x, timef, verbose, log, lvl)):
+            if lvl == 'error':
+                # errors are written before msg returns, even if not printed
+                logger.flush()
+                if verbose:
+                    try: sys.exit()
+                    except: pass
+            return
+        # the logger is not running in this process, write directly
+        if log in ("", None):
+            log = logger.log
+
     tstamp = time.strftime(timef, time.localtime())
     if verbose:
         m = tstamp + ": " + x
@@ -1106,6 +1570,222 @@ def msg(x, timef='%Y-%m-%d %H:%M:%S', verbose=True, log=None, level='message'):
         except: pass
 
 
+_logger = None
+"""Background logger used by msg, see start_logger"""
+
+_msg_levels = {'0': 'message', '1': 'warning', '2': 'error'}
+
+
+def start_logger(log=None, maxbytes=0, backups=3, jsonl=False, batch=1000):
+    """Start a background logger thread behind the msg function.
+
+    Once started, msg only puts messages on a queue and returns. A background
+    thread formats the time stamps, prints the messages, calls arcpy.AddMessage
+    (AddWarning, AddError), and appends the messages to log files in batches.
+    Error level messages are flushed before msg returns. The logger is flushed
+    and stopped by stop_logger, which is also called when Python exits.
+    Starting a new logger stops the running one.
+
+    Optional:
+    log -- file to write messages to if msg is called without log parameter,
+        default is None, i.e. such messages are not written to any file
+    maxbytes -- if greater than 0 (default), a log file is rotated before it
+        would grow over maxbytes bytes: log.1 becomes log.2 and so on,
+        log becomes log.1, and a new log is started
+    backups -- number of rotated log files to keep, default is 3
+    jsonl -- if True, messages are written as JSON lines with keys time,
+        level, and msg, otherwise as text lines like msg does (default)
+    batch -- maximum number of messages handled by the thread at once
+
+    Example:
+    >>> start_logger('c:\\temp\\log.txt', 10 * 1024**2, 5)
+    >>> for i in xrange(100000): msg(i, verbose=False) # written to log.txt
+    >>> stop_logger()
+    """
+    global _logger
+    import atexit
+    stop_logger()
+    _logger = _Logger(log, maxbytes, backups, jsonl, batch)
+    _logger.start()
+    if not getattr(start_logger, 'atexit', False):
+        atexit.register(stop_logger)
+        start_logger.atexit = True
+    return
+
+
+def stop_logger():
+    """Flush and stop the background logger started by start_logger.
+
+    Messages are written directly by msg again after this function returns.
+    Does nothing if no logger is running.
+    """
+    global _logger
+    logger = _logger
+    _logger = None
+    if logger is not None:
+        logger.stop()
+    return
+
+
+class _Logger(object):
+    """Queue of messages from msg and a thread that writes them, see start_logger"""
+
+    def __init__(self, log, maxbytes, backups, jsonl, batch):
+        import threading
+        import Queue
+        self.pid = os.getpid() # forked processes inherit the logger but not its thread
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.log = log
+        self.maxbytes = int(maxbytes)
+        self.backups = int(backups)
+        self.jsonl = jsonl
+        self.batch = max(1, int(batch))
+        self.queue = Queue.Queue()
+        self.files = {} # open log files by path
+        self.sizes = {} # sizes of log files by path
+        self.stamps = {} # last formatted time stamp by time format
+        self.thread = threading.Thread(target=self.run, name='arcapi_logger')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def alive(self):
+        """Return True if the thread of the logger runs in this process"""
+        return self.pid == os.getpid() and self.thread.is_alive()
+
+    def put(self, record):
+        """Queue record and return True, or return False if the logger is not running"""
+        if self.pid != os.getpid():
+            return False
+        with self.lock:
+            # records are never queued after the stop sentinel
+            if self.stopped or not self.thread.is_alive():
+                return False
+            self.queue.put(record)
+        return True
+
+    def flush(self, timeout=10):
+        """Wait until all queued messages are written, at most timeout seconds.
+
+        Returns False if messages are still queued.
+        """
+        end = time.time() + timeout
+        done = self.queue.all_tasks_done
+        with done:
+            while self.queue.unfinished_tasks:
+                left = end - time.time()
+                if left <= 0 or not self.alive():
+                    return False
+                done.wait(min(left, 0.1))
+        return True
+
+    def stop(self):
+        if self.pid != os.getpid():
+            return
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        import Queue
+        stop = False
+        while not stop:
+            records = [self.queue.get()]
+            try:
+                while len(records) < self.batch:
+                    records.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            if None in records:
+                stop = True
+                records = [r for r in records if r is not None]
+            try:
+                self.write(records)
+            except Exception, e:
+                sys.stderr.write("arcapi logger failed: %s\n" % str(e))
+            for i in range(len(records) + (1 if stop else 0)):
+                self.queue.task_done()
+        for fl in self.files.itervalues():
+            fl.close()
+        self.files = {}
+
+    def stamp(self, t, timef):
+        """Format time t by timef, formatting only once per second"""
+        sec = int(t)
+        last = self.stamps.get(timef, None)
+        if last is None or last[0] != sec:
+            last = (sec, time.strftime(timef, time.localtime(sec)))
+            self.stamps[timef] = last
+        return last[1]
+
+    def write(self, records):
+        lines = {} # lines to write by log file
+        for t, x, timef, verbose, log, level in records:
+            tstamp = self.stamp(t, timef)
+            if verbose:
+                m = tstamp + ": " + x
+                if level == 'message':
+                    print("P:" + m)
+                    arcpy.AddMessage("T:" + m)
+                elif level == 'warning':
+                    print("W:" + m)
+                    arcpy.AddWarning("T:" + m)
+                elif level == 'error':
+                    print("E:" + m)
+                    arcpy.AddError("T:" + m)
+            if log in ("", None):
+                log = self.log
+            if log not in ("", None):
+                if self.jsonl:
+                    import json
+                    ln = json.dumps({'time': tstamp, 'level': level, 'msg': x})
+                else:
+                    ln = "P:" + tstamp + ": " + x
+                lines.setdefault(log, []).append(ln + "\n")
+        for log, lns in lines.iteritems():
+            self.append(log, lns)
+
+    def append(self, log, lns):
+        """Append lines lns to log file, rotate the file when it gets full"""
+        if log not in self.files:
+            self.files[log] = open(log, "a")
+            self.sizes[log] = os.path.getsize(log)
+        chunk, size = [], self.sizes[log]
+        for ln in lns:
+            if self.maxbytes > 0 and size > 0 and size + len(ln) > self.maxbytes:
+                self.files[log].write("".join(chunk))
+                self.rotate(log)
+                chunk, size = [], 0
+            chunk.append(ln)
+            size += len(ln)
+        self.files[log].write("".join(chunk))
+        self.files[log].flush()
+        self.sizes[log] = size
+
+    def rotate(self, log):
+        """Close log file, shift its backups, and open a new one"""
+        self.files[log].close()
+        for i in range(self.backups - 1, 0, -1):
+            src = "%s.%s" % (log, i)
+            if os.path.exists(src):
+                dst = "%s.%s" % (log, i + 1)
+                if os.path.exists(dst):
+                    os.remove(dst)
+                os.rename(src, dst)
+        if self.backups > 0:
+            if os.path.exists(log + ".1"):
+                os.remove(log + ".1")
+            os.rename(log, log + ".1")
+        else:
+            os.remove(log)
+        self.files[log] = open(log, "a")
+
+
 def list_environments(x=[], printit=False):
     """Return a list of 2-tuples of all arcgis environments.
 
@@ -1166,6 +1846,40 @@ def tstamp(p = "", tf="%Y%m%d%H%M%S", d="_", m=False, s=()):
     return stamp
 
 
+_unique_counter = itertools.count(1)
+
+_unique_host = None
+
+
+def unique_name(prefix='tmp', suffix=''):
+    """Return a name that is unique across threads, processes, and computers.
+
+    The name is prefix, computer name (letters and digits only), process id,
+    and a counter joined by underscores, followed by suffix. Unlike names
+    from tstamp, names created within one second or by parallel workers
+    writing to shared storage do not collide, and unlike CreateScratchName,
+    no workspace needs to be checked. The name is a valid geodatabase
+    name if prefix starts with a letter, but may be too long for shapefiles,
+    dBase tables, or Esri GRID rasters.
+
+    Optional:
+    prefix -- prefix of the name, default is 'tmp'
+    suffix -- suffix of the name like '.shp', default is ''
+
+    Example:
+    >>> unique_name() # 'tmp_mypc_4242_1'
+    >>> unique_name('lr') # 'lr_mypc_4242_2'
+    >>> os.path.join('in_memory', unique_name('sums')) # 'in_memory\\sums_mypc_4242_3'
+    """
+    global _unique_host
+    if _unique_host is None:
+        import re
+        import socket
+        _unique_host = re.sub('[^0-9a-z]', '', socket.gethostname().lower())[:15]
+    bits = [str(prefix), _unique_host, str(os.getpid()), str(next(_unique_counter))]
+    return '_'.join(b for b in bits if b) + str(suffix)
+
+
 def dlt(x):
     """arcpy.Delete_management(x) if arcpy.Exists(x).
 
@@ -1209,6 +1923,121 @@ def cleanup(x, verbose=False, **args):
     return cnt
 
 
+_scratch_local = threading.local()
+"""Stack of active scratch sessions of each thread"""
+
+def _discard(x):
+    """Delete temporary x, or leave it to the active scratch session if any"""
+    stack = getattr(_scratch_local, 'stack', None)
+    if stack:
+        stack[-1].add(x)
+    else:
+        dlt(x)
+
+
+class _ScratchSession(object):
+    """Temporary datasets and layers recorded by scratch"""
+
+    def __init__(self):
+        self.items = []
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def add(self, x):
+        """Record x for deletion at the end of the session and return x"""
+        with self.lock:
+            self.items.append(x)
+        return x
+
+    def cleanup(self, workers=4, verbose=False):
+        """Delete recorded items, return list of items that could not be deleted.
+
+        Items without a workspace (layers and table views) are deleted first,
+        one by one in reverse order of recording, so that they release locks
+        on their data sources. The other items are then grouped by workspace.
+        Groups are deleted in parallel threads, items within a group one by one
+        in reverse order of recording.
+        """
+        with self.lock:
+            items, self.items = self.items, []
+        layers, groups = [], {}
+        for x in items:
+            key = os.path.dirname(str(x)).lower()
+            if key == '':
+                layers.append(x)
+            else:
+                groups.setdefault(key, []).append(x)
+        failed_layers = _delete_group(layers)
+        groups = groups.values()
+        if workers > 1 and len(groups) > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(workers, len(groups)))
+            try:
+                failed = pool.map(_delete_group, groups)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            failed = map(_delete_group, groups)
+        failed = failed_layers + [x for f in failed for x in f]
+        self.failed.extend(failed)
+        for x in failed:
+            msg("Scratch could not delete " + str(x), verbose=verbose)
+        return failed
+
+
+def _delete_group(items):
+    """Delete items, return list of items which exist but could not be deleted"""
+    failed = []
+    for x in reversed(items):
+        try:
+            # delete straight away, Exists is only needed if that fails
+            arcpy.Delete_management(x)
+        except Exception:
+            try:
+                if arcpy.Exists(x):
+                    failed.append(x)
+            except Exception:
+                failed.append(x)
+    return failed
+
+
+@contextmanager
+def scratch(workers=4, verbose=False):
+    """Record temporaries created within a with block and delete them at its end.
+
+    Temporary datasets and layers that arcapi functions create (for example in
+    fill_no_data, create_pie_chart, to_points, or chart) are not deleted after
+    each call but recorded by the session. Add your own temporaries with
+    session.add(x), which returns x. When the block exits, even because of an
+    exception, all recorded items are deleted in one batch: layers and table
+    views first, then the other items grouped by workspace, with the groups
+    deleted in parallel threads. Items that
+    could not be deleted are listed in session.failed. Sessions can be nested,
+    temporaries go to the innermost session of the current thread.
+
+    Optional:
+    workers -- maximum number of threads deleting items, default is 4
+    verbose -- print a message for each item that could not be deleted
+
+    Example:
+    >>> with scratch() as s:
+    ...     tmp = s.add(arcpy.CopyFeatures_management(fc, r'in_memory\\tmp').getOutput(0))
+    ...     to_points('c:\\foo\\bar.dbf', 'c:\\foo\\pts.shp', 'X', 'Y', 4326)
+    >>> s.failed # []
+    """
+    session = _ScratchSession()
+    stack = getattr(_scratch_local, 'stack', None)
+    if stack is None:
+        stack = _scratch_local.stack = []
+    stack.append(session)
+    try:
+        yield session
+    finally:
+        stack.remove(session)
+        session.cleanup(workers, verbose)
+
+
 def to_points(tbl, out_fc, xcol, ycol, sr, zcol='#', w=''):
     """Convert table to point feature class, return path to the feature class.
 
@@ -1231,14 +2060,15 @@ def to_points(tbl, out_fc, xcol, ycol, sr, zcol='#', w=''):
     >>> table_to_points(t, o, "XC", "YC", arcpy.SpatialReference(27700))
     >>> table_to_points(t, o, "XC", "YC", arcpy.describe(tbl).spatialReference)
     """
-    lrnm = tstamp('lr', '%m%d%H%M%S', '')
-    if type(sr) != arcpy.SpatialReference:
-        sr = arcpy.SpatialReference(sr)
+    lrnm = unique_name('lr')
+    sr = _spatial_reference(sr)
     lr = arcpy.MakeXYEventLayer_management(tbl, xcol, ycol, lrnm, sr, zcol).getOutput(0)
-    if str(w) not in ('', '*'):
-        arcpy.SelectLayerByAttribute_management(lr, "NEW_SELECTION", w)
-    out_fc = arcpy.CopyFeatures_management(lr, out_fc).getOutput(0)
-    dlt(lr)
+    try:
+        if str(w) not in ('', '*'):
+            arcpy.SelectLayerByAttribute_management(lr, "NEW_SELECTION", w)
+        out_fc = arcpy.CopyFeatures_management(lr, out_fc).getOutput(0)
+    finally:
+        _discard(lr)
     return (arcpy.Describe(out_fc).catalogPath)
 
 
@@ -1316,7 +2146,8 @@ def to_scratch(name, enforce=False):
     LIMITATION: Reliable for geodatabases only! Does not handle extensions.
 
     Returns os.path.join(arcpy.env.scratchWorkspace, name).
-    If scratchWorkspace is None, it tries workspace, then scratchGDB.
+    If scratchWorkspace is None, it tries geodatabase of this process from
+    the scratch_pool if the pool is used, then workspace, then scratchGDB.
 
     This function 'to_scratch' has also an alias 'tos'!
 
@@ -1335,6 +2166,7 @@ def to_scratch(name, enforce=False):
     >>> tos('foo', 0) # '...\\scratch.gdb\\foo'
     """
     ws = arcpy.env.scratchWorkspace
+    if ws is None: ws = _pool_scratch()
     if ws is None: ws = arcpy.env.workspace
     if ws is None: ws = arcpy.env.scratchGDB
 
@@ -1386,7 +2218,9 @@ def swsp(ws = None):
     """Get or set arcpy.env.scratchWorkspace and return its path.
 
     If ws is None and arcpy.env.scratchWorkspace is None, this function will set
-    arcpy.env.scratchWorkspace to arcpy.env.scratchGDB and return its path.
+    arcpy.env.scratchWorkspace to geodatabase of this process from the
+    scratch_pool if the pool is used, otherwise to arcpy.env.scratchGDB, and
+    return its path.
 
     This function 'swsp' has also an alias 'wsps'!
 
@@ -1403,6 +2237,8 @@ def swsp(ws = None):
     """
     if ws is None:
         ws = arcpy.env.scratchWorkspace
+        if ws is None:
+            ws = _pool_scratch()
         if ws is None:
             ws = arcpy.env.scratchGDB
             arcpy.env.scratchWorkspace = ws
@@ -1414,6 +2250,219 @@ def swsp(ws = None):
     return arcpy.env.scratchWorkspace
 
 
+_pool_claim = {'pid': None, 'folder': None, 'gdb': None, 'lock': None}
+"""Geodatabase from the scratch pool claimed by this process"""
+
+_pool_lock = threading.Lock()
+
+
+def scratch_pool(folder, size=None):
+    """Use a pool of scratch file geodatabases, one for each worker process.
+
+    Creates geodatabases scratch_0.gdb to scratch_<size-1>.gdb in folder if
+    they do not exist and returns their paths. From then on, swsp, to_scratch,
+    and functions using them give each process its own geodatabase from the
+    pool, so parallel workers never contend for locks on a shared scratch
+    workspace. Worker processes started later inherit the pool through the
+    environment variable ARCAPI_SCRATCH_POOL, so call this function before
+    starting workers. A process claims its geodatabase on first use by
+    locking file scratch_<i>.lock and keeps it until it ends, the lock is
+    released by the operating system even if the process crashes. If all
+    geodatabases are claimed, the pool grows by one geodatabase.
+    The claimed geodatabase becomes arcpy.env.scratchWorkspace unless
+    scratchWorkspace is already set.
+
+    Required:
+    folder -- folder for the geodatabases, None stops using the pool
+
+    Optional:
+    size -- number of geodatabases to create, default is number of CPUs
+
+    Example:
+    >>> scratch_pool('c:\\temp\\pool', 16)
+    >>> # then in each worker process:
+    >>> to_scratch('foo') # 'c:\\temp\\pool\\scratch_3.gdb\\foo'
+    """
+    if folder is None:
+        os.environ.pop('ARCAPI_SCRATCH_POOL', None)
+        return []
+    if size is None:
+        import multiprocessing
+        size = multiprocessing.cpu_count()
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    gdbs = [_pool_gdb(folder, i) for i in range(size)]
+    os.environ['ARCAPI_SCRATCH_POOL'] = os.path.abspath(folder)
+    return gdbs
+
+
+def _pool_gdb(folder, i):
+    """Return path to geodatabase i of the pool in folder, create it if needed"""
+    gdb = os.path.join(folder, 'scratch_%s.gdb' % i)
+    if not arcpy.Exists(gdb):
+        gdb = arcpy.management.CreateFileGDB(folder, 'scratch_%s' % i, 'CURRENT').getOutput(0)
+    return gdb
+
+
+def _pool_try_lock(path):
+    """Return open file with exclusive lock on it, or None if already locked"""
+    f = open(path, 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        f.close()
+        return None
+    return f
+
+
+def _pool_scratch():
+    """Return geodatabase claimed by this process from the scratch pool.
+
+    Returns None if scratch_pool is not used.
+    """
+    folder = os.environ.get('ARCAPI_SCRATCH_POOL', None)
+    if not folder:
+        return None
+    with _pool_lock:
+        pid = os.getpid()
+        if _pool_claim['pid'] == pid and _pool_claim['folder'] == folder:
+            return _pool_claim['gdb']
+        i = 0
+        while True:
+            lock = _pool_try_lock(os.path.join(folder, 'scratch_%s.lock' % i))
+            if lock is not None:
+                break
+            i += 1
+        gdb = _pool_gdb(folder, i)
+        _pool_claim.update({'pid': pid, 'folder': folder, 'gdb': gdb, 'lock': lock})
+    if arcpy.env.scratchWorkspace is None:
+        arcpy.env.scratchWorkspace = gdb
+    return gdb
+
+
+def pmap(func, datasets, workers=None, scratch=None, chunksize=1):
+    """Apply function func to each dataset in a pool of processes.
+
+    Settings of arcpy.env in the current process, as returned by
+    list_environments, are sent to every worker process and applied there
+    before any dataset is processed. Each worker gets its own scratch
+    workspace from a scratch_pool (see scratch_pool), so outputs of to_scratch
+    never collide. Environment settings that cannot be pickled are sent as
+    strings (spatial references as their string representation).
+    The function and datasets must be picklable, so func must be defined at
+    module level (functools.partial of such a function is fine too).
+
+    Returns a list of tuples (dataset, result, error) in the same order as
+    datasets, where error is None if func succeeded, otherwise error message
+    and result is None.
+
+    On Windows, call this function from within if __name__ == '__main__':
+
+    Required:
+    func -- function that takes one dataset as the only argument
+    datasets -- iterable of datasets, for example from list_data or list_all_fcs
+
+    Optional:
+    workers -- number of worker processes, default is None for cpu count,
+        0 or 1 processes all datasets in the current process
+    scratch -- folder for the scratch pool, default is None for the pool
+        already set by scratch_pool, or a new folder in the system temporary
+        folder if there is none, which is deleted with its contents when
+        pmap returns; False keeps the scratch workspace of the current
+        process
+    chunksize -- number of datasets sent to a worker at once, default is 1
+
+    Example:
+    >>> fcs = list_data('c:\\temp\\data.gdb', type=['Polygon'])
+    >>> pmap(nrow, fcs, 4) # [('c:\\temp\\data.gdb\\a', 12, None), ...]
+    """
+    import multiprocessing
+
+    datasets = list(datasets)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(int(workers), len(datasets))
+
+    if workers <= 1:
+        return [_pmap_one((func, ds)) for ds in datasets]
+
+    envs = _pmap_envs(scratch is False)
+    pool_var = os.environ.get('ARCAPI_SCRATCH_POOL', None)
+    temp = None
+    if scratch is None and not pool_var:
+        import tempfile
+        scratch = temp = tempfile.mkdtemp(prefix='arcapi_pool_')
+    try:
+        if scratch:
+            scratch_pool(scratch, workers)
+        # workers inherit the pool through the environment when they start,
+        # keep it until the pool is closed as the pool may restart workers
+        pool = multiprocessing.Pool(workers, _pmap_init, (envs, scratch is not False))
+        try:
+            ret = pool.map(_pmap_one, [(func, ds) for ds in datasets], chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        if pool_var is None:
+            os.environ.pop('ARCAPI_SCRATCH_POOL', None)
+        else:
+            os.environ['ARCAPI_SCRATCH_POOL'] = pool_var
+        if temp is not None:
+            import shutil
+            shutil.rmtree(temp, True)
+    return ret
+
+
+def _pmap_envs(keep_scratch=False):
+    """Return picklable list of (name, value) of arcpy.env for pmap workers."""
+    import cPickle
+    skip = ('scratchgdb', 'scratchfolder')
+    if not keep_scratch:
+        skip += ('scratchworkspace',)
+    envs = []
+    for en, env in list_environments():
+        if en.lower() in skip or callable(env):
+            continue
+        try:
+            cPickle.dumps(env, 2)
+        except Exception:
+            if hasattr(env, 'exportToString'):
+                env = env.exportToString()
+            else:
+                env = str(env)
+        envs.append((en, env))
+    return envs
+
+
+def _pmap_init(envs, use_pool=True):
+    """Apply arcpy.env settings and claim a scratch workspace in a pmap worker."""
+    for en, env in envs:
+        try:
+            setattr(arcpy.env, en, env)
+        except Exception:
+            # read-only settings and values the worker cannot interpret
+            pass
+    if use_pool:
+        arcpy.env.scratchWorkspace = None
+        _pool_scratch()
+
+
+def _pmap_one(job):
+    """Call func on one dataset for pmap, return tuple (dataset, result, error)."""
+    func, ds = job
+    try:
+        return (ds, func(ds), None)
+    except Exception, e:
+        return (ds, None, str(e) or e.__class__.__name__)
+
+
 def summary(tbl, cols=['*'], modes=None, maxcats=10, w='', verbose=True):
     """Summary statistics about columns of a table.
 
@@ -1604,6 +2653,7 @@ def find(pattern, path, sub_dirs=True):
     \\arcserver1\SDE\BELL\BellePlaine.mdf
     \\arcserver1\SDE\BGLK\BigLake.mdf
     """
+    # see also find_iter for many patterns, large trees, and indexing
     import fnmatch
 
     theFiles = []
@@ -1616,26 +2666,284 @@ def find(pattern, path, sub_dirs=True):
     return theFiles
 
 
-def int_to_float(raster, out_raster, decimals):
-    """Convert an Integer Raster to a Float Raster
-    *** Requires spatial analyst extension ***
+def find_iter(patterns, path, sub_dirs=True, workers=8, index=None, max_age=None):
+    """Find files matching any of wild card patterns, yield them as found.
 
-    E.g., for a cell with a value of 45750, using this tool with 3
-    decimal places will give this cell a value of 45.750
+    All patterns are compiled into one regular expression, so each file name
+    is tested only once. Directories are listed by scandir (os.scandir or the
+    scandir package if available, otherwise os.listdir) and top level
+    subdirectories of path are searched by several threads at once, therefore
+    files are not yielded in any particular order. Patterns are not case
+    sensitive on Windows, like in find.
+
+    If index is specified, paths to all files under path are written into the
+    index file during the search, and later searches only read the index
+    instead of walking the directories. The index is rebuilt when it was
+    built for another path or is older than max_age seconds.
 
     Required:
-    raster -- input integer raster
-    out_raster -- new float raster
-    decimals -- number of places to to move decimal for each cell
+    patterns -- wild card pattern or list of patterns, e.g. ['*.mdf', '*.ldf']
+    path -- root directory to search
+
+    Optional:
+    sub_dirs -- search through all sub directories? default is True
+    workers -- number of threads, default is 8, 0 or 1 searches in one thread
+    index -- path to index file, default is None (do not use index)
+    max_age -- maximum age of index in seconds, default is None (no limit)
 
     Example:
-    >>> convertIntegerToFloat(r'C:\Temp\ndvi_int', r'C:\Temp\ndvi_float', 4)
+    >>> for f in find_iter(['*.mdf', '*.ldf'], r'\\ArcServer1\SDE'):
+    ...     print f
+    >>> idx = r'c:\temp\arcserver1.idx'
+    >>> mdfs = list(find_iter('*.mdf', r'\\ArcServer1\SDE', index=idx, max_age=86400))
     """
-    try:
+    import re
+    import fnmatch
+
+    if isinstance(patterns, basestring):
+        patterns = [patterns]
+    rxs = []
+    for p in patterns:
+        rx = fnmatch.translate(p)
+        for end in ('\\Z(?ms)', '\\Z'):
+            if rx.endswith(end):
+                rx = rx[:-len(end)]
+                break
+        rxs.append('(?:%s)' % rx)
+    flags = re.S | (re.I if os.name == 'nt' else 0)
+    regex = re.compile('(?:%s)\\Z' % '|'.join(rxs), flags)
+    path = os.path.abspath(path)
+    flat = sub_dirs in [False, 'false', 0]
+
+    if index is not None and _find_index_valid(index, path, max_age):
+        with open(index, 'r') as f:
+            f.readline()
+            for line in f:
+                fl = line.rstrip('\r\n')
+                d, name = os.path.split(fl)
+                if flat and d != path:
+                    continue
+                if regex.match(name):
+                    yield fl
+        return
+
+    out = None
+    if index is not None:
+        # the index lists all files, so the whole tree has to be walked
+        out = open(index + '.tmp', 'w')
+        out.write('%s\n' % path)
+    try:
+        for fl in _find_walk(path, flat and out is None, workers):
+            if out is not None:
+                out.write('%s\n' % fl)
+            if flat and os.path.dirname(fl) != path:
+                continue
+            if regex.match(os.path.basename(fl)):
+                yield fl
+    except:
+        if out is not None:
+            out.close()
+            os.remove(index + '.tmp')
+        raise
+    if out is not None:
+        out.close()
+        if os.path.exists(index):
+            os.remove(index)
+        os.rename(index + '.tmp', index)
+
+
+def _find_index_valid(index, path, max_age):
+    """Return True if index of find_iter exists, is for path, and is recent"""
+    if not os.path.exists(index):
+        return False
+    if max_age is not None and time.time() - os.path.getmtime(index) > max_age:
+        return False
+    with open(index, 'r') as f:
+        return f.readline().rstrip('\r\n') == path
+
+
+def _find_scandir(d):
+    """Return list of tuples (name, is_directory) of entries in directory d"""
+    scandir = getattr(os, 'scandir', None)
+    if scandir is None:
+        try:
+            from scandir import scandir
+        except ImportError:
+            scandir = None
+    if scandir is not None:
+        return [(e.name, e.is_dir(follow_symlinks=False)) for e in scandir(d)]
+    ret = []
+    for name in os.listdir(d):
+        p = os.path.join(d, name)
+        ret.append((name, os.path.isdir(p) and not os.path.islink(p)))
+    return ret
+
+
+def _find_tree(d, flat, put, stop):
+    """Call put on every file path under directory d until stop is set"""
+    stack = [d]
+    while stack and not stop.is_set():
+        top = stack.pop()
+        try:
+            entries = _find_scandir(top)
+        except (IOError, OSError):
+            # unreadable directories are skipped like in os.walk
+            continue
+        for name, isdir in entries:
+            if isdir:
+                if not flat:
+                    stack.append(os.path.join(top, name))
+            else:
+                put(os.path.join(top, name))
+
+
+def _find_walk(path, flat=False, workers=8, buffer=10000):
+    """Yield paths to all files under path, walk top level subdirectories in parallel.
+
+    Threads wait when buffer paths are waiting for the consumer. An exception
+    raised in a thread is raised again by this generator.
+    """
+    import Queue
+
+    try:
+        entries = _find_scandir(path)
+    except (IOError, OSError):
+        return
+    subdirs = []
+    for name, isdir in entries:
+        if isdir:
+            subdirs.append(os.path.join(path, name))
+        else:
+            yield os.path.join(path, name)
+    if flat or not subdirs:
+        return
+
+    stop = threading.Event()
+    if workers <= 1:
+        found = []
+        for d in subdirs:
+            _find_tree(d, False, found.append, stop)
+            for fl in found:
+                yield fl
+            del found[:]
+        return
+
+    done = object()
+    q = Queue.Queue(buffer)
+    todo = Queue.Queue()
+    for d in subdirs:
+        todo.put(d)
+
+    def put(x):
+        # give up when the consumer has stopped, it does not take any more
+        while not stop.is_set():
+            try:
+                q.put(x, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def work():
+        error = None
+        try:
+            while not stop.is_set():
+                try:
+                    d = todo.get_nowait()
+                except Queue.Empty:
+                    break
+                _find_tree(d, False, put, stop)
+        except Exception:
+            error = sys.exc_info()
+        finally:
+            put((done, error))
+
+    threads = [threading.Thread(target=work) for i in range(min(workers, len(subdirs)))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        running = len(threads)
+        while running:
+            fl = q.get()
+            if isinstance(fl, tuple) and fl[0] is done:
+                running -= 1
+                if fl[1] is not None:
+                    raise fl[1][0], fl[1][1], fl[1][2]
+            else:
+                yield fl
+    finally:
+        # stop the threads if the caller does not want any more files
+        stop.set()
+
+
+_extensions = {}
+"""Number of active extension sessions by extension name"""
+
+_extensions_lock = threading.Lock()
+
+
+@contextmanager
+def extension(name='Spatial'):
+    """Check out ArcGIS extension for the duration of a with block.
+
+    Sessions are reference counted, so nested sessions and functions that
+    use extension internally do not check the licence out again. The licence
+    is checked out when the outermost session starts and checked in when it
+    ends. Processing many rasters inside one session therefore pays the round
+    trip to the licence server only once.
+    Raises ArcapiError if the extension cannot be checked out.
+
+    Optional:
+    name -- extension code like 'Spatial' (default), '3D', or 'Network'
+
+    Example:
+    >>> with extension('Spatial'):
+    ...     for r in ['c:\\temp\\r1', 'c:\\temp\\r2']:
+    ...         int_to_float(r, r + '_f', 2)
+    """
+    with _extensions_lock:
+        n = _extensions.get(name, 0)
+        if n == 0:
+            status = arcpy.CheckOutExtension(name)
+            if status != 'CheckedOut':
+                raise ArcapiError('Could not check out extension %s: %s' % (name, status))
+        _extensions[name] = n + 1
+    try:
+        yield name
+    finally:
+        with _extensions_lock:
+            n = _extensions[name] - 1
+            if n == 0:
+                del _extensions[name]
+                arcpy.CheckInExtension(name)
+            else:
+                _extensions[name] = n
+
+
+def int_to_float(raster, out_raster, decimals):
+    """Convert an Integer Raster to a Float Raster
+    *** Requires spatial analyst extension ***
+
+    E.g., for a cell with a value of 45750, using this tool with 3
+    decimal places will give this cell a value of 45.750
+    The licence is checked out by extension, see extension to process
+    many rasters with one checkout. Raises ArcapiError if Spatial Analyst
+    is not available.
+
+    Required:
+    raster -- input integer raster
+    out_raster -- new float raster
+    decimals -- number of places to to move decimal for each cell
+
+    Example:
+    >>> convertIntegerToFloat(r'C:\Temp\ndvi_int', r'C:\Temp\ndvi_float', 4)
+    """
+    try:
         import arcpy.sa as sa
+    except ImportError:
+        raise ArcapiError('Module arcpy.sa not found.')
 
-        # check out license
-        arcpy.CheckOutExtension('Spatial')
+    with extension('Spatial'):
         fl_rast = sa.Float(arcpy.Raster(raster) / float(10**int(decimals)))
         try:
             fl_rast.save(out_raster)
@@ -1645,23 +2953,22 @@ def int_to_float(raster, out_raster, decimals):
             if not arcpy.Exists(out_raster):
                 out_raster = out_raster.split('.')[0] + '.tif'
                 fl_rast.save(out_raster)
-        try:
-            arcpy.CalculateStatistics_management(out_raster)
-            arcpy.BuildPyramids_management(out_raster)
-        except:
-            pass
+    try:
+        arcpy.CalculateStatistics_management(out_raster)
+        arcpy.BuildPyramids_management(out_raster)
+    except:
+        pass
 
-        msg('Created: %s' %out_raster)
-        arcpy.CheckInExtension('Spatial')
-        return out_raster
-    except ImportError:
-        return 'Module arcpy.sa not found.'
+    msg('Created: %s' %out_raster)
+    return out_raster
 
 
 def fill_no_data(in_raster, out_raster, w=5, h=5):
     """Fill "NoData" cells with mean values from focal statistics.
 
     Use a larger neighborhood for raster with large areas of no data cells.
+    The licence is checked out by extension. Raises ArcapiError if Spatial
+    Analyst is not available.
 
     *** Requires spatial analyst extension ***
 
@@ -1678,32 +2985,32 @@ def fill_no_data(in_raster, out_raster, w=5, h=5):
     """
     try:
         import arcpy.sa as sa
-        # Make Copy of Raster
-        _dir, name = os.path.split(arcpy.Describe(in_raster).catalogPath)
-        temp = os.path.join(_dir, 'rast_copyxxx')
-        if arcpy.Exists(temp):
-            arcpy.Delete_management(temp)
+    except ImportError:
+        raise ArcapiError('Module arcpy.sa not found.')
+
+    # Make Copy of Raster, in_memory avoids the 13 character limit of GRID
+    # names that unique names exceed if scratch workspace is a folder
+    temp = os.path.join('in_memory', unique_name('rast_copy'))
+    try:
         arcpy.CopyRaster_management(in_raster, temp)
 
         # Fill NoData
-        arcpy.CheckOutExtension('Spatial')
-        filled = sa.Con(sa.IsNull(temp),sa.FocalStatistics(temp,sa.NbrRectangle(w,h),'MEAN'),temp)
-        filled.save(out_raster)
+        with extension('Spatial'):
+            filled = sa.Con(sa.IsNull(temp),sa.FocalStatistics(temp,sa.NbrRectangle(w,h),'MEAN'),temp)
+            filled.save(out_raster)
         arcpy.BuildPyramids_management(out_raster)
-        arcpy.CheckInExtension('Spatial')
-
-        # Delete original and replace
-        if arcpy.Exists(temp):
-            arcpy.Delete_management(temp)
-        msg('Filled NoData Cells in: %s' %out_raster)
-        return out_raster
-    except ImportError:
-        return 'Module arcpy.sa not found.'
+    finally:
+        # Delete the copy even if filling failed
+        _discard(temp)
+    msg('Filled NoData Cells in: %s' %out_raster)
+    return out_raster
 
 
 def meters_to_feet(in_dem, out_raster, factor=3.28084):
     """Convert DEM Z units by a factor, default factor converts m -> ft.
     *** Requires spatial analyst extension ***
+    The licence is checked out by extension. Raises ArcapiError if Spatial
+    Analyst is not available.
 
     Required:
     in_dem -- input dem
@@ -1716,7 +3023,10 @@ def meters_to_feet(in_dem, out_raster, factor=3.28084):
     """
     try:
         import arcpy.sa as sa
-        arcpy.CheckOutExtension('Spatial')
+    except ImportError:
+        raise ArcapiError('Module arcpy.sa not found.')
+
+    with extension('Spatial'):
         out = sa.Float(sa.Times(arcpy.Raster(in_dem), factor))
         try:
             out.save(out_raster)
@@ -1726,16 +3036,13 @@ def meters_to_feet(in_dem, out_raster, factor=3.28084):
             if not arcpy.Exists(out_raster):
                 out_raster = out_raster.split('.')[0] + '.tif'
                 out.save(out_raster)
-        try:
-            arcpy.CalculateStatistics_management(out_raster)
-            arcpy.BuildPyramids_management(out_raster)
-        except:
-            pass
-        arcpy.AddMessage('Created: %s' %out_raster)
-        arcpy.CheckInExtension('Spatial')
-        return out_raster
-    except ImportError:
-        return 'Module arcpy.sa not found'
+    try:
+        arcpy.CalculateStatistics_management(out_raster)
+        arcpy.BuildPyramids_management(out_raster)
+    except:
+        pass
+    arcpy.AddMessage('Created: %s' %out_raster)
+    return out_raster
 
 
 def currentMxd():
@@ -1843,6 +3150,9 @@ def make_poly_from_extent(ext, sr):
 def list_all_fcs(gdb, wild = '*', ftype='All', rel=False):
     """Return a list of all feature classes in a geodatabase.
 
+    Does not change arcpy.env.workspace. The geodatabase is listed anew on
+    every call, use gdb_inventory to reuse cached results.
+
     if rel is True, only relative paths will be returned.  If
     false, the full path to each feature classs is returned
     Relative path Example:
@@ -1888,25 +3198,131 @@ def list_all_fcs(gdb, wild = '*', ftype='All', rel=False):
     # from script tool
     if not ftype:
         ftype = 'All'
-    arcpy.env.workspace = gdb
+    # the inventory does not change arcpy.env.workspace
+    return gdb_inventory(gdb, wild, ftype, rel, refresh=True)
 
-    # loop through feature classes
-    feats = []
 
-    # Add top level fc's (not in feature data sets)
-    feats += arcpy.ListFeatureClasses(wild, ftype)
+_inventory = {}
+"""Cache of gdb_inventory, (workspace, feature type) -> (stamp, feature classes)"""
 
-    # loop through feature datasets
-    for fd in arcpy.ListDatasets('*', 'Feature'):
-        arcpy.env.workspace = fdws = os.path.join(gdb, fd)
-        feats += [os.path.join(fd, fc) for fc in
-                  arcpy.ListFeatureClasses(wild, ftype)]
+_inventory_lock = threading.Lock()
+
+_inventory_walk_types = {
+    'POINT': 'Point', 'POLYGON': 'Polygon', 'POLYLINE': 'Polyline',
+    'LINE': 'Polyline', 'ARC': 'Polyline', 'MULTIPATCH': 'Multipatch',
+    'MULTIPOINT': 'Multipoint'
+}
+"""Feature types of ListFeatureClasses that arcpy.da.Walk can filter by"""
 
-    # return list of features, relative pathed or full pathed
-    if rel:
-        return sorted(feats)
+
+def gdb_inventory(gdbs, wild='*', ftype='All', rel=False, workers=4, refresh=False):
+    """List feature classes in one or more geodatabases, using a cache.
+
+    Unlike arcpy.ListFeatureClasses, this function does not change
+    arcpy.env.workspace and can be called from several threads at once.
+    Feature classes are discovered by arcpy.da.Walk, including those in
+    feature datasets. Results for file geodatabases (.gdb folders) are cached
+    for each geodatabase and feature type and reused until modification time
+    of the folder or of any file in it changes (i.e. until a feature class is
+    added, removed, or renamed). Other workspaces, such as .sde connection
+    files, personal geodatabases, and in_memory, do not reveal changes by
+    modification time and are never cached.
+    Several geodatabases are listed concurrently by a pool of threads.
+
+    Returns sorted list of feature classes if gdbs is one geodatabase,
+    otherwise a dictionary with the list for each geodatabase.
+
+    Required:
+    gdbs -- geodatabase or list of geodatabases
+
+    Optional:
+    wild -- wildcard for names of feature classes, not case sensitive,
+        default is '*'
+    ftype -- feature type as in list_all_fcs, default is 'All'
+    rel -- if True, return paths relative to the geodatabase, default is False
+    workers -- number of threads, default is 4
+    refresh -- if True, ignore cached results, default is False
+
+    Example:
+    >>> gdb_inventory('c:\\temp\\test.gdb', 'storm*', 'Point', True) # ['Utilities\\Storm_Mh', 'Utilities\\Storm_Cb']
+    >>> gdb_inventory(['c:\\temp\\a.gdb', 'c:\\temp\\b.gdb'])
+    """
+    import fnmatch
+
+    single = isinstance(gdbs, basestring)
+    if single:
+        gdbs = [gdbs]
+    ftype = str(ftype or 'All')
+    lister = lambda g: _inventory_fcs(g, ftype, refresh)
+    if workers > 1 and len(gdbs) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(gdbs)))
+        try:
+            listed = pool.map(lister, gdbs)
+        finally:
+            pool.close()
+            pool.join()
     else:
-        return sorted([os.path.join(gdb, ft) for ft in feats])
+        listed = map(lister, gdbs)
+
+    wild = str(wild or '*').lower()
+    ret = {}
+    for gdb, feats in zip(gdbs, listed):
+        if wild != '*':
+            feats = [f for f in feats if fnmatch.fnmatchcase(os.path.basename(f).lower(), wild)]
+        if not rel:
+            feats = [os.path.join(gdb, f) for f in feats]
+        ret[gdb] = feats
+    if single:
+        return ret[gdbs[0]]
+    return ret
+
+
+def _inventory_stamp(gdb):
+    """Return latest modification time of file geodatabase gdb and its files.
+
+    Returns None if gdb is not a file geodatabase folder.
+    """
+    if not (gdb.lower().rstrip('\\/').endswith('.gdb') and os.path.isdir(gdb)):
+        return None
+    try:
+        # renames only rewrite system tables, so the folder mtime is not enough
+        stamp = os.stat(gdb).st_mtime
+        for f in os.listdir(gdb):
+            stamp = max(stamp, os.stat(os.path.join(gdb, f)).st_mtime)
+        return stamp
+    except OSError:
+        return None
+
+
+def _inventory_fcs(gdb, ftype='All', refresh=False):
+    """Return sorted relative paths of feature classes of type ftype in gdb"""
+    key = (os.path.normcase(os.path.abspath(gdb)), ftype.upper())
+    stamp = _inventory_stamp(gdb)
+    if not refresh and stamp is not None:
+        with _inventory_lock:
+            cached = _inventory.get(key, None)
+        if cached is not None and cached[0] == stamp:
+            return list(cached[1])
+
+    walk_type = None
+    if ftype.upper() != 'ALL':
+        walk_type = _inventory_walk_types.get(ftype.upper(), None)
+    feats = []
+    for dirpath, dirnames, filenames in arcpy.da.Walk(gdb, datatype='FeatureClass', type=walk_type):
+        fd = dirpath[len(gdb):].lstrip('\\/')
+        for fc in filenames:
+            if ftype.upper() != 'ALL' and walk_type is None:
+                # types like Annotation or Dimension are not known to Walk
+                if arcpy.Describe(os.path.join(dirpath, fc)).featureType.upper() != ftype.upper():
+                    continue
+            feats.append(os.path.join(fd, fc))
+    feats.sort()
+
+    if stamp is not None:
+        with _inventory_lock:
+            _inventory[key] = (stamp, tuple(feats))
+    return feats
 
 
 def field_list(in_fc, filterer=[], oid=True, shape=True, objects=False):
@@ -2318,6 +3734,372 @@ def list_data(top, **options):
             yield item
 
 
+def scan_data(top, cache=None, workers=8, **options):
+    """Walk down a file structure and pick up all data sets (items) in parallel.
+    Returns a generator of full paths to the items, like list_data does.
+
+    Folders are scanned by several threads at once, level by level, and items
+    of each folder (including contents of file geodatabases in it) are
+    discovered by arcpy.da.Walk. If cache is specified, items of each folder
+    are stored in a JSON file together with modification times of the folder
+    and its geodatabases. Next time, only folders which changed since are
+    scanned again by arcpy.da.Walk, other folders are only checked by os.stat.
+    Items are yielded in alphabetical order within each folder, folders are
+    processed from top down.
+
+    Required:
+    top -- full path to the root folder to start from
+
+    Optional:
+    cache -- path to a JSON file to keep the cache in, default is None (no cache)
+    workers -- number of threads scanning folders, default is 8,
+        0 or 1 scans folders one by one
+    exclude, exclude_dir, oneach, onerror, datatypes, type, skippers --
+        see list_data, exclude_dir is also applied to geodatabases and
+        feature datasets
+
+    Example:
+    >>> scan_data(r'c:\temp', r'c:\temp\scan_cache.json')
+    >>> scan_data(r'\\server\share', 'c:\\temp\\share.json', 16, skippers=(".txt", ".xls"))
+    """
+    import json
+
+    exclude = options.get('exclude', None)
+    exclude_dir = options.get('exclude_dir', None)
+    oneach = options.get('oneach', None)
+    onerror = options.get('onerror', None)
+    datatypes = options.get('datatypes', None)
+    types = options.get('type', None)
+    skippers = options.get('skippers', None)
+
+    if skippers is not None:
+        skippers = [str(sk).lower() for sk in skippers]
+
+    # cached folders are valid only for the same data types
+    params = json.loads(json.dumps([datatypes, types]))
+    entries = {}
+    if cache is not None and os.path.exists(cache):
+        try:
+            with open(cache, 'r') as f:
+                stored = json.load(f)
+            if stored.get('params', None) == params:
+                entries = stored.get('dirs', {})
+        except (IOError, ValueError):
+            # unreadable cache is rebuilt
+            entries = {}
+
+    walker = lambda d: _scan_dir(d, entries.get(_scan_key(d), None), onerror, datatypes, types)
+    pool = None
+    if workers > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
+    seen = {}
+    try:
+        level = [top]
+        while level:
+            if pool is None:
+                scanned = map(walker, level)
+            else:
+                scanned = pool.map(walker, level)
+            level = []
+            for d, entry in scanned:
+                if entry is None:
+                    continue
+                seen[_scan_key(d)] = entry
+                for rel in entry['items']:
+                    if exclude_dir is not None:
+                        # containing geodatabases and feature datasets
+                        if any([exclude_dir(p) for p in rel.split(os.sep)[:-1]]):
+                            continue
+                    item = os.path.join(d, rel)
+                    if exclude is not None:
+                        if exclude(item):
+                            continue
+                    if skippers is not None:
+                        if any([item.lower().find(sk) > -1 for sk in skippers]):
+                            continue
+                    if oneach is not None:
+                        oneach(item)
+                    yield item
+                for di in entry['dirs']:
+                    if exclude_dir is None or not exclude_dir(di):
+                        level.append(os.path.join(d, di))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if cache is not None:
+        # forget folders under top which no longer exist or were skipped
+        root = _scan_key(top).rstrip(os.sep) + os.sep
+        dirs = dict((k, v) for k, v in entries.iteritems() if not (k + os.sep).startswith(root))
+        dirs.update(seen)
+        tmp = cache + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'params': params, 'dirs': dirs}, f)
+        if os.path.exists(cache):
+            os.remove(cache)
+        os.rename(tmp, cache)
+
+
+def _scan_key(d):
+    """Return key of folder d in the cache of scan_data"""
+    return os.path.normcase(os.path.abspath(d))
+
+
+def _scan_stamp(d, ws):
+    """Return modification times of folder d and its workspaces ws, or None"""
+    try:
+        return [os.stat(p).st_mtime for p in [d] + [os.path.join(d, w) for w in ws]]
+    except OSError:
+        return None
+
+
+def _scan_dir(d, entry, onerror, datatypes, types):
+    """Scan one folder for scan_data, return tuple (d, entry).
+
+    Entry is a dictionary with modification times 'stamp', 'items' relative to
+    d, subfolders 'dirs' to be scanned next, and workspaces 'ws' like file
+    geodatabases which are scanned as part of d. Entry is returned as is if
+    nothing changed and None if d cannot be scanned.
+    """
+    if entry is not None and _scan_stamp(d, entry['ws']) == entry['stamp']:
+        return d, entry
+    items, dirs, ws = [], [], []
+    first = True
+    try:
+        for dirpath, dirnames, filenames in arcpy.da.Walk(d, topdown=True, onerror=onerror, followlinks=False, datatype=datatypes, type=types):
+            if first:
+                first = False
+                dirs = [di for di in dirnames if not di.lower().endswith('.gdb')]
+                ws = [di for di in dirnames if di.lower().endswith('.gdb')]
+                # plain subfolders are scanned separately
+                dirnames[:] = ws
+            rel = dirpath[len(d):].lstrip('\\/')
+            items.extend([os.path.join(rel, f) for f in filenames])
+    except (IOError, OSError, RuntimeError), e:
+        if onerror is not None:
+            onerror(e)
+        return d, None
+    stamp = _scan_stamp(d, ws)
+    if stamp is None:
+        return d, None
+    return d, {'stamp': stamp, 'items': sorted(items), 'dirs': sorted(dirs), 'ws': ws}
+
+
+_catalog_schema = """
+CREATE TABLE IF NOT EXISTS datasets (
+    path TEXT PRIMARY KEY, name TEXT, type TEXT, shape_type TEXT,
+    nrows INTEGER, xmin REAL, ymin REAL, xmax REAL, ymax REAL,
+    sr TEXT, mtime REAL, indexed REAL, error TEXT
+);
+CREATE TABLE IF NOT EXISTS fields (
+    path TEXT, name TEXT, type TEXT, length INTEGER
+);
+CREATE INDEX IF NOT EXISTS fields_name ON fields (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS fields_path ON fields (path);
+"""
+"""SQLite tables of catalog_index"""
+
+
+def catalog_index(root, db_path, refresh=False, verbose=False, **options):
+    """Record profiles of all datasets under root in an SQLite database.
+
+    Datasets are discovered by list_data. For each dataset, the table
+    datasets stores path, name, data type, shape type, number of rows, extent,
+    name of spatial reference, and modification time, and the table fields
+    stores name, type, and length of each field. Only datasets which are new
+    or changed since the last run are described again, datasets that no
+    longer exist under root are removed. A dataset in a file geodatabase is
+    considered changed when any file of the geodatabase changes (an edit of
+    one dataset thus refreshes all datasets of the geodatabase), a shapefile
+    when any of its .shp, .shx, .dbf, or .prj files changes. Workspaces such
+    as personal geodatabases or .sde connections do not reveal edits by
+    modification time, use refresh=True for them after editing data.
+    Datasets that cannot be described are recorded with the error message.
+
+    Query the database with catalog_with_field, catalog_search, or any SQLite
+    client, e.g. sqlite3.connect(db_path).
+
+    Returns dictionary with numbers of 'added', 'updated', 'removed', and
+    'unchanged' datasets.
+
+    Required:
+    root -- full path to the root workspace to start from
+    db_path -- path to the SQLite database file, created if it does not exist
+
+    Optional:
+    refresh -- if True, describe all datasets again, default is False
+    verbose -- if True, print progress, default is False
+    options -- keyword arguments of list_data, e.g. skippers or exclude
+
+    Example:
+    >>> catalog_index(r'\\ArcServer1\GIS', 'c:\\temp\\catalog.sqlite')
+    >>> catalog_with_field('c:\\temp\\catalog.sqlite', 'PARCEL_ID')
+    >>> catalog_search('c:\\temp\\catalog.sqlite', shape_type='Polygon', min_rows=1000000)
+    """
+    import sqlite3
+
+    ret = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+    con = sqlite3.connect(db_path)
+    try:
+        con.executescript(_catalog_schema)
+        known = dict(con.execute('SELECT path, mtime FROM datasets'))
+        seen = set()
+        stamps = {}
+        for item in list_data(root, **options):
+            if not isinstance(item, unicode):
+                item = item.decode(sys.getfilesystemencoding() or 'utf-8')
+            seen.add(item)
+            mtime = _catalog_mtime(item, stamps)
+            if not refresh and item in known and known[item] == mtime:
+                ret['unchanged'] += 1
+                continue
+            ret['updated' if item in known else 'added'] += 1
+            row, fields = _catalog_profile(item)
+            con.execute('DELETE FROM fields WHERE path = ?', (item,))
+            con.execute('INSERT OR REPLACE INTO datasets VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                (item,) + row[:9] + (mtime, time.time(), row[9]))
+            con.executemany('INSERT INTO fields VALUES (?,?,?,?)', [(item,) + f for f in fields])
+            if verbose:
+                msg('Indexed ' + item)
+
+        if not isinstance(root, unicode):
+            root = root.decode(sys.getfilesystemencoding() or 'utf-8')
+        top = os.path.join(root, u'')
+        gone = [(p,) for p in known if p not in seen and (p.startswith(top) or p == root)]
+        con.executemany('DELETE FROM fields WHERE path = ?', gone)
+        con.executemany('DELETE FROM datasets WHERE path = ?', gone)
+        ret['removed'] = len(gone)
+        con.commit()
+    finally:
+        con.close()
+    return ret
+
+
+def _catalog_mtime(item, stamps):
+    """Return modification time of item or the nearest existing parent folder.
+
+    File geodatabases are stamped by the latest modification time of their
+    files (see _inventory_stamp), shapefiles by the latest of their parts.
+    """
+    if item.lower().endswith('.shp'):
+        base = item[:-4]
+        times = [os.path.getmtime(base + e) for e in ('.shp', '.shx', '.dbf', '.prj') if os.path.exists(base + e)]
+        if times:
+            return max(times)
+    p = item
+    while p:
+        if p in stamps:
+            return stamps[p]
+        if os.path.exists(p):
+            stamps[p] = _inventory_stamp(p) or os.path.getmtime(p)
+            return stamps[p]
+        parent = os.path.dirname(p)
+        if parent == p:
+            break
+        p = parent
+    return None
+
+
+def _catalog_profile(item):
+    """Describe item for catalog_index, return tuple (row, fields).
+
+    Row is (name, type, shape type, rows, xmin, ymin, xmax, ymax, sr, error),
+    fields is a list of tuples (name, type, length).
+    """
+    name = os.path.basename(item)
+    try:
+        d = arcpy.Describe(item)
+    except Exception, e:
+        return (name, None, None, None, None, None, None, None, None, str(e)), []
+    ext = getattr(d, 'extent', None)
+    sr = getattr(d, 'spatialReference', None)
+    row = [
+        name, getattr(d, 'dataType', None), getattr(d, 'shapeType', None), None,
+        getattr(ext, 'XMin', None), getattr(ext, 'YMin', None),
+        getattr(ext, 'XMax', None), getattr(ext, 'YMax', None),
+        getattr(sr, 'name', None), None
+    ]
+    fields = []
+    try:
+        if hasattr(d, 'fields'):
+            fields = [(f.name, f.type, f.length) for f in d.fields]
+            row[3] = nrow(item)
+    except Exception, e:
+        row[9] = str(e)
+    return tuple(row), fields
+
+
+def catalog_with_field(db_path, field, wild=False):
+    """Return paths of datasets in catalog_index database that have field.
+
+    Required:
+    db_path -- path to the SQLite database built by catalog_index
+    field -- name of the field, not case sensitive
+
+    Optional:
+    wild -- if True, * in field matches any characters, default is False
+
+    Example:
+    >>> catalog_with_field('c:\\temp\\catalog.sqlite', 'PIN') # [u'c:\\gis\\a.gdb\\parcels', ...]
+    >>> catalog_with_field('c:\\temp\\catalog.sqlite', 'POP_*', True)
+    """
+    import sqlite3
+    if wild:
+        sql = "name LIKE ? ESCAPE '!'"
+        field = field.replace('!', '!!').replace('%', '!%').replace('_', '!_').replace('*', '%')
+    else:
+        sql = 'name = ? COLLATE NOCASE'
+    con = sqlite3.connect(db_path)
+    try:
+        cur = con.execute('SELECT DISTINCT path FROM fields WHERE ' + sql + ' ORDER BY path', (field,))
+        return [r[0] for r in cur]
+    finally:
+        con.close()
+
+
+def catalog_search(db_path, dtype=None, shape_type=None, min_rows=None, max_rows=None, wild=None):
+    """Return paths of datasets in catalog_index database matching criteria.
+
+    Criteria that are None are not applied.
+
+    Required:
+    db_path -- path to the SQLite database built by catalog_index
+
+    Optional:
+    dtype -- data type reported by arcpy.Describe, e.g. 'FeatureClass'
+    shape_type -- shape type reported by arcpy.Describe, e.g. 'Polygon'
+    min_rows -- minimal number of rows
+    max_rows -- maximal number of rows
+    wild -- wildcard for the path, * for any characters, not case sensitive
+
+    Example:
+    >>> catalog_search('c:\\temp\\catalog.sqlite', 'FeatureClass', 'Polygon', 1000000)
+    >>> catalog_search('c:\\temp\\catalog.sqlite', wild='*roads*')
+    """
+    import sqlite3
+    w = []
+    params = []
+    for sql, value in (('type = ?', dtype), ('shape_type = ?', shape_type),
+                       ('nrows >= ?', min_rows), ('nrows <= ?', max_rows)):
+        if value is not None:
+            w.append(sql)
+            params.append(value)
+    if wild is not None:
+        w.append("path LIKE ? ESCAPE '!'")
+        pat = wild.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+        params.append(pat.replace('*', '%'))
+    sql = 'SELECT path FROM datasets'
+    if w:
+        sql += ' WHERE ' + ' AND '.join(w)
+    con = sqlite3.connect(db_path)
+    try:
+        return [r[0] for r in con.execute(sql + ' ORDER BY path', params)]
+    finally:
+        con.close()
+
+
 def create_pie_chart(fig, table, case_field, data_field='', fig_title='', x=8.5, y=8.5, rounding=0):
     """Create a pie chart based on a case field and data field.
 
@@ -2376,7 +4158,8 @@ def create_pie_chart(fig, table, case_field, data_field='', fig_title='', x=8.5,
     vals=[]
 
     # sum values
-    sum_table = str(arcpy.Statistics_analysis(table, r'in_memory\sum_tab_xxx',
+    sum_tab = os.path.join('in_memory', unique_name('sum_tab'))
+    sum_table = str(arcpy.Statistics_analysis(table, sum_tab,
                                               [[fields[1], 'SUM']],
                                               fields[0]).getOutput(0))
     fields[1] = 'SUM_{0}'.format(fields[1])
@@ -2410,7 +4193,7 @@ def create_pie_chart(fig, table, case_field, data_field='', fig_title='', x=8.5,
         pylab.title(fig_title)
         pylab.savefig(fig)
         msg('Created: %s' %fig)
-    arcpy.Delete_management(sum_table)
+    _discard(sum_table)
     return fig
 
 
@@ -2466,6 +4249,867 @@ def combine_pdfs(out_pdf, pdf_path_or_list, wildcard=''):
     return out_pdf
 
 
+_http_pool = {}
+"""Idle keep-alive connections, (scheme, host, port) -> list of (connection, time)"""
+
+_http_pool_lock = threading.Lock()
+
+_http_pool_settings = {'size': 4, 'idle': 60.0, 'timeout': 60.0}
+"""Settings of the connection pool, see connection_pool"""
+
+
+def connection_pool(size=None, idle=None, timeout=None):
+    """Configure pool of persistent connections used by request functions.
+
+    HTTP and HTTPS connections are kept open after a request (keep-alive) and
+    reused by the next request to the same host, which saves a TCP and TLS
+    handshake per request. At most size idle connections are kept for each
+    host and connections idle for more than idle seconds are not reused.
+    Connections are used by one thread at a time, so the request functions
+    can be called from several threads. Calling this function closes all idle
+    connections. If proxy is configured by environment variables like
+    http_proxy, urllib2 is used instead and connections are not pooled.
+
+    Returns dictionary with current settings.
+
+    Optional:
+    size -- number of idle connections kept per host, 0 disables the pool,
+        default is None (no change, initially 4)
+    idle -- seconds after which idle connections are closed,
+        default is None (no change, initially 60)
+    timeout -- socket timeout of new connections in seconds,
+        default is None (no change, initially 60)
+
+    Example:
+    >>> connection_pool(8, 30) # {'size': 8, 'idle': 30.0, 'timeout': 60.0}
+    >>> connection_pool(0) # do not keep connections open
+    """
+    with _http_pool_lock:
+        if size is not None:
+            _http_pool_settings['size'] = int(size)
+        if idle is not None:
+            _http_pool_settings['idle'] = float(idle)
+        if timeout is not None:
+            _http_pool_settings['timeout'] = float(timeout)
+        conns = [c for v in _http_pool.values() for c, t in v]
+        _http_pool.clear()
+        ret = dict(_http_pool_settings)
+    for c in conns:
+        c.close()
+    return ret
+
+
+def _conn_get(key):
+    """Return tuple (connection, reused) for key (scheme, host, port)"""
+    import httplib
+    stale = []
+    conn = None
+    with _http_pool_lock:
+        idle = _http_pool.get(key, [])
+        now = time.time()
+        while idle and conn is None:
+            c, t = idle.pop()
+            if now - t > _http_pool_settings['idle']:
+                stale.append(c)
+            else:
+                conn = c
+        timeout = _http_pool_settings['timeout']
+    for c in stale:
+        c.close()
+    if conn is not None:
+        return conn, True
+    scheme, host, port = key
+    if scheme == 'https':
+        return httplib.HTTPSConnection(host, port, timeout=timeout), False
+    return httplib.HTTPConnection(host, port, timeout=timeout), False
+
+
+def _conn_put(key, conn):
+    """Return connection to the pool, or close it if the pool is full"""
+    with _http_pool_lock:
+        idle = _http_pool.setdefault(key, [])
+        if len(idle) < _http_pool_settings['size']:
+            idle.append((conn, time.time()))
+            return
+    conn.close()
+
+
+_http_compression = {'accept': True, 'post_threshold': None}
+"""Compression settings of request functions, see http_compression"""
+
+
+def http_compression(accept=True, post_threshold=None):
+    """Configure compression of data transferred by request functions.
+
+    If accept is True, requests include header Accept-Encoding: gzip, deflate
+    and compressed responses are decompressed transparently, also when they
+    are streamed by request_stream, so data_type parsing, the cache, and
+    json_items work as before. Bodies of POST requests of post_threshold or
+    more bytes are sent gzipped with header Content-Encoding: gzip, which
+    only some servers accept, so it is off by default.
+
+    Returns dictionary with current settings.
+
+    Optional:
+    accept -- ask servers for compressed responses, default is True
+    post_threshold -- minimal size in bytes of POST bodies to compress,
+        default is None (do not compress)
+
+    Example:
+    >>> http_compression(True, 64 * 1024) # gzip POST bodies of 64 kB or more
+    >>> http_compression(False) # ask for uncompressed responses
+    """
+    _http_compression.update({'accept': bool(accept), 'post_threshold': post_threshold})
+    return dict(_http_compression)
+
+
+class _Inflater(object):
+    """Incremental decompression of gzip or deflate response body"""
+
+    def __init__(self, encoding):
+        import zlib
+        self.zlib = zlib
+        self.deflate = encoding == 'deflate'
+        self.first = True
+        wbits = zlib.MAX_WBITS if self.deflate else 16 + zlib.MAX_WBITS
+        self.d = zlib.decompressobj(wbits)
+
+    def decompress(self, s):
+        if self.first and self.deflate and s:
+            self.first = False
+            try:
+                return self.d.decompress(s)
+            except self.zlib.error:
+                # some servers send raw deflate data without zlib header
+                self.d = self.zlib.decompressobj(-self.zlib.MAX_WBITS)
+        return self.d.decompress(s)
+
+    def flush(self):
+        return self.d.flush()
+
+
+def _inflater(rhdrs):
+    """Return _Inflater for response with headers rhdrs, or None if not compressed"""
+    enc = rhdrs.get('content-encoding', '').strip().lower()
+    if enc in ('gzip', 'x-gzip', 'deflate'):
+        # headers describe the body after decompression
+        rhdrs.pop('content-encoding')
+        rhdrs.pop('content-length', None)
+        return _Inflater('deflate' if enc == 'deflate' else 'gzip')
+    return None
+
+
+def _inflate(rhdrs, body):
+    """Return decompressed body of response with headers rhdrs"""
+    d = _inflater(rhdrs)
+    if d is None:
+        return body
+    return d.decompress(body) + d.flush()
+
+
+def _fetch(method, url, body=None, headers={}, redirects=10, stream=False):
+    """Issue HTTP(S) request over pooled connection, return (status, reason, headers, body).
+
+    Follows redirects like urllib2 does. Response headers are a dictionary
+    with lower case keys. Uses urllib2 if a proxy is configured for the host.
+    If stream is True, body is a _ResponseStream to be read and closed.
+    """
+    import urllib
+    import urlparse
+    import httplib
+    import socket
+
+    hdrs = dict((k.title(), v) for k, v in headers.iteritems())
+    if body is not None:
+        hdrs.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+    hdrs.setdefault('User-Agent', 'Python-urllib/%s' % sys.version[:3])
+    if _http_compression['accept']:
+        hdrs.setdefault('Accept-Encoding', 'gzip, deflate')
+    threshold = _http_compression['post_threshold']
+    if body is not None and threshold is not None and len(body) >= threshold and 'Content-Encoding' not in hdrs:
+        import gzip
+        from StringIO import StringIO
+        buf = StringIO()
+        with closing(gzip.GzipFile(fileobj=buf, mode='wb')) as gz:
+            gz.write(body)
+        body = buf.getvalue()
+        hdrs['Content-Encoding'] = 'gzip'
+
+    for i in range(redirects + 1):
+        parsed = urlparse.urlsplit(url)
+        scheme = parsed.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise ArcapiError('Protocol can only be http or https!')
+        host = parsed.hostname
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        proxies = urllib.getproxies()
+        if scheme in proxies and not urllib.proxy_bypass(host):
+            return _fetch_urllib2(method, url, body, hdrs, stream)
+
+        path = urlparse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+        key = (scheme, host, port)
+        while True:
+            conn, reused = _conn_get(key)
+            sent = False
+            try:
+                conn.request(method, path, body, hdrs)
+                sent = True
+                r = conn.getresponse()
+                rhdrs = dict((k.lower(), v) for k, v in r.getheaders())
+                redirect = r.status in (301, 302, 303, 307, 308) and 'location' in rhdrs
+                rbody = None if stream and not redirect else r.read()
+                break
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                # server may have closed an idle connection, retry on a new one
+                # unless the server may have acted on the request already
+                if not reused or not _fetch_stale(e, sent, method):
+                    raise
+        if rbody is None:
+            return r.status, r.reason, rhdrs, _ResponseStream(r, conn, key, inflater=_inflater(rhdrs))
+        if r.will_close:
+            conn.close()
+        else:
+            _conn_put(key, conn)
+
+        if redirect:
+            url = urlparse.urljoin(url, rhdrs['location'])
+            if r.status == 303 or (r.status in (301, 302) and method == 'POST'):
+                method, body = 'GET', None
+                hdrs.pop('Content-Type', None)
+                hdrs.pop('Content-Encoding', None)
+            continue
+        return r.status, r.reason, rhdrs, _inflate(rhdrs, rbody)
+    raise ArcapiError('Too many redirects, last url was %s' % url)
+
+
+def _fetch_stale(error, sent, method):
+    """Return True if request failed by error on a reused connection can be sent again.
+
+    That is if sending failed, or if an idempotent request got no response
+    because the server had closed the connection. Timeouts are never retried.
+    """
+    import errno
+    import httplib
+    import socket
+
+    if isinstance(error, socket.timeout):
+        return False
+    if not sent:
+        return True
+    if method.upper() not in ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'):
+        return False
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    return isinstance(error, socket.error) and error.errno == errno.ECONNRESET
+
+
+def _fetch_urllib2(method, url, body, headers, stream=False):
+    """Issue request by urllib2, which honours proxies, for _fetch"""
+    import urllib2
+    rq = urllib2.Request(url, body, headers)
+    rq.get_method = lambda: method
+    try:
+        re = urllib2.urlopen(rq)
+    except urllib2.HTTPError, e:
+        re = e
+    rhdrs = dict((k.lower(), v) for k, v in re.info().items())
+    if stream:
+        return re.code, re.msg, rhdrs, _ResponseStream(re, inflater=_inflater(rhdrs))
+    with closing(re):
+        return re.code, re.msg, rhdrs, _inflate(rhdrs, re.read())
+
+
+class _ResponseStream(object):
+    """Body of a streamed response with read and iteration by chunks.
+
+    The connection is returned to the pool when the body is read to the end
+    and closed, otherwise the connection is closed. Compressed body is
+    decompressed by inflater, then read(n) reads n compressed bytes.
+    """
+
+    def __init__(self, response, conn=None, key=None, chunk_size=2 ** 16, inflater=None):
+        self.response = response
+        self.conn = conn
+        self.key = key
+        self.chunk_size = chunk_size
+        self.inflater = inflater
+        self.done = False
+
+    def read(self, n=-1):
+        if self.response is None:
+            return ''
+        if n is None or n < 0:
+            s = self.response.read()
+            self.done = True
+            if self.inflater is not None:
+                s = self.inflater.decompress(s) + self.inflater.flush()
+        else:
+            s = self.response.read(n)
+            self.done = not s
+            if self.inflater is not None:
+                while s:
+                    # compressed data may not produce any output yet
+                    out = self.inflater.decompress(s)
+                    if out:
+                        break
+                    s = self.response.read(n)
+                self.done = not s
+                s = self.inflater.flush() if self.done else out
+        if self.done:
+            self.close()
+        return s
+
+    def __iter__(self):
+        while True:
+            s = self.read(self.chunk_size)
+            if not s:
+                break
+            yield s
+
+    def close(self):
+        r, self.response = self.response, None
+        if r is None:
+            return
+        if self.conn is None:
+            r.close()
+        elif self.done and not r.will_close:
+            _conn_put(self.key, self.conn)
+        else:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def request_stream(url, data=None, headers={}, chunk_size=2 ** 16, out_file=None):
+    """Issue HTTP or HTTPS request and stream the response without keeping it in memory.
+
+    Returns an iterator over chunks of the response body (strings of up to
+    chunk_size bytes as received, see http_compression), or writes the body
+    to out_file and returns out_file.
+    Use json_items to parse JSON from the chunks one array element at a time.
+    The response cache (see http_cache) is not used.
+
+    Required:
+    url -- URL to issue the request to, starting with http:// or https://
+
+    Optional:
+    data -- dictionary of data to send by POST, default is None (GET)
+    headers -- dictionary of headers to include in the request
+    chunk_size -- maximum size of chunks in bytes, default is 65536
+    out_file -- path to file to write the body to, default is None
+
+    Example:
+    >>> u = 'http://sampleserver3.arcgisonline.com/ArcGIS/rest/services/SanFrancisco/311Incidents/FeatureServer/0/query'
+    >>> q = {'where': '1=1', 'outFields': '*', 'f': 'json'}
+    >>> request_stream(u, q, out_file='c:\\temp\\incidents.json')
+    >>> for feature in json_items(request_stream(u, q), 'features'):
+    ...     print feature['attributes']
+    """
+    import urllib
+    import urllib2
+    from StringIO import StringIO
+
+    if data is not None:
+        data = urllib.urlencode(data)
+    method = 'GET' if data is None else 'POST'
+    status, reason, rhdrs, stream = _fetch(method, str(url), data, headers, stream=True)
+    stream.chunk_size = chunk_size
+    if status >= 400:
+        raise urllib2.HTTPError(url, status, reason, rhdrs, StringIO(stream.read()))
+    if out_file is None:
+        return _stream_chunks(stream)
+    with closing(stream):
+        with open(out_file, 'wb') as f:
+            for chunk in stream:
+                f.write(chunk)
+    return out_file
+
+
+def _stream_chunks(stream):
+    """Yield chunks of _ResponseStream stream and close it in the end"""
+    with closing(stream):
+        for chunk in stream:
+            yield chunk
+
+
+def json_items(chunks, path='features'):
+    """Parse elements of an array in JSON document one by one.
+
+    Yields parsed elements of the array located by path, for example the
+    features of an ArcGIS REST query response, without parsing or keeping
+    the whole document in memory. Only the elements of one array are in
+    memory at once. Content before the array is skipped, content after it is
+    not read at all.
+
+    Required:
+    chunks -- iterable of strings, e.g. from request_stream, or a file object
+
+    Optional:
+    path -- dot separated keys of nested objects that lead to the array,
+        default is 'features'; use '' if the document itself is an array
+
+    Example:
+    >>> list(json_items(['{"features": [{"a": 1}, ', '{"a": 2}]}'])) # [{u'a': 1}, {u'a': 2}]
+    >>> with open('c:\\temp\\incidents.json', 'rb') as f:
+    ...     n = sum(1 for ft in json_items(f, 'features'))
+    """
+    if isinstance(chunks, basestring):
+        chunks = [chunks]
+    elif hasattr(chunks, 'read'):
+        f = chunks
+        chunks = iter(lambda: f.read(2 ** 16), '')
+    keys = [k for k in str(path).split('.') if k] if path else []
+    return _JsonItems(chunks).items(keys)
+
+
+class _JsonItems(object):
+    """Incremental scanner of JSON text from chunks, see json_items"""
+
+    def __init__(self, chunks):
+        import re
+        import json
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.string = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+
+    def load(self):
+        """Append next chunk to the buffer, return False at the end of input"""
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        self.eof = True
+        return False
+
+    def trim(self, i):
+        """Drop consumed part of the buffer, return new position of i"""
+        if i > 2 ** 16:
+            self.buf = self.buf[i:]
+            return 0
+        return i
+
+    def skip(self, i, chars=' \t\r\n'):
+        """Return position of next character not in chars, None at the end"""
+        while True:
+            while i < len(self.buf) and self.buf[i] in chars:
+                i += 1
+            if i < len(self.buf):
+                return i
+            if not self.load():
+                return None
+
+    def items(self, keys):
+        # stack of enclosing containers as [bracket, key of the current value]
+        stack = []
+        i = 0
+        while True:
+            i = self.skip(self.trim(i))
+            if i is None:
+                raise ValueError('JSON array %s not found' % '.'.join(keys))
+            c = self.buf[i]
+            if c == '"':
+                m = self.string.match(self.buf, i)
+                while m is None:
+                    if not self.load():
+                        raise ValueError('Unterminated string in JSON')
+                    m = self.string.match(self.buf, i)
+                s, i = m.group(), m.end()
+                j = self.skip(i)
+                if j is not None and stack and stack[-1][0] == '{' and self.buf[j] == ':':
+                    stack[-1][1] = self.decoder.decode(s)
+                    i = j + 1
+            elif c == '[' and [k for b, k in stack] == keys and (not stack or stack[-1][0] == '{'):
+                for item in self.array(i + 1):
+                    yield item
+                return
+            elif c in '{[':
+                stack.append([c, None])
+                i += 1
+            elif c in '}]':
+                stack.pop()
+                i += 1
+            else:
+                i += 1
+
+    def array(self, i):
+        """Yield elements of array starting at position i"""
+        while True:
+            i = self.skip(self.trim(i), ' \t\r\n,')
+            if i is None:
+                raise ValueError('Unterminated array in JSON')
+            if self.buf[i] == ']':
+                return
+            while True:
+                try:
+                    item, end = self.decoder.raw_decode(self.buf, i)
+                    # a number at the end of the buffer may continue in next chunk
+                    if self.eof or (end < len(self.buf) and self.buf[end] in ' \t\r\n,]'):
+                        break
+                except ValueError:
+                    if self.eof:
+                        raise
+                self.load()
+            yield item
+            i = end
+
+
+_esri_field_types = {
+    'esriFieldTypeSmallInteger': 'SHORT', 'esriFieldTypeInteger': 'LONG',
+    'esriFieldTypeSingle': 'FLOAT', 'esriFieldTypeDouble': 'DOUBLE',
+    'esriFieldTypeString': 'TEXT', 'esriFieldTypeDate': 'DATE',
+    'esriFieldTypeGUID': 'TEXT', 'esriFieldTypeGlobalID': 'TEXT'
+}
+"""Field types of ArcGIS REST API supported by download_features"""
+
+_esri_geometry_types = {
+    'esriGeometryPoint': 'POINT', 'esriGeometryMultipoint': 'MULTIPOINT',
+    'esriGeometryPolyline': 'POLYLINE', 'esriGeometryPolygon': 'POLYGON'
+}
+"""Geometry types of ArcGIS REST API supported by download_features"""
+
+
+def download_features(layer_url, out_tbl, where='1=1', page_size=1000, workers=4, params=None, geometry=True):
+    """Download features from ArcGIS REST layer or table into a feature class or table.
+
+    Reads schema of the layer, queries object ids matching where clause,
+    splits them into pages of page_size ids (at most maxRecordCount of the
+    layer), and downloads the pages concurrently by request_many. Features
+    are written into out_tbl by one insert cursor as pages arrive, in the
+    order of object ids. Object ids of the source are stored in field SRC_OID.
+    Fields of types like Blob or Raster are skipped, and so are the geometry
+    field and fields derived from geometry (e.g. Shape__Area, Shape_Length,
+    SHAPE.STArea()). Other field names are adjusted by arcpy.ValidateFieldName
+    for the workspace of out_tbl. If the layer has geometry
+    and geometry is True, out_tbl is a feature class in the spatial reference
+    of the layer, otherwise it is a table.
+
+    Returns catalog path to out_tbl. Raises ArcapiError if any page could not
+    be downloaded (after retries), out_tbl then contains the other pages.
+
+    Required:
+    layer_url -- url of the layer, e.g. .../FeatureServer/0 or .../MapServer/2
+    out_tbl -- path to the output feature class or table
+
+    Optional:
+    where -- where clause to select features, default is '1=1' (all)
+    page_size -- number of features per request, default is 1000
+    workers -- number of concurrent requests, default is 4
+    params -- dictionary of other parameters of each request, e.g. token
+    geometry -- download geometries too, default is True
+
+    Example:
+    >>> u = 'http://sampleserver3.arcgisonline.com/ArcGIS/rest/services/SanFrancisco/311Incidents/FeatureServer/0'
+    >>> download_features(u, 'c:\\temp\\data.gdb\\incidents', "status = 'Closed'", 500, 8)
+    """
+    import datetime
+    import re
+
+    layer_url = str(layer_url).rstrip('/')
+    base = dict(params or {})
+    base['f'] = 'json'
+    layer = _rest_json(layer_url, base)
+    query = layer_url + '/query'
+    ids = _rest_json(query, dict(base, where=where, returnIdsOnly='true'))
+    oidf = ids.get('objectIdFieldName', None) or layer.get('objectIdField', None)
+    ids = sorted(ids.get('objectIds', None) or [])
+
+    # schema of the output, names holds source names of the columns after SRC_OID
+    ws = os.path.dirname(out_tbl) or arcpy.env.workspace
+    gfield = layer.get('geometryField', None) or {}
+    gfield = (gfield.get('name', '') if isinstance(gfield, dict) else gfield).lower()
+    derived = re.compile(r'shape[._]+(st)?(area|length)(\(\))?\Z', re.IGNORECASE)
+    cols, names, dates = [('SRC_OID', 'LONG')], [], set()
+    used = set(['src_oid'])
+    for f in layer.get('fields', []):
+        if f['type'] == 'esriFieldTypeOID' and oidf is None:
+            oidf = f['name']
+        tp = _esri_field_types.get(f['type'], None)
+        if tp is None or f['name'].lower() == gfield or derived.match(f['name']):
+            continue
+        length = f.get('length', None) if tp == 'TEXT' else None
+        if f['type'] in ('esriFieldTypeGUID', 'esriFieldTypeGlobalID'):
+            length = 38
+        nm = base_nm = str(arcpy.ValidateFieldName(f['name'], ws))
+        k = 1
+        while nm.lower() in used:
+            nm = '%s_%s' % (base_nm, k)
+            k += 1
+        used.add(nm.lower())
+        cols.append((nm, tp, length) if length else (nm, tp))
+        if tp == 'DATE':
+            dates.add(len(names))
+        names.append(f['name'])
+    if oidf is None:
+        raise ArcapiError('Layer %s has no object id field' % layer_url)
+    gtype = _esri_geometry_types.get(layer.get('geometryType', None), None) if geometry else None
+    sr = None
+    if gtype is not None:
+        wkid = (layer.get('extent', None) or {}).get('spatialReference', {})
+        wkid = wkid.get('latestWkid', None) or wkid.get('wkid', None)
+        sr = None if wkid is None else _spatial_reference(int(wkid))
+    out_tbl = _create_table(out_tbl, cols, gtype, sr)
+    fields = [c[0] for c in cols]
+    if gtype is not None:
+        fields.append('SHAPE@XY' if gtype == 'POINT' else 'SHAPE@')
+
+    page_size = max(1, min(int(page_size), int(layer.get('maxRecordCount', None) or page_size)))
+    pages = [ids[i:i + page_size] for i in range(0, len(ids), page_size)]
+    out_fields = ','.join([oidf] + names)
+    specs = [{
+        'url': query, 'data_type': 'json',
+        'data': dict(base, objectIds=','.join(map(str, p)), outFields=out_fields,
+                     returnGeometry='true' if gtype else 'false')
+    } for p in pages]
+
+    epoch = datetime.datetime(1970, 1, 1)
+
+    def rows(features):
+        for ft in features:
+            at = dict((k.lower(), v) for k, v in ft.get('attributes', {}).iteritems())
+            rw = [at.get(oidf.lower(), None)] + [at.get(n.lower(), None) for n in names]
+            for i in dates:
+                if rw[i + 1] is not None:
+                    rw[i + 1] = epoch + datetime.timedelta(milliseconds=rw[i + 1])
+            if gtype == 'POINT':
+                g = ft.get('geometry', None) or {}
+                rw.append((g['x'], g['y']) if g.get('x', None) is not None else None)
+            elif gtype is not None:
+                g = ft.get('geometry', None)
+                if g is not None and sr is not None:
+                    g = dict(g, spatialReference={'wkid': sr.factoryCode})
+                rw.append(None if g is None else arcpy.AsShape(g, True))
+            yield rw
+
+    failed = []
+    pending = {}
+    nxt = 0
+    with arcpy.da.InsertCursor(out_tbl, fields) as ic:
+        # queries do not change anything, so failed pages can be requested again
+        for i, result, error in request_many(specs, workers, ordered=False, retry_post=True):
+            if error is None and 'error' in result:
+                error = str(result['error'])
+            if error is not None:
+                failed.append('%s-%s: %s' % (pages[i][0], pages[i][-1], error))
+                result = {}
+            pending[i] = result.get('features', [])
+            # keep the order of object ids
+            while nxt in pending:
+                _insert_rows(out_tbl, fields, rows(pending.pop(nxt)), ic=ic)
+                nxt += 1
+    if failed:
+        raise ArcapiError('%s of %s pages failed, object ids %s' % (len(failed), len(pages), '; '.join(failed)))
+    return out_tbl
+
+
+def _rest_json(url, data):
+    """Return JSON response of ArcGIS REST API, raise ArcapiError for error responses"""
+    result = request(url, data, 'json')
+    if 'error' in result:
+        raise ArcapiError('%s: %s' % (url, result['error']))
+    return result
+
+
+_http_cache_settings = {'folder': None, 'ttl': 3600.0, 'max_size': 100 * 2 ** 20, 'post': False}
+"""Settings of the response cache, see http_cache"""
+
+_http_cache_state = {'size': None}
+"""Total size of cached files in bytes, None if not known yet"""
+
+_http_cache_lock = threading.Lock()
+
+
+def http_cache(folder=None, ttl=3600, max_size=100, clear=False, post=False):
+    """Cache responses of request functions (and epsg) in a folder.
+
+    Successful responses are stored in files keyed by method, url, and body
+    of the request. Only GET requests are cached unless post is True, because
+    POST requests often change data on the server (applyEdits, submitJob) and
+    must reach it every time. A cached response is used without asking the
+    server for ttl seconds. After that, the request is sent with
+    If-None-Match and If-Modified-Since headers if the server provided ETag
+    or Last-Modified, and the cached response is used again if the server
+    replies 304 Not Modified. Responses parsed as json are stored parsed, so
+    they are not parsed again. When the cache grows over max_size megabytes,
+    least recently used responses are removed. Responses with Cache-Control
+    no-store are never cached, and neither are json responses with a top
+    level 'error' key, which is how ArcGIS REST API reports failures. Note
+    that request headers are not part of the key, so do not use the cache for
+    responses that depend on headers.
+
+    Returns dictionary with current settings.
+
+    Optional:
+    folder -- folder to store responses in, created if it does not exist,
+        default is None, which stops caching
+    ttl -- seconds for which responses are used without revalidation,
+        default is 3600
+    max_size -- maximum size of the cache in megabytes, default is 100
+    clear -- if True, delete all cached responses, default is False
+    post -- if True, cache POST requests too, use only for endpoints that
+        do not change anything, such as query, default is False
+
+    Example:
+    >>> http_cache('c:\\temp\\http_cache', 24 * 3600)
+    >>> epsg(27700) # from the server
+    >>> epsg(27700) # from the cache
+    >>> http_cache() # stop caching
+    """
+    with _http_cache_lock:
+        if folder is not None:
+            folder = os.path.abspath(folder)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            if clear:
+                for f in os.listdir(folder):
+                    if f.endswith('.pkl'):
+                        os.remove(os.path.join(folder, f))
+        _http_cache_settings.update({
+            'folder': folder, 'ttl': float(ttl), 'max_size': int(max_size * 2 ** 20), 'post': bool(post)
+        })
+        _http_cache_state['size'] = None
+        return dict(_http_cache_settings)
+
+
+def _fetch_parsed(method, url, body, headers, data_type, convert, strict=False):
+    """Return response of _fetch converted by convert, use the cache if enabled.
+
+    If strict is True, raise urllib2.HTTPError for status 400 and higher.
+    """
+    import urllib2
+    from StringIO import StringIO
+
+    folder = _http_cache_settings['folder']
+    if folder is None or (method != 'GET' and not (method == 'POST' and _http_cache_settings['post'])):
+        status, reason, rhdrs, rs = _fetch(method, url, body, headers)
+        if strict and status >= 400:
+            raise urllib2.HTTPError(url, status, reason, rhdrs, StringIO(rs))
+        return convert(rs)
+
+    import hashlib
+    key = hashlib.sha1('\n'.join([method, url, body or ''])).hexdigest()
+    path = os.path.join(folder, key + '.pkl')
+    entry = _cache_load(path)
+    hdrs = dict(headers)
+    if entry is not None:
+        if time.time() - entry['stored'] <= _http_cache_settings['ttl']:
+            return _cache_hit(path, entry, data_type, convert)
+        if entry['etag']:
+            hdrs['If-None-Match'] = entry['etag']
+        if entry['modified']:
+            hdrs['If-Modified-Since'] = entry['modified']
+
+    status, reason, rhdrs, rs = _fetch(method, url, body, hdrs)
+    if status == 304 and entry is not None:
+        entry['stored'] = time.time()
+        return _cache_hit(path, entry, data_type, convert, True)
+    if strict and status >= 400:
+        raise urllib2.HTTPError(url, status, reason, rhdrs, StringIO(rs))
+    result = convert(rs)
+    failed = isinstance(result, dict) and 'error' in result
+    if status == 200 and not failed and 'no-store' not in rhdrs.get('cache-control', ''):
+        entry = {
+            'url': url, 'stored': time.time(), 'body': rs,
+            'etag': rhdrs.get('etag', None), 'modified': rhdrs.get('last-modified', None),
+            'parsed': {}
+        }
+        if data_type in ('json', 'jsonp', 'pjson'):
+            entry['parsed'][data_type] = result
+        _cache_save(path, entry)
+    return result
+
+
+def _cache_load(path):
+    """Return cached entry from file path, or None"""
+    import cPickle
+    try:
+        with open(path, 'rb') as f:
+            return cPickle.load(f)
+    except Exception:
+        # missing, incomplete, or incompatible file is a cache miss
+        return None
+
+
+def _cache_hit(path, entry, data_type, convert, changed=False):
+    """Return result from cached entry, mark it as recently used"""
+    parsed = entry['parsed']
+    if data_type in parsed:
+        result = parsed[data_type]
+    else:
+        result = convert(entry['body'])
+        if data_type in ('json', 'jsonp', 'pjson'):
+            parsed[data_type] = result
+            changed = True
+    if changed:
+        _cache_save(path, entry)
+    else:
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+    return result
+
+
+def _cache_save(path, entry):
+    """Write cached entry to file path and evict old entries if needed"""
+    import cPickle
+    tmp = '%s.%s.%s.tmp' % (path, os.getpid(), threading.current_thread().ident)
+    try:
+        old = os.path.getsize(path)
+    except OSError:
+        old = 0
+    with open(tmp, 'wb') as f:
+        cPickle.dump(entry, f, 2)
+    size = os.path.getsize(tmp)
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+    except OSError:
+        # another thread or process stored the same response
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return
+    with _http_cache_lock:
+        if _http_cache_state['size'] is not None:
+            _http_cache_state['size'] += size - old
+        else:
+            folder = os.path.dirname(path)
+            _http_cache_state['size'] = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder) if f.endswith('.pkl'))
+        if _http_cache_state['size'] > _http_cache_settings['max_size']:
+            _http_cache_state['size'] = _cache_evict(os.path.dirname(path), _http_cache_settings['max_size'])
+
+
+def _cache_evict(folder, max_size):
+    """Delete least recently used files until folder has 90 % of max_size, return size"""
+    files = []
+    for f in os.listdir(folder):
+        if f.endswith('.pkl'):
+            p = os.path.join(folder, f)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+    files.sort()
+    size = sum(f[1] for f in files)
+    for mtime, fsize, p in files:
+        if size <= 0.9 * max_size:
+            break
+        try:
+            os.remove(p)
+            size -= fsize
+        except OSError:
+            pass
+    return size
+
+
 def request_http(url, data=None, data_type='text', headers={}):
     """Return result of an HTTP Request.
 
@@ -2494,7 +5138,8 @@ def request_http(url, data=None, data_type='text', headers={}):
     >>> request('http://epsg.io/4326.xml', None, 'xml')
     """
 
-    result = ''
+    import urllib
+    import json
     callback = 'callmeback' # may not be used
 
     # prepare data
@@ -2507,36 +5152,34 @@ def request_http(url, data=None, data_type='text', headers={}):
     if data is not None:
          data = urllib.urlencode(data)
 
-    # make the request
-    rq = urllib2.Request(url, data, headers)
-    re = urllib2.urlopen(rq)
-    rs = re.read()
-
-    # handle result
-    if data_type in ('json', 'jsonp', 'pjson'):
-        rs = rs.strip()
-
-        # strip callback function if present
-        if rs.startswith(callback + '('):
-            rs = rs.lstrip(callback + '(')
-            rs = rs[:rs.rfind(')')]
-
-        result = json.loads(rs)
-    elif data_type == 'xml':
-        from xml.etree import ElementTree as ET
-        rs = rs.strip()
-        result = ET.fromstring(rs)
-    elif data_type == 'text':
-        result = rs
-    else:
-        raise Exception('Unsupported data_type %s ' % data_type)
+    def convert(rs):
+        # handle result
+        if data_type in ('json', 'jsonp', 'pjson'):
+            rs = rs.strip()
+
+            # strip callback function if present
+            if rs.startswith(callback + '('):
+                rs = rs.lstrip(callback + '(')
+                rs = rs[:rs.rfind(')')]
+
+            result = json.loads(rs)
+        elif data_type == 'xml':
+            from xml.etree import ElementTree as ET
+            rs = rs.strip()
+            result = ET.fromstring(rs)
+        elif data_type == 'text':
+            result = rs
+        else:
+            raise Exception('Unsupported data_type %s ' % data_type)
+        return result
 
-    return result
+    # make the request over a pooled keep-alive connection, or use the cache
+    return _fetch_parsed('GET' if data is None else 'POST', url, data, headers, data_type, convert, True)
 
 
-def request_https(url, data=None, data_type="text", headers={}):
+def request_https(url, data=None, data_type="text", headers={}, strict=False):
     """Return result of an HTTPS Request.
-    Uses urllib.HTTPSConnection to issue the request.
+    Uses a pooled httplib.HTTPSConnection to issue the request, see connection_pool.
 
     Only GET and POST methods are supported. To issue a GET request, parameters
     must be encoded as part of the url and data must be None. To issue a POST
@@ -2556,11 +5199,16 @@ def request_https(url, data=None, data_type="text", headers={}):
                 jsonp,pjson -- parse the text with json.loads(text) and return
                     also, add parameter callback to the request
         header -- dictionary of headers to include in the request
+        strict -- if True, raise urllib2.HTTPError for HTTP status 400 and
+            higher like request_http does, otherwise (default) return the
+            body of such responses
     Example:
     >>> request_https('https://gitgub.com')
     >>> u = 'https://sampleserver3.arcgisonline.com/ArcGIS/rest/services'
     >>> request_https(u,{'f':'json'}, 'json')
     """
+    import urllib
+    import json
     url = str(url)
     callback = '' # may not be used
 
@@ -2568,56 +5216,47 @@ def request_https(url, data=None, data_type="text", headers={}):
     if not url.lower().startswith("https://"):
         url = "https://" + url
 
-    urlparsed = urlparse.urlparse(url)
-    hostname = urlparsed.hostname
-    path = url[8 + len(hostname):] # get path as url without https and host name
+    # issue the request over a pooled keep-alive connection, or use the cache
+    if data is None:
 
-    # connect to the host and issue the request
-    with closing(httplib.HTTPSConnection(hostname)) as cns:
+        if data_type == 'jsonp' or data_type == 'pjson':
+            # TODO: Make sure callback parameter is included
+            pass
 
-        if data is None:
+        # use GET request, all parameters must be encoded as part of the url
+        method, d = "GET", None
 
-            if data_type == 'jsonp' or data_type == 'pjson':
-                # TODO: Make sure callback parameter is included
-                pass
+    else:
 
-            # use GET request, all parameters must be encoded as part of the url
-            cns.request("GET", path, None, headers)
+        if data_type == 'jsonp' or data_type == 'pjson':
+            raise Exception("data_type 'jsonp' not allowed for POST method!")
 
-        else:
+        # use POST request, data must be a dictionary and not part of the url
+        method, d = "POST", urllib.urlencode(data)
 
-            if data_type == 'jsonp' or data_type == 'pjson':
-                raise Exception("data_type 'jsonp' not allowed for POST method!")
-
-            # use POST request, data must be a dictionary and not part of the url
-            d = urllib.urlencode(data)
-            cns.request("POST", path, d, headers)
-
-        r = cns.getresponse()
-        s = r.read()
-        cns.close()
-
-    # convert to required format
-    result = None
-    if data_type is None or data_type == 'text':
-        result = s
-    elif data_type == 'json':
-        result = json.loads(s)
-    elif data_type == 'jsonp' or data_type == 'pjson':
-        result = json.loads(s.lstrip(callback + "(").rstrip(")"))
-    elif data_type == 'xml':
-        from xml.etree import ElementTree as ET
-        rs = rs.strip()
-        result = ET.fromstring(rs)
+    def convert(s):
+        # convert to required format
+        result = None
+        if data_type is None or data_type == 'text':
+            result = s
+        elif data_type == 'json':
+            result = json.loads(s)
+        elif data_type == 'jsonp' or data_type == 'pjson':
+            result = json.loads(s.lstrip(callback + "(").rstrip(")"))
+        elif data_type == 'xml':
+            from xml.etree import ElementTree as ET
+            result = ET.fromstring(s.strip())
+        return result
 
-    return result
+    return _fetch_parsed(method, url, d, headers, data_type, convert, strict)
 
 
 def request(url, data=None, data_type='text', headers={}):
     """Return result of an HTTP or HTTPS Request.
 
-    Uses urllib2.Request to issue HTTP request and the urllib.HTTPSConnection
-    to issue https requests.
+    Requests are issued over persistent connections kept in a pool for each
+    host (see connection_pool), unless a proxy is configured, then urllib2 is
+    used.
     Only GET and POST methods are supported. To issue a GET request, parameters
     must be encoded as part of the url and data must be None. To issue a POST
     request, parameters must be supplied as a dictionary for parameter data and
@@ -2672,9 +5311,271 @@ def request(url, data=None, data_type='text', headers={}):
     return result
 
 
+def request_many(specs, workers=8, rate=None, retries=3, per_host=None, backoff=0.5, ordered=True, retry_post=False):
+    """Issue many requests concurrently, see request.
+
+    Requests are issued by a pool of threads over pooled keep-alive
+    connections. The number of requests started per second can be limited
+    by rate (token bucket allowing short bursts of up to rate requests) and
+    the number of concurrent requests to one host by per_host.
+    Requests failing because of network errors or HTTP status 429 or 5xx are
+    retried up to retries times, waiting backoff, 2*backoff, 4*backoff...
+    seconds (with random jitter) in between, or as long as the server asks
+    by the Retry-After header. Only GET requests (without data) are retried
+    by default, because a POST request that failed may still have changed
+    data on the server (e.g. applyEdits) and must not be repeated. Use
+    retry_post=True, or key retry of a dictionary spec, for POST requests
+    that are safe to repeat, such as queries.
+
+    Each request is specified by an url, by a tuple of arguments of request,
+    i.e. (url, data, data_type, headers), or by a dictionary with keys url,
+    data, data_type, headers, and retry (True or False to override the
+    default of retrying GET requests and POST requests if retry_post).
+
+    If ordered is True, returns list of tuples (index, result, error) in the
+    same order as specs, otherwise returns a generator yielding the tuples as
+    requests complete. Index is the position of the request in specs, error
+    is None if the request succeeded, otherwise error message.
+
+    Required:
+    specs -- iterable of urls, tuples, or dictionaries
+
+    Optional:
+    workers -- number of threads, default is 8
+    rate -- maximum number of requests started per second, default is None (no limit)
+    retries -- maximum number of retries of each request, default is 3
+    per_host -- maximum number of concurrent requests to one host,
+        default is None (no limit except workers)
+    backoff -- seconds to wait before the first retry, default is 0.5
+    ordered -- return list in order (True, default) or generator (False)
+    retry_post -- retry POST requests too, default is False
+
+    Example:
+    >>> u = 'http://sampleserver3.arcgisonline.com/ArcGIS/rest/services/Locators/ESRI_Geocode_USA/GeocodeServer/findAddressCandidates'
+    >>> specs = [(u, {'Address': a, 'f': 'json'}, 'json') for a in ('380 New York St', '1 Main St')]
+    >>> res = request_many(specs, 4, rate=10, per_host=2, retry_post=True)
+    >>> for i, result, error in request_many(specs, ordered=False):
+    ...     print i, error
+    """
+    from multiprocessing.pool import ThreadPool
+
+    jobs = list(enumerate(specs))
+    bucket = None
+    if rate is not None:
+        bucket = _TokenBucket(rate)
+    limits = {}
+    limits_lock = threading.Lock()
+
+    def job(item):
+        i, spec = item
+        try:
+            args = _request_args(spec)
+        except Exception, e:
+            return (i, None, str(e))
+        retry = args.pop('retry', None)
+        if retry is None:
+            retry = retry_post or args.get('data', None) is None
+        host = None
+        if per_host is not None:
+            import urlparse
+            host = urlparse.urlsplit(args['url']).netloc.lower()
+            with limits_lock:
+                limit = limits.setdefault(host, threading.Semaphore(per_host))
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.take()
+            if host is not None:
+                limit.acquire()
+            try:
+                return (i, _request_strict(**args), None)
+            except Exception, e:
+                wait = _request_retry_after(e)
+                if wait is None or attempt >= retries or not retry:
+                    return (i, None, str(e) or e.__class__.__name__)
+            finally:
+                if host is not None:
+                    limit.release()
+            import random
+            time.sleep(max(wait, backoff * 2 ** attempt * random.uniform(0.5, 1.0)))
+            attempt += 1
+
+    pool = ThreadPool(max(1, min(int(workers), len(jobs))))
+    if ordered:
+        try:
+            return pool.map(job, jobs, 1)
+        finally:
+            pool.close()
+            pool.join()
+    return _request_stream(pool, job, jobs)
+
+
+def _request_strict(url, data=None, data_type='text', headers={}):
+    """Return result of request, raise urllib2.HTTPError for status 400 and higher over HTTPS too"""
+    if str(url).lower().startswith('https://'):
+        return request_https(url, data, data_type, headers, True)
+    return request(url, data, data_type, headers)
+
+
+def _request_stream(pool, job, jobs):
+    """Yield results of job as they complete for request_many"""
+    try:
+        for r in pool.imap_unordered(job, jobs):
+            yield r
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _request_args(spec):
+    """Return dictionary of arguments of request from request_many spec"""
+    if isinstance(spec, basestring):
+        return {'url': spec}
+    if isinstance(spec, dict):
+        args = dict(spec)
+    else:
+        args = dict(zip(('url', 'data', 'data_type', 'headers'), spec))
+    if 'url' not in args:
+        raise ArcapiError('Request specification without url: %s' % (spec,))
+    if isinstance(args.get('data', None), dict):
+        # request_http adds callback to data
+        args['data'] = dict(args['data'])
+    return args
+
+
+def _request_retry_after(e):
+    """Return seconds to wait before retrying after error e, None if not to retry"""
+    import socket
+    import httplib
+    import urllib2
+    if isinstance(e, urllib2.HTTPError):
+        if e.code != 429 and e.code < 500:
+            return None
+        try:
+            return float(dict((k.lower(), v) for k, v in dict(e.hdrs or {}).items()).get('retry-after', 0))
+        except (TypeError, ValueError):
+            # Retry-After given as a date
+            return 0
+    if isinstance(e, (urllib2.URLError, socket.error, httplib.HTTPException)):
+        return 0
+    return None
+
+
+class _TokenBucket(object):
+    """Thread-safe token bucket, tokens are refilled at rate per second"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self.tokens = self.burst
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Wait until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_srs = {}
+"""Memo of epsg, 'code.form' -> spatial reference string"""
+
+_srs_lock = threading.Lock()
+
+_srs_settings = {'catalog': None, 'offline': False}
+"""Catalog file and offline mode of epsg, see srs_catalog"""
+
+_epsg_url = 'http://epsg.io/%s.%s'
+"""Url of spatial reference by code and form used by epsg"""
+
+
+def srs_catalog(path=None, offline=False):
+    """Use a local catalog of spatial references for epsg.
+
+    The catalog is a JSON file that stores strings returned by epsg by code
+    and format. Its entries are loaded into memory, and epsg adds every newly
+    obtained string to it, so each spatial reference is downloaded only once.
+    Fill the catalog in advance by epsg_prefetch, then copy the file to
+    computers without Internet connection and use it with offline=True.
+
+    Returns number of spatial references in the catalog.
+
+    Optional:
+    path -- path to the JSON file, created when first needed,
+        default is None (no catalog, spatial references are kept in memory only)
+    offline -- if True, epsg never connects to the Internet and raises
+        ArcapiError for spatial references not in the catalog (or, for
+        esriwkt, not known to arcpy), default is False
+
+    Example:
+    >>> srs_catalog('c:\\temp\\srs.json')
+    >>> epsg_prefetch([27700, 4326, 3857], ['esriwkt', 'proj4'])
+    >>> srs_catalog('c:\\temp\\srs.json', offline=True) # on an air-gapped computer
+    >>> epsg(27700, 'proj4')
+    """
+    import json
+    loaded = {}
+    if path is not None and os.path.exists(path):
+        with open(path, 'r') as f:
+            loaded = json.load(f)
+    with _srs_lock:
+        _srs_settings.update({'catalog': path, 'offline': bool(offline)})
+        _srs.update(loaded)
+        return len(loaded)
+
+
+def _srs_store(entries):
+    """Add dictionary entries to the memo and the catalog file of epsg"""
+    import json
+    with _srs_lock:
+        _srs.update(entries)
+        path = _srs_settings['catalog']
+        if path is None or not entries:
+            return
+        catalog = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                catalog = json.load(f)
+        catalog.update(entries)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(catalog, f, indent=0, sort_keys=True)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+
+
+def _srs_local(code, form):
+    """Return spatial reference string from arcpy without network, or None"""
+    if form != 'esriwkt':
+        return None
+    try:
+        s = arcpy.SpatialReference(int(code)).exportToString()
+    except Exception:
+        # unknown code or arcpy not available
+        return None
+    if not isinstance(s, basestring) or not s:
+        return None
+    # drop the domain and tolerance parts after the WKT
+    return s.split(';')[0]
+
+
 def epsg(epsgcode, form='esriwkt'):
     """Get spatial reference system by EPSG code as string.
-    Queries the http://epsg.io website.
+    Returns string from memory or from catalog (see srs_catalog) if it was
+    obtained before, otherwise from arcpy (only esriwkt, no network needed),
+    otherwise queries the http://epsg.io website and remembers the result.
+    Note that esriwkt from arcpy is the WKT part of exportToString of
+    arcpy.SpatialReference, which may differ from the text of epsg.io (e.g.
+    in precision of numbers), although it describes the same system.
     epsgcode -- European Petrol Survey Group code (http://www.epsg.org/)
     form -- Format to return:
         html : HTML
@@ -2690,12 +5591,72 @@ def epsg(epsgcode, form='esriwkt'):
         mapnik : Mapnik
         sql : PostGIS
     Example:
-    >>> srs_str_by_epsg(27700, 'esriwkt')
+    >>> epsg(27700, 'esriwkt')
     """
-    srsstr = request('http://epsg.io/%s.%s' % (epsgcode, str(form).lower()))
+    form = str(form).lower()
+    key = '%s.%s' % (epsgcode, form)
+    srsstr = _srs.get(key, None)
+    if srsstr is not None:
+        return srsstr
+    srsstr = _srs_local(epsgcode, form)
+    if srsstr is None:
+        if _srs_settings['offline']:
+            raise ArcapiError('Spatial reference %s not in catalog %s' % (key, _srs_settings['catalog']))
+        srsstr = request(_epsg_url % (epsgcode, form))
+    _srs_store({key: srsstr})
     return srsstr
 
 
+def epsg_prefetch(codes, forms=['esriwkt'], workers=8):
+    """Obtain spatial reference strings for many codes at once, see epsg.
+
+    Strings not known yet are obtained from arcpy (esriwkt) or downloaded
+    concurrently from the http://epsg.io website and stored in memory and in
+    the catalog (see srs_catalog) in one go.
+
+    Returns list of tuples (code, form, error) for strings that could not be
+    obtained.
+
+    Required:
+    codes -- list of EPSG codes
+
+    Optional:
+    forms -- list of formats, see epsg, default is ['esriwkt']
+    workers -- number of concurrent downloads, default is 8
+
+    Example:
+    >>> srs_catalog('c:\\temp\\srs.json')
+    >>> epsg_prefetch(range(27700, 27701) + [4326, 3857], ['esriwkt', 'proj4', 'wkt'])
+    """
+    found = {}
+    missing = []
+    for code in codes:
+        for form in forms:
+            form = str(form).lower()
+            key = '%s.%s' % (code, form)
+            if key in _srs or key in found:
+                continue
+            s = _srs_local(code, form)
+            if s is None:
+                missing.append((code, form, key))
+            else:
+                found[key] = s
+    errors = []
+    if missing:
+        if _srs_settings['offline']:
+            errors = [(code, form, 'offline') for code, form, key in missing]
+        else:
+            urls = [_epsg_url % (code, form) for code, form, key in missing]
+            for i, result, error in request_many(urls, workers):
+                code, form, key = missing[i]
+                if error is None:
+                    found[key] = result
+                else:
+                    errors.append((code, form, error))
+    _srs_store(found)
+    return errors
+
+
 def arctype_to_ptype(tp):
     """Convert ArcGIS field type string to Python type.
       tp -- ArcGIS type as string like SHORT|LONG|TEXT|DOUBLE|FLOAT...
@@ -2708,6 +5669,7 @@ def arctype_to_ptype(tp):
     >>> arctype_to_ptype("SmallInteger") # returns int
     >>> arctype_to_ptype("DATE") # returns datetime.datetime
     """
+    import datetime
     tp = str(tp).upper().strip()
     o = str
     if tp == "TEXT" or tp == "STRING":
@@ -2743,10 +5705,8 @@ def project_coordinates(xys, in_sr, out_sr, datum_transformation=None):
     >>> project_coordinates(coordinates, 29902, 27700, dtt)
     """
 
-    if not type(in_sr) is arcpy.SpatialReference:
-        in_sr = arcpy.SpatialReference(in_sr)
-    if not type(out_sr) is arcpy.SpatialReference:
-        out_sr = arcpy.SpatialReference(out_sr)
+    in_sr = _spatial_reference(in_sr)
+    out_sr = _spatial_reference(out_sr)
 
     xyspr = []
     for xy in xys:
@@ -2764,34 +5724,440 @@ def project_coordinates(xys, in_sr, out_sr, datum_transformation=None):
     return xyspr
 
 
+_sr_objects = {}
+"""Memo of spatial reference strings (exportToString) by wkid"""
+
+
+def _spatial_reference(sr):
+    """Return arcpy.SpatialReference for sr.
+
+    Objects are created from strings remembered by wkid, which is quicker than
+    a lookup by wkid. Each call returns a new object, so callers may modify it.
+    Other sr, such as paths to .prj files, are not remembered.
+    """
+    if type(sr) is arcpy.SpatialReference:
+        return sr
+    if not isinstance(sr, (int, long)) or isinstance(sr, bool):
+        return arcpy.SpatialReference(sr)
+    s = _sr_objects.get(sr, None)
+    if s is None:
+        ret = arcpy.SpatialReference(sr)
+        _sr_objects[sr] = ret.exportToString()
+        return ret
+    ret = arcpy.SpatialReference()
+    ret.loadFromString(s)
+    return ret
+
+
+_profile = {}
+"""Profiling records by function name, see profile_start"""
+
+_profile_patched = []
+"""List of (module, name, original function) replaced by profile_start"""
+
+_profile_local = threading.local()
+"""Stacks of profiling records of running functions by thread"""
+
+
+def profile_start():
+    """Start profiling calls to all public arcapi functions.
+
+    Every public function of arcapi is replaced by a wrapper that records
+    number of calls, cumulative and maximum wall time of a call, and number of
+    rows read and written by arcpy cursors opened within the function.
+    Rows are attributed to the innermost profiled function that opened
+    the cursor, times of functions include times of functions they call.
+    Profiling is also started when arcapi is imported if the environment
+    variable ARCAPI_PROFILE is set to 1. When profiling is not started,
+    arcapi functions are not wrapped at all and there is no overhead.
+    Starting the profiler again does not reset the records, see profile_reset.
+
+    Example:
+    >>> profile_start()
+    >>> tmp = values('c:\\foo\\bar.shp', 'Shape_Length')
+    >>> print_tuples(profile_report())
+    >>> profile_stop()
+    """
+    global arcpy
+    import inspect
+    if _profile_patched:
+        return
+
+    # modules where arcapi functions can be found, i.e. this module and
+    # the arcapi package which imports everything from this module
+    mods = [sys.modules[__name__]]
+    pkgname = __name__.rpartition('.')[0]
+    if pkgname in sys.modules:
+        mods.append(sys.modules[pkgname])
+
+    skip = ('profile_start', 'profile_stop', 'profile_reset', 'profile_report', 'main')
+    wrappers = {}
+    for name, fun in globals().items():
+        if name.startswith('_') or name in skip:
+            continue
+        if not inspect.isfunction(fun) or fun.__module__ != __name__:
+            continue
+        if fun not in wrappers:
+            wrappers[fun] = _profiled(fun, inspect.isgeneratorfunction(fun))
+        for mod in mods:
+            if getattr(mod, name, None) is fun:
+                _profile_patched.append((mod, name, fun))
+                setattr(mod, name, wrappers[fun])
+
+    arcpy = _ArcpyProxy(arcpy, _profile_cursor)
+    return
+
+
+def profile_stop():
+    """Stop profiling started by profile_start, records are kept.
+
+    Example:
+    >>> profile_stop()
+    """
+    global arcpy
+    while _profile_patched:
+        mod, name, fun = _profile_patched.pop()
+        setattr(mod, name, fun)
+    if isinstance(arcpy, _ArcpyProxy) and arcpy._hook is _profile_cursor:
+        arcpy = _resolved(arcpy._target)
+    return
+
+
+def profile_reset():
+    """Forget all records collected by profiling"""
+    _profile.clear()
+
+
+def profile_report(sort='cumulative', out_json=None):
+    """Return records collected by profiling as a list of tuples.
+
+    Each tuple represents one function with values:
+    (name, calls, cumulative time, maximum time, mean time, rows read, rows written)
+    Times are in seconds. Functions which were not called are not listed.
+
+    Optional:
+    sort -- name of the value to sort by in descending order, one of
+        name|calls|cumulative(default)|max|mean|read|written.
+        Sorting by name is in ascending order.
+    out_json -- path to a JSON file to dump the report to, default is None
+
+    Example:
+    >>> print_tuples(profile_report())
+    >>> tmp = profile_report('calls', 'c:\\temp\\profile.json')
+    """
+    keys = ('name', 'calls', 'cumulative', 'max', 'mean', 'read', 'written')
+    if sort not in keys:
+        raise ArcapiError("sort %s not in %s" % (sort, "|".join(keys)))
+    ret = []
+    for name, r in _profile.items():
+        calls, cum, mx, rd, wr = r
+        if calls > 0:
+            ret.append((name, calls, cum, mx, cum / calls, rd, wr))
+    i = keys.index(sort)
+    ret.sort(key=lambda a: a[i], reverse=(sort != 'name'))
+    if out_json is not None:
+        import json
+        with open(out_json, 'w') as f:
+            json.dump([dict(zip(keys, r)) for r in ret], f, indent=1)
+    return ret
+
+
+def _profile_record(name):
+    """Return the profiling record [calls, cumulative, max, read, written]"""
+    r = _profile.get(name, None)
+    if r is None:
+        r = _profile.setdefault(name, [0, 0.0, 0.0, 0, 0])
+    return r
+
+
+def _profile_stack():
+    """Return stack of profiling records of running functions of this thread"""
+    stack = getattr(_profile_local, 'stack', None)
+    if stack is None:
+        stack = _profile_local.stack = []
+    return stack
+
+
+def _profiled(fun, isgenerator=False):
+    """Return a wrapper of function fun that records its calls when profiling"""
+    import functools
+    from timeit import default_timer as timer
+    name = fun.__name__
+
+    if isgenerator:
+        # time the work done for each item, not just creating the generator
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            r = _profile_record(name)
+            r[0] += 1
+            gen = fun(*args, **kwargs)
+            total = 0.0
+            stack = _profile_stack()
+            while True:
+                stack.append(r)
+                t = timer()
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+                finally:
+                    dt = timer() - t
+                    stack.pop()
+                    total += dt
+                    r[1] += dt
+                    r[2] = max(r[2], total)
+                yield item
+    else:
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            r = _profile_record(name)
+            r[0] += 1
+            stack = _profile_stack()
+            stack.append(r)
+            t = timer()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                dt = timer() - t
+                stack.pop()
+                r[1] += dt
+                r[2] = max(r[2], dt)
+    return wrapper
+
+
+def _profile_cursor(name, value):
+    """Hook for _ArcpyProxy that makes cursors count rows when profiling"""
+    if name in ('arcpy.da.SearchCursor', 'arcpy.da.UpdateCursor',
+                'arcpy.da.InsertCursor', 'arcpy.SearchCursor',
+                'arcpy.UpdateCursor', 'arcpy.InsertCursor'):
+        def cursor(*args, **kwargs):
+            stack = _profile_stack()
+            r = stack[-1] if stack else _profile_record('<outside arcapi>')
+            return _CountingCursor(value(*args, **kwargs), r)
+        return cursor
+    return value
+
+
+@contextmanager
+def trace_arcpy(target=None):
+    """Count and time calls to arcpy made by arcapi functions.
+
+    A context manager which temporarily replaces arcpy used by arcapi by
+    a proxy that records every call of an arcpy function (and every cursor
+    created) per calling arcapi function, i.e. the innermost public arcapi
+    function on the call stack. Only calls from arcapi are recorded, not
+    calls you make to arcpy directly. Use it to find repeated calls to
+    arcpy.Describe, arcpy.ListFields, or geoprocessing tools.
+    Not thread safe, do not use it in more threads at the same time.
+
+    Returns object with the following methods:
+    report(sort='time') -- list of tuples (arcapi function, arcpy function,
+        number of calls, total time in seconds) sorted by time or calls
+    calls(name) -- number of calls of arcpy function name like
+        'arcpy.Describe' from all arcapi functions
+
+    Optional:
+    target -- the module to trace, default is None for arcpy used by arcapi,
+        can also be ArcpyMockup or other object which mimics arcpy
+
+    Example:
+    >>> with trace_arcpy() as t:
+    ...     create_field_name('c:\\foo\\bar.shp', 'NEWCOL')
+    >>> print_tuples(t.report())
+    >>> t.calls('arcpy.Describe') # 2
+    """
+    global arcpy
+    original = arcpy
+    tracer = _ArcpyTracer()
+    arcpy = _ArcpyProxy(original if target is None else target, tracer.hook)
+    try:
+        yield tracer
+    finally:
+        arcpy = _resolved(original)
+
+
+class _ArcpyTracer(object):
+    """Records calls of arcpy functions for trace_arcpy"""
+
+    def __init__(self):
+        import inspect
+        self.records = {} # (arcapi function, arcpy function): [calls, time]
+        funs = [f for n, f in globals().items() if not n.startswith('_')]
+        funs += [f for m, n, f in _profile_patched] # if profiling is on
+        self.codes = set([f.func_code for f in funs
+            if inspect.isfunction(f) and f.__module__ == __name__
+            and f.func_code.co_name != 'wrapper'])
+
+    def hook(self, name, value):
+        """Hook for _ArcpyProxy which wraps functions and cursor classes"""
+        import inspect
+        if not callable(value):
+            return value
+        if inspect.isclass(value) and not name.endswith('Cursor'):
+            # classes like SpatialReference must stay classes for type checks
+            return value
+        from timeit import default_timer as timer
+        records = self.records
+        caller = self.caller
+
+        def traced(*args, **kwargs):
+            key = (caller(), name)
+            t = timer()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                dt = timer() - t
+                r = records.get(key, None)
+                if r is None:
+                    r = records[key] = [0, 0.0]
+                r[0] += 1
+                r[1] += dt
+        return traced
+
+    def caller(self):
+        """Return name of the innermost public arcapi function on the stack"""
+        codes = self.codes
+        f = sys._getframe(2)
+        while f is not None:
+            if f.f_code in codes:
+                return f.f_code.co_name
+            f = f.f_back
+        return '<outside arcapi>'
+
+    def report(self, sort='time'):
+        i = 3 if sort == 'time' else 2
+        ret = [(k[0], k[1], v[0], v[1]) for k, v in self.records.items()]
+        ret.sort(key=lambda a: (-a[i], a[0], a[1]))
+        return ret
+
+    def calls(self, name):
+        return sum([v[0] for k, v in self.records.items() if k[1] == name])
+
+
+class _ArcpyProxy(object):
+    """Stand-in for the arcpy module (or its submodules) which passes
+    every attribute of arcpy through a hook before returning it.
+
+    The hook is a function which takes the full name of the attribute like
+    'arcpy.da.SearchCursor' and the attribute, and returns what should be
+    returned instead of the attribute. Submodules are wrapped by proxies too.
+    Setting attributes sets them on arcpy.
+    """
+
+    def __init__(self, target, hook, name='arcpy'):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_hook', hook)
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_cache', {})
+
+    def __getattr__(self, key):
+        cache = self._cache
+        if key in cache:
+            return cache[key]
+        value = getattr(self._target, key)
+        fullname = self._name + '.' + key
+        if isinstance(value, ModuleType):
+            ret = _ArcpyProxy(value, self._hook, fullname)
+        else:
+            ret = self._hook(fullname, value)
+        if isinstance(value, ModuleType) or callable(value):
+            cache[key] = ret
+        return ret
+
+    def __setattr__(self, key, value):
+        self._cache.pop(key, None)
+        setattr(self._target, key, value)
+
+
+class _CountingCursor(object):
+    """Wrapper of an arcpy cursor which counts rows read and written into
+    the profiling record r.
+    """
+
+    def __init__(self, cursor, r):
+        self._cursor = cursor
+        self._r = r
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._cursor.__exit__(*args)
+
+    def __iter__(self):
+        r = self._r
+        for row in self._cursor:
+            r[3] += 1
+            yield row
+
+    def next(self):
+        row = self._cursor.next()
+        if row is not None:
+            self._r[3] += 1
+        return row
+
+    def updateRow(self, row):
+        self._r[4] += 1
+        return self._cursor.updateRow(row)
+
+    def insertRow(self, row):
+        self._r[4] += 1
+        return self._cursor.insertRow(row)
+
+    def deleteRow(self, *args):
+        self._r[4] += 1
+        return self._cursor.deleteRow(*args)
+
+    def __getattr__(self, key):
+        return getattr(self._cursor, key)
+
+
 class ArcapiError(Exception):
     """A type of exception raised from arcapi module"""
     pass
 
 
+class _ArcpyAlias(object):
+    """Callable that looks up an arcpy function like 'da.SearchCursor' when
+    called, so that defining an alias does not import arcpy."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        f = arcpy
+        for n in self.name.split('.'):
+            f = getattr(f, n)
+        return f(*args, **kwargs)
+
+    def __repr__(self):
+        return '<alias of arcpy.%s>' % self.name
+
+
 """
 Aliases
 =======
-Modified to allow computers without arcpy import arcapi.
-That is why instead of just:
+Modified to allow computers without arcpy import arcapi, and to import arcpy
+only when it is needed. That is why instead of just:
 search = arcpy.da.SearchCursor
 we need:
-searcher = getattr(getattr(arcpy, "da", None), "SearchCursor", None)
+searcher = _ArcpyAlias("da.SearchCursor")
 """
-searcher = getattr(getattr(arcpy, "da", None), "SearchCursor", None)
-updater = getattr(getattr(arcpy, "da", None), "UpdateCursor", None)
-inserter = getattr(getattr(arcpy, "da", None), "InsertCursor", None)
-add_col = getattr(getattr(arcpy, "management", None), "AddField", None)
-descr = getattr(arcpy, "Describe", None)
-flyr = getattr(getattr(arcpy, "management", None), "MakeFeatureLayer", None)
-rlyr = getattr(getattr(arcpy, "management", None), "MakeRasterLayer", None)
-tviw = getattr(getattr(arcpy, "management", None), "MakeTableView", None)
+searcher = _ArcpyAlias("da.SearchCursor")
+updater = _ArcpyAlias("da.UpdateCursor")
+inserter = _ArcpyAlias("da.InsertCursor")
+add_col = _ArcpyAlias("management.AddField")
+descr = _ArcpyAlias("Describe")
+flyr = _ArcpyAlias("management.MakeFeatureLayer")
+rlyr = _ArcpyAlias("management.MakeRasterLayer")
+tviw = _ArcpyAlias("management.MakeTableView")
 tos = to_scratch
 wsps = swsp
 osj = os.path.join
 bname = os.path.basename
 dname = os.path.dirname
-srs = getattr(arcpy, "SpatialReference", None)
+srs = _ArcpyAlias("SpatialReference")
 
 
 lut_field_types = {
@@ -2806,6 +6172,10 @@ lut_field_types = {
 }
 
 
+if os.environ.get('ARCAPI_PROFILE', '').lower() in ('1', 'true', 'yes'):
+    profile_start()
+
+
 def main():
     pass
 
@@ -0,0 +1,353 @@
+"""
+#-------------------------------------------------------------------------------
+# Name:        arcapi_bench
+# Purpose:     Benchmarks for arcapi module.
+#
+# Author:      Filip Kral, Caleb Mackay
+#
+# Created:     18/10/2026
+# Licence:     LGPL v3
+#-------------------------------------------------------------------------------
+# Reproducible benchmarks of arcapi functions on synthetic tables.
+#
+# Synthetic tables are generated from a seeded random number generator, so two
+# runs with the same seed and sizes work with identical data. Each case runs
+# in a fresh process, rows per second and peak memory are measured and written
+# to a JSON file, which can be used as a baseline for later runs.
+#
+# Usage:
+#   python arcapi_bench.py --out bench.json
+#   python arcapi_bench.py --sizes 1000 1000000 --baseline bench.json
+#   python arcapi_bench.py --cases values distinct --repeat 5
+#   python arcapi_bench.py --fake --row-latency 0.00001
+#
+# With --fake, tables are kept in memory by ArcpyFake instead of arcpy, so the
+# benchmarks also run on computers without ArcGIS.
+#
+# The script exits with status 1 if any regressions against baseline are found.
+#-------------------------------------------------------------------------------
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import platform
+import argparse
+import multiprocessing
+import arcapi as ap
+from ArcpyFake import ArcpyFake
+
+
+SIZES = (1000, 10000, 100000)
+"""Default numbers of rows of synthetic tables"""
+
+NCATS = 50
+"""Number of distinct values in the CAT column"""
+
+COLS = [('ID', 'LONG'), ('NUM', 'DOUBLE'), ('CAT', 'TEXT', 20),
+        ('NULLY', 'DOUBLE'), ('KEY', 'LONG'), ('UPD', 'DOUBLE')]
+"""Columns of synthetic tables"""
+
+
+def synthetic_rows(nrows, seed=0):
+    """Yield nrows rows of synthetic data as tuples matching COLS.
+
+    NUM is normally distributed, CAT has NCATS categories, NULLY is null in
+    90% of rows, KEY references keys of synthetic_join_rows, UPD is null.
+    """
+    rnd = random.Random(seed)
+    for i in xrange(nrows):
+        nully = rnd.random() if rnd.random() < 0.1 else None
+        yield (i, rnd.gauss(0, 1), 'cat_%s' % rnd.randint(1, NCATS), nully,
+               rnd.randint(1, 1000), None)
+
+
+def synthetic_join_rows(seed=0):
+    """Yield 1000 rows (KEY, VAL, NOTE) with unique keys for joins"""
+    rnd = random.Random(seed)
+    for k in xrange(1, 1001):
+        yield (k, rnd.random(), 'note_%s' % k)
+
+
+def make_table(ws, nrows, seed=0):
+    """Create synthetic table with nrows rows in workspace ws, return path"""
+    tbl = os.path.join(ws, 'bench_%s_%s' % (nrows, seed))
+    if not ap.arcpy.Exists(tbl):
+        ap.tlist_to_table(synthetic_rows(nrows, seed), tbl, COLS)
+    return tbl
+
+
+def make_join_table(ws, seed=0):
+    """Create synthetic join table in workspace ws, return path"""
+    tbl = os.path.join(ws, 'bench_join_%s' % seed)
+    if not ap.arcpy.Exists(tbl):
+        cols = [('KEY', 'LONG'), ('VAL', 'DOUBLE'), ('NOTE', 'TEXT', 20)]
+        ap.tlist_to_table(synthetic_join_rows(seed), tbl, cols)
+    return tbl
+
+
+def copy_table(tbl, suffix):
+    """Return path to a fresh copy of table tbl"""
+    out = tbl + '_' + suffix
+    ap.dlt(out)
+    return ap.arcpy.management.Copy(tbl, out).getOutput(0)
+
+
+# Each case is a pair of functions (setup, run). Setup takes path to the
+# synthetic table, number of rows, and the workspace and returns a context,
+# run takes the context and is timed. Setup is not timed. Run may return the
+# number of rows it processed if it is not the number of rows of the table.
+
+def _setup_table(tbl, nrows, ws):
+    return tbl
+
+def _run_values(tbl):
+    ap.values(tbl, 'NUM')
+
+def _setup_frequency(tbl, nrows, ws):
+    return ap.values(tbl, 'CAT')
+
+def _run_frequency(x):
+    ap.frequency(x)
+
+def _run_distinct(tbl):
+    ap.distinct(tbl, 'CAT')
+
+def _run_summary(tbl):
+    ap.summary(tbl, verbose=False)
+
+def _run_head(tbl):
+    ap.head(tbl, 10, verbose=False)
+    return 10
+
+def _setup_tlist_to_table(tbl, nrows, ws):
+    out = os.path.join(ws, 'bench_tlist_out')
+    ap.dlt(out)
+    return (list(synthetic_rows(nrows)), out)
+
+def _run_tlist_to_table(ctx):
+    ap.tlist_to_table(ctx[0], ctx[1], COLS)
+
+def _setup_update_col_from_dict(tbl, nrows, ws):
+    tbl = copy_table(tbl, 'upd')
+    return (tbl, dict((i + 1, float(i)) for i in xrange(nrows)))
+
+def _run_update_col_from_dict(ctx):
+    ap.update_col_from_dict(ctx[0], ctx[1], 'UPD')
+
+def _setup_join_using_dict(tbl, nrows, ws):
+    return (copy_table(tbl, 'join'), make_join_table(ws))
+
+def _run_join_using_dict(ctx):
+    ap.join_using_dict(ctx[0], 'KEY', ctx[1], 'KEY', ['VAL', 'NOTE'])
+
+
+CASES = {
+    'values': (_setup_table, _run_values),
+    'frequency': (_setup_frequency, _run_frequency),
+    'distinct': (_setup_table, _run_distinct),
+    'summary': (_setup_table, _run_summary),
+    'head': (_setup_table, _run_head),
+    'tlist_to_table': (_setup_tlist_to_table, _run_tlist_to_table),
+    'update_col_from_dict': (_setup_update_col_from_dict, _run_update_col_from_dict),
+    'join_using_dict': (_setup_join_using_dict, _run_join_using_dict)
+}
+"""Benchmark cases by name"""
+
+
+def memory():
+    """Return tuple (current, peak) memory of this process in bytes.
+
+    Uses psapi on Windows and /proc and resource elsewhere, any value which
+    cannot be determined is None.
+    """
+    if os.name == 'nt':
+        import ctypes
+        from ctypes import wintypes
+
+        class PMC(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD),
+                        ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t),
+                        ('PeakPagefileUsage', ctypes.c_size_t)]
+        pmc = PMC()
+        pmc.cb = ctypes.sizeof(PMC)
+        proc = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(proc, ctypes.byref(pmc), pmc.cb)
+        return (pmc.WorkingSetSize, pmc.PeakWorkingSetSize)
+    current, peak = None, None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == 'darwin' else 1024
+    except Exception:
+        pass
+    return (current, peak)
+
+
+def use_fake(call_latency=0.0, row_latency=0.0):
+    """Make arcapi use ArcpyFake with given latencies instead of arcpy"""
+    ap.arcpy = ArcpyFake(call_latency, row_latency)
+
+
+def run_case(case, ws, nrows, seed=0, fake=None):
+    """Run benchmark case on a synthetic table with nrows rows.
+
+    If fake is a tuple (call_latency, row_latency) and this process does not
+    use ArcpyFake yet, use_fake is called first.
+
+    Returns a dictionary with keys case, nrows, seconds, rows_per_sec, and
+    peak_mem, which is the growth of peak memory during the timed run
+    (None if it cannot be measured).
+    """
+    if fake is not None and not isinstance(ap.arcpy, ArcpyFake):
+        use_fake(*fake)
+    setup, run = CASES[case]
+    ctx = setup(make_table(ws, nrows, seed), nrows, ws)
+    current, peak = memory()
+    t = time.time()
+    n = run(ctx)
+    seconds = time.time() - t
+    peak_after = memory()[1]
+    n = nrows if n is None else n
+    peak_mem = None
+    if peak_after is not None:
+        peak_mem = max(0, peak_after - max(current or 0, peak or 0))
+    return {
+        'case': case,
+        'nrows': nrows,
+        'seconds': seconds,
+        'rows_per_sec': n / seconds if seconds > 0 else None,
+        'peak_mem': peak_mem
+    }
+
+
+def _run_case_star(args):
+    return run_case(*args)
+
+
+def bench(cases=None, sizes=SIZES, ws=None, seed=0, repeat=3, fake=None, verbose=True):
+    """Run benchmark cases on synthetic tables of sizes and return results.
+
+    Every run is executed in a fresh process. Of repeated runs, the fastest
+    one is kept. Synthetic tables are created once and reused.
+
+    Optional:
+    cases -- list of case names, default None runs all CASES
+    sizes -- numbers of rows of synthetic tables
+    ws -- workspace for synthetic tables, default is arcpy.env.scratchGDB
+    seed -- seed for random number generator
+    repeat -- number of runs of each case, default is 3
+    fake -- tuple (call_latency, row_latency) to run on ArcpyFake, default
+        is None, which runs on arcpy
+    verbose -- print progress if True (default)
+    """
+    if cases is None:
+        cases = sorted(CASES.keys())
+    if fake is not None:
+        use_fake(*fake)
+    if ws is None:
+        ws = ap.arcpy.env.scratchGDB
+    results = []
+    for nrows in sizes:
+        make_table(ws, nrows, seed)
+        for case in cases:
+            best = None
+            for i in range(repeat):
+                pool = multiprocessing.Pool(1)
+                try:
+                    r = pool.apply(_run_case_star, ((case, ws, nrows, seed, fake),))
+                finally:
+                    pool.close()
+                    pool.join()
+                if best is None or r['seconds'] < best['seconds']:
+                    best = r
+            results.append(best)
+            if verbose:
+                ap.msg('%s %s rows: %.3f s, %s rows/s, peak memory +%s B' %
+                    (case, nrows, best['seconds'], best['rows_per_sec'], best['peak_mem']))
+    return {
+        'meta': {
+            'arcapi': ap.__version__,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'time': ap.tstamp(tf='%Y-%m-%d %H:%M:%S'),
+            'seed': seed,
+            'repeat': repeat,
+            'fake': fake
+        },
+        'results': results
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare results with baseline results and return list of regressions.
+
+    A regression is a case where rows per second dropped or peak memory grew
+    by more than tolerance (fraction, default is 0.2 for 20%) compared to the
+    baseline. Each regression is a tuple (case, nrows, measure, baseline value,
+    new value). Cases missing from the baseline are ignored.
+    """
+    base = dict([((r['case'], r['nrows']), r) for r in baseline['results']])
+    regressions = []
+    for r in results['results']:
+        b = base.get((r['case'], r['nrows']), None)
+        if b is None:
+            continue
+        if b['rows_per_sec'] and r['rows_per_sec'] is not None:
+            if r['rows_per_sec'] < b['rows_per_sec'] * (1 - tolerance):
+                regressions.append((r['case'], r['nrows'], 'rows_per_sec', b['rows_per_sec'], r['rows_per_sec']))
+        if b['peak_mem'] and r['peak_mem'] is not None:
+            if r['peak_mem'] > b['peak_mem'] * (1 + tolerance):
+                regressions.append((r['case'], r['nrows'], 'peak_mem', b['peak_mem'], r['peak_mem']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for arcapi')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES.keys()), default=None)
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    parser.add_argument('--workspace', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', default='bench.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--fake', action='store_true', help='use in-memory ArcpyFake instead of arcpy')
+    parser.add_argument('--call-latency', type=float, default=0.0)
+    parser.add_argument('--row-latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = (args.call_latency, args.row_latency) if args.fake else None
+    results = bench(args.cases, args.sizes, args.workspace, args.seed, args.repeat, fake)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=1)
+    ap.msg('Results written to ' + str(args.out))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            ap.msg('Regressions against ' + str(args.baseline), level='warning')
+            ap.print_tuples(regressions)
+            return 1
+        ap.msg('No regressions against ' + str(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
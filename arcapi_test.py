@@ -19,10 +19,214 @@
 import unittest
 import os
 import sys
+import json
+import time
+import urlparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from contextlib import contextmanager
 import arcpy
 import arcapi as ap
 
 
+class _TestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Local stand-in for a REST endpoint with keep-alive connections"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        self.server.requests.append(self.path)
+        if self.drop():
+            return
+        if self.path.startswith('/etag'):
+            if self.headers.get('If-None-Match', None) == '"v1"':
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            text = json.dumps({'path': self.path, 'etag': 'v1'})
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(text)))
+            self.end_headers()
+            self.wfile.write(text)
+            return
+        if self.path.startswith('/gzip') or self.path.startswith('/deflate'):
+            import zlib
+            self.server.encodings.append(self.headers.get('Accept-Encoding', None))
+            text = json.dumps({'path': self.path, 'items': range(1000)})
+            if self.path.startswith('/gzip'):
+                z = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            else:
+                z = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            text = z.compress(text) + z.flush()
+            self.send_response(200)
+            self.send_header('Content-Encoding', self.path[1:].split('?')[0])
+            self.send_header('Content-Length', str(len(text)))
+            self.end_headers()
+            self.wfile.write(text)
+            return
+        if self.path.startswith('/features'):
+            features = [{'attributes': {'OBJECTID': i}} for i in range(5000)]
+            self.reply(200, json.dumps({'fields': [], 'features': features}))
+            return
+        if self.path.startswith('/error'):
+            self.reply(200, json.dumps({'error': {'code': 500, 'message': 'Busy'}}))
+            return
+        if self.path.startswith('/epsg/'):
+            self.reply(200, 'SRS ' + self.path[6:])
+            return
+        if self.flaky():
+            return
+        if self.path.startswith('/slow'):
+            with self.server.lock:
+                self.server.active += 1
+                self.server.maxactive = max(self.server.active, self.server.maxactive)
+            time.sleep(0.05)
+            with self.server.lock:
+                self.server.active -= 1
+        if self.path.startswith('/redirect'):
+            self.send_response(302)
+            self.send_header('Location', '/json?redirected=1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.reply(200, json.dumps({'path': self.path, 'method': 'GET'}))
+
+    def do_POST(self):
+        self.server.clients.add(self.client_address)
+        self.server.requests.append(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.encodings.append(self.headers.get('Content-Encoding', None))
+        if self.headers.get('Content-Encoding', None) == 'gzip':
+            import zlib
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if self.drop() or self.flaky():
+            return
+        if self.path.startswith('/rest/'):
+            self.rest(dict((k, v[0]) for k, v in urlparse.parse_qs(body).items()))
+            return
+        self.reply(200, json.dumps({'path': self.path, 'method': 'POST', 'body': body}))
+
+    def flaky(self):
+        """Fail with 503 twice for each of /flaky paths, then succeed"""
+        if not self.path.startswith('/flaky'):
+            return False
+        with self.server.lock:
+            n = self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        if n > 2:
+            return False
+        self.send_response(503)
+        self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return True
+
+    def drop(self):
+        """Close the connection without response on first request of /drop paths"""
+        if not self.path.startswith('/drop'):
+            return False
+        with self.server.lock:
+            n = self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        if n > 1:
+            return False
+        self.close_connection = 1
+        return True
+
+    def rest(self, q):
+        """Emulate layer and query endpoints of ArcGIS REST API"""
+        if not self.path.endswith('/query'):
+            fields = [
+                {'name': 'OBJECTID', 'type': 'esriFieldTypeOID'},
+                {'name': 'NAME', 'type': 'esriFieldTypeString', 'length': 20},
+                {'name': 'VAL', 'type': 'esriFieldTypeDouble'},
+                {'name': 'DT', 'type': 'esriFieldTypeDate'},
+                {'name': 'BLOB', 'type': 'esriFieldTypeBlob'}
+            ]
+            layer = {'fields': fields, 'maxRecordCount': 1000}
+            if self.path == '/rest/hosted':
+                # hosted layers report geometry derived fields
+                fields.extend([
+                    {'name': 'POP-EST', 'type': 'esriFieldTypeInteger'},
+                    {'name': 'Shape', 'type': 'esriFieldTypeDouble'},
+                    {'name': 'Shape__Area', 'type': 'esriFieldTypeDouble'},
+                    {'name': 'SHAPE.STLength()', 'type': 'esriFieldTypeDouble'},
+                    {'name': 'Shape_Area_sqkm', 'type': 'esriFieldTypeDouble'}
+                ])
+                layer['geometryField'] = {'name': 'Shape', 'type': 'esriFieldTypeGeometry'}
+            return self.reply(200, json.dumps(layer))
+        if q.get('returnIdsOnly', None) == 'true':
+            n = 2500
+            if q['where'].startswith('OBJECTID <= '):
+                n = int(q['where'][12:])
+            ids = range(n, 0, -1)
+            return self.reply(200, json.dumps({'objectIdFieldName': 'OBJECTID', 'objectIds': ids}))
+        ids = map(int, q['objectIds'].split(','))
+        if 13 in ids and 'fail' in q:
+            return self.reply(200, json.dumps({'error': {'code': 400, 'message': 'Failed'}}))
+        features = [{'attributes': {
+            'OBJECTID': i, 'NAME': 'n%s' % i, 'VAL': None if i % 10 == 0 else i * 0.5,
+            'DT': 86400000 * i, 'BLOB': 'x', 'POP-EST': 2 * i, 'Shape__Area': 1.5, 'Shape_Area_sqkm': 0.5}} for i in ids]
+        self.reply(200, json.dumps({'features': features}))
+
+    def reply(self, status, text):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, *args):
+        pass
+
+
+class _TestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        import socket
+        # clients closing pooled connections are expected
+        if not issubclass(sys.exc_info()[0], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+def _test_server(handler=_TestHandler, tls=False):
+    """Start local HTTP server in a thread, return it, url is server.url.
+
+    If tls is True, the server speaks HTTPS with a self-signed certificate
+    from the testing folder, see _unverified_https.
+    """
+    server = _TestServer(('127.0.0.1', 0), handler)
+    if tls:
+        import ssl
+        pem = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'testing', 'testing_files', 'localhost.pem')
+        server.socket = ssl.wrap_socket(server.socket, certfile=pem, server_side=True)
+    server.clients = set()
+    server.requests = []
+    server.encodings = []
+    server.lock = threading.Lock()
+    server.hits = {}
+    server.active = server.maxactive = 0
+    server.url = '%s://127.0.0.1:%s' % ('https' if tls else 'http', server.server_address[1])
+    th = threading.Thread(target=server.serve_forever)
+    th.daemon = True
+    th.start()
+    return server
+
+
+@contextmanager
+def _unverified_https():
+    """Accept the self-signed certificate of the test server within a with block"""
+    import ssl
+    default = ssl._create_default_https_context
+    ssl._create_default_https_context = ssl._create_unverified_context
+    try:
+        yield
+    finally:
+        ssl._create_default_https_context = default
+
+
 class TestGlobalFunctions(unittest.TestCase):
 
     def setUp(self):
@@ -116,6 +320,20 @@ class TestGlobalFunctions(unittest.TestCase):
         self.assertEqual(str(est).lower(), str(obs).lower())
         pass
 
+    def testchart_many(self):
+        fcs = [self.t_fc, self.t_fc2, self.t_fc]
+        est = ap.chart_many(fcs, r'c:\temp', lambda a: {'txt': os.path.basename(a)})
+        obs = [
+            (self.t_fc, r'c:\temp\ne_110m_admin_0_countries.jpg', None),
+            (self.t_fc2, r'c:\temp\Illinois.jpg', None),
+            (self.t_fc, r'c:\temp\ne_110m_admin_0_countries_2.jpg', None)
+        ]
+        self.assertEqual(est, obs)
+        for e in est:
+            self.assertTrue(os.path.exists(e[1]))
+            os.remove(e[1])
+        pass
+
     def testplot(self):
         pic = r'c:\temp\plot.png'
         x = xrange(20)
@@ -127,6 +345,18 @@ class TestGlobalFunctions(unittest.TestCase):
             ap.plot(x, [1,2,3], pic, 'Main', 'X [m]', 'Y [m]', 'o', 'k', openit=False)
         pass
 
+    def testplot_lod(self):
+        pic = r'c:\temp\plot.png'
+        x = range(1000)
+        y = [i % 37 for i in x]
+        for lod in ('density', 'hexbin', 'decimate'):
+            ap.plot(x, y, pic, openit=False, maxpoints=100, lod=lod, gridsize=20)
+            self.assertTrue(os.path.exists(pic))
+            os.remove(pic)
+        with self.assertRaises(ap.ArcapiError):
+            ap.plot(x, y, pic, openit=False, lod='spam')
+        pass
+
     def testhist(self):
         pic = r'c:\temp\plot.png'
         x = xrange(20)
@@ -135,6 +365,21 @@ class TestGlobalFunctions(unittest.TestCase):
         os.remove(pic)
         self.assertFalse(os.path.exists(pic))
 
+    def testhist_table(self):
+        pic = r'c:\temp\plot.png'
+        h = ap.hist_table(self.t_fc, 'POP_EST', 5, out_file=pic, openit=False)
+        self.assertEqual(int(sum(h[0])), ap.nrow(self.t_fc))
+        self.assertEqual(len(h[1]), 6)
+        h = ap.hist_table(self.t_fc, 'POP_EST', [0, 1e6, 1e10], '"POP_EST" > 0',
+            out_file=pic, main='Main', log=True, openit=False)
+        self.assertEqual(list(h[1]), [0, 1e6, 1e10])
+        # numpy integers are numbers of bins too
+        import numpy
+        h = ap.hist_table(self.t_fc, 'POP_EST', numpy.int64(5), out_file=pic, openit=False)
+        self.assertEqual(len(h[1]), 6)
+        os.remove(pic)
+        self.assertFalse(os.path.exists(pic))
+
     def testbars(self):
         pic = r'c:\temp\plot.png'
         x = xrange(20)
@@ -155,6 +400,23 @@ class TestGlobalFunctions(unittest.TestCase):
         os.remove(pic)
         self.assertFalse(os.path.exists(pic))
 
+    def testplot_many(self):
+        pics = [r'c:\temp\plot_many_%s.png' % i for i in range(4)]
+        specs = [
+            {'kind': 'plot', 'x': range(20), 'out_file': pics[0]},
+            {'kind': 'hist', 'x': range(20), 'out_file': pics[1], 'bins': 5},
+            {'kind': 'bars', 'x': range(5), 'out_file': pics[2], 'main': 'Main'},
+            {'kind': 'pie', 'x': [1,2,3,4], 'y': [1,1,2,2], 'out_file': pics[3]},
+            {'kind': 'spam', 'x': [], 'out_file': r'c:\temp\spam.png'}
+        ]
+        est = ap.plot_many(iter(specs), 2)
+        self.assertEqual([e[0] for e in est], pics + [r'c:\temp\spam.png'])
+        self.assertEqual([e[1] is None for e in est], [True] * 4 + [False])
+        self.assertTrue(all([os.path.exists(p) for p in pics]))
+        for p in pics:
+            os.remove(p)
+        pass
+
     def testrename_col(self):
         import arcpy
         import tempfile
@@ -223,6 +485,47 @@ class TestGlobalFunctions(unittest.TestCase):
 ##    def testmsg(self):
 ##        pass
 
+    def teststart_logger(self):
+        import json
+        log = r'c:\temp\arcapi_log.txt'
+        for f in [log, log + '.1', log + '.2']:
+            if os.path.exists(f):
+                os.remove(f)
+        ap.start_logger(log, maxbytes=1000, backups=2, jsonl=True)
+        for i in range(100):
+            ap.msg('message ' + str(i), verbose=False)
+        ap.stop_logger()
+        with open(log, 'r') as f:
+            lines = f.readlines()
+        self.assertEqual(json.loads(lines[-1])['msg'], 'message 99')
+        self.assertTrue(os.path.getsize(log) <= 1000)
+        self.assertTrue(os.path.exists(log + '.2'))
+        self.assertFalse(os.path.exists(log + '.3'))
+        for f in [log, log + '.1', log + '.2']:
+            os.remove(f)
+        # errors are written before msg returns, even if not printed
+        ap.start_logger(log)
+        try:
+            ap.msg('failed', verbose=False, level='error')
+            with open(log, 'r') as f:
+                self.assertTrue(f.read().endswith(': failed\n'))
+        finally:
+            ap.stop_logger()
+        os.remove(log)
+        # msg that got the logger just before it stopped writes directly
+        ap.start_logger()
+        logger = ap._logger
+        ap.stop_logger()
+        ap._logger = logger
+        try:
+            ap.msg('late', verbose=False, log=log)
+        finally:
+            ap._logger = None
+        with open(log, 'r') as f:
+            self.assertTrue(f.read().endswith(': late\n'))
+        os.remove(log)
+        pass
+
     def testfrequency(self):
         est = ap.frequency([1,1,2,3,4,4,4])
         obs = {1: 2, 2: 1, 3: 1, 4: 3}
@@ -259,6 +562,14 @@ class TestGlobalFunctions(unittest.TestCase):
         self.assertEqual(est, obs)
         pass
 
+    def testunique_name(self):
+        est = [ap.unique_name('lr') for i in range(1000)]
+        self.assertEqual(len(set(est)), 1000)
+        self.assertTrue(all([e.startswith('lr_') for e in est]))
+        self.assertTrue(str(os.getpid()) in est[0])
+        self.assertTrue(ap.unique_name('tmp', '.shp').endswith('.shp'))
+        pass
+
     def testdlt(self):
         est = []
         wc = '"OBJECTID" < 11'
@@ -287,6 +598,34 @@ class TestGlobalFunctions(unittest.TestCase):
         obs = 0
         self.assertEqual(est, obs)
 
+    def testscratch(self):
+        ofc = arcpy.CreateScratchName("tmp_out.dbf", workspace="c:\\temp").replace('.dbf', '.shp')
+        with ap.scratch() as s:
+            tmp = s.add(arcpy.CopyFeatures_management(self.t_fc, 'in_memory\\scratch_tmp').getOutput(0))
+            out = s.add(arcpy.management.Copy(self.t_fc, arcpy.CreateScratchName("tmp", workspace=arcpy.env.scratchGDB)).getOutput(0))
+            ptfc = ap.to_points(self.t_fc, ofc, "POP_EST", "GDP_MD_EST", 27700)
+            self.assertEqual(len(s.items), 3) # tmp, out, and layer from to_points
+            self.assertTrue(arcpy.Exists(tmp))
+        self.assertFalse(arcpy.Exists(tmp))
+        self.assertFalse(arcpy.Exists(out))
+        self.assertEqual(s.failed, [])
+        self.assertTrue(arcpy.Exists(ptfc))
+        arcpy.Delete_management(ptfc)
+        # layers and views go before any workspace group
+        deleted = []
+        delete = arcpy.Delete_management
+        arcpy.Delete_management = deleted.append
+        try:
+            s = ap._ScratchSession()
+            for x in ['lyr', 'in_memory\\a', 'c:\\temp\\x.gdb\\b', 'view', 'in_memory\\c']:
+                s.add(x)
+            self.assertEqual(s.cleanup(), [])
+        finally:
+            arcpy.Delete_management = delete
+        self.assertEqual(deleted[:2], ['view', 'lyr'])
+        self.assertEqual(len(deleted), 5)
+        pass
+
     def testto_points(self):
         obs = 10
         wc = '"OBJECTID" < ' + str(obs + 1)
@@ -305,6 +644,31 @@ class TestGlobalFunctions(unittest.TestCase):
 ##    def testswsp(self):
 ##        pass
 
+    def testscratch_pool(self):
+        import tempfile
+        folder = tempfile.mkdtemp()
+        sws = arcpy.env.scratchWorkspace
+        try:
+            gdbs = ap.scratch_pool(folder, 2)
+            self.assertEqual(len(gdbs), 2)
+            self.assertTrue(all([arcpy.Exists(g) for g in gdbs]))
+            arcpy.env.scratchWorkspace = None
+            est = ap.to_scratch('foo')
+            self.assertEqual(est, os.path.join(gdbs[0], 'foo'))
+            self.assertEqual(ap.swsp(), gdbs[0])
+        finally:
+            ap.scratch_pool(None)
+            arcpy.env.scratchWorkspace = sws
+        pass
+
+    def testpmap(self):
+        fcs = [self.t_fc, self.t_fc2, os.path.join(self.testing_gdb, 'nope')]
+        est = ap.pmap(ap.nrow, fcs, 2)
+        self.assertEqual([e[0] for e in est], fcs)
+        self.assertEqual([e[1] for e in est[:2]], [177, ap.nrow(self.t_fc2)])
+        self.assertEqual([e[2] is None for e in est], [True, True, False])
+        pass
+
     def testto_scratch(self):
         est = []
         obs = []
@@ -389,6 +753,34 @@ class TestGlobalFunctions(unittest.TestCase):
         est.append(len(findings))
         self.assertEqual(est, obs)
 
+    def testfind_iter(self):
+        obs = sorted(set(ap.find('*.shp', self.testingfolder) + ap.find('*110m*', self.testingfolder)))
+        est = sorted(ap.find_iter(['*.shp', '*110m*'], self.testingfolder))
+        self.assertEqual(est, obs)
+        idx = os.path.join(self.testingfolder, 'find.idx')
+        try:
+            est = sorted(ap.find_iter(['*.shp', '*110m*'], self.testingfolder, index=idx))
+            self.assertEqual(est, obs)
+            est = sorted(ap.find_iter(['*.shp', '*110m*'], self.testingfolder, index=idx))
+            self.assertEqual(est, obs)
+        finally:
+            os.remove(idx)
+        self.assertEqual(list(ap.find_iter('*.shp', self.testingfolder, False)), ap.find('*.shp', self.testingfolder, False))
+        # a small buffer holds back the threads, not the results
+        est = sorted(ap._find_walk(self.testingfolder, buffer=2))
+        self.assertEqual(est, sorted(ap._find_walk(self.testingfolder, workers=1)))
+        # errors in the threads reach the caller
+        def fail(*args):
+            raise ValueError('walk failed')
+        tree = ap._find_tree
+        ap._find_tree = fail
+        try:
+            with self.assertRaises(ValueError):
+                list(ap.find_iter('*.shp', self.testingfolder))
+        finally:
+            ap._find_tree = tree
+        pass
+
     def testfixArgs(self):
         list_args = 'C:\Temp\Shapefiles\Contours.shp;C:\Temp\Shapefiles\Contours.shp'
         est = ap.fixArgs(list_args, list)
@@ -398,13 +790,28 @@ class TestGlobalFunctions(unittest.TestCase):
         self.assertEqual(est, False)
         pass
 
+    def testextension(self):
+        if arcpy.CheckExtension('Spatial') == 'Available':
+            with ap.extension('Spatial'):
+                with ap.extension('Spatial'):
+                    self.assertEqual(arcpy.CheckExtension('Spatial'), 'Available')
+                est = arcpy.sa.Times(os.path.join(self.testingfolder, r'testing_files\rasters\dh30m_dem'), 2)
+                self.assertTrue(est is not None)
+        with self.assertRaises(ap.ArcapiError):
+            with ap.extension('NoSuchExtension'):
+                pass
+        pass
+
     def testint_to_float(self):
         _dir = os.path.join(self.testingfolder, r'testing_files\rasters')
         ndvi = os.path.join(_dir, 'dh_july_ndvi')
         ob = round(arcpy.Raster(ndvi).maximum, 5)
         int_rst = os.path.join(_dir, 'ndvi_int')
         est = os.path.join(_dir, 'ndvi_tst')
-        if arcpy.CheckExtension('Spatial') == 'Available':
+        if arcpy.CheckExtension('Spatial') != 'Available':
+            with self.assertRaises(ap.ArcapiError):
+                ap.int_to_float(ndvi, est, 6)
+        else:
             arcpy.CheckOutExtension('Spatial')
             arcpy.sa.Int(arcpy.sa.Times(ndvi, 1000000)).save(int_rst)
             arcpy.CheckInExtension('Spatial')
@@ -421,7 +828,10 @@ class TestGlobalFunctions(unittest.TestCase):
         ndvi = os.path.join(_dir, 'dh_july_ndvi')
         est = os.path.join(_dir, 'ndvi_fill')
         null = os.path.join(_dir, 'null_rst')
-        if arcpy.CheckExtension('Spatial') == 'Available':
+        if arcpy.CheckExtension('Spatial') != 'Available':
+            with self.assertRaises(ap.ArcapiError):
+                ap.fill_no_data(ndvi, est, 10, 10)
+        else:
             ap.fill_no_data(ndvi, est, 10, 10)
             arcpy.CheckOutExtension('Spatial')
             arcpy.sa.IsNull(est).save(null)
@@ -437,6 +847,10 @@ class TestGlobalFunctions(unittest.TestCase):
         _dir = os.path.join(self.testingfolder, r'testing_files\rasters')
         dem = os.path.join(_dir, 'dh30m_dem')
         est = os.path.join(_dir, 'dem_ft')
+        if arcpy.CheckExtension('Spatial') != 'Available':
+            with self.assertRaises(ap.ArcapiError):
+                ap.meters_to_feet(dem, est)
+            return
         ap.meters_to_feet(dem, est)
         self.assertEqual(int(arcpy.Raster(est).maximum), 6244)
         try:
@@ -461,9 +875,17 @@ class TestGlobalFunctions(unittest.TestCase):
         pass
 
     def testlist_all_fcs(self):
+        ws = arcpy.env.workspace
         est = ap.list_all_fcs(self.testing_gdb, '*', 'All', True)
         obs = ['Illinois', 'ne_110m_admin_0_countries']
         self.assertEqual(est, obs)
+        self.assertEqual(arcpy.env.workspace, ws)
+        pass
+
+    def testgdb_inventory(self):
+        est = ap.gdb_inventory([self.testing_gdb], 'ill*', 'Polygon', True, refresh=True)
+        self.assertEqual(est, {self.testing_gdb: ['Illinois']})
+        self.assertEqual(ap.gdb_inventory(self.testing_gdb, 'ill*', 'Polygon'), [self.t_fc2])
         pass
 
     def testfield_list(self):
@@ -601,6 +1023,33 @@ class TestGlobalFunctions(unittest.TestCase):
         all_in = all([(ei in datas) for ei in expected])
         self.assertTrue(all_in)
 
+    def testcatalog_index(self):
+        db = os.path.join(self.testingfolder, 'catalog.sqlite')
+        try:
+            est = ap.catalog_index(self.testingfolder, db)
+            self.assertTrue(est['added'] > 0)
+            self.assertTrue(self.t_fc in ap.catalog_with_field(db, 'pop_est'))
+            est = ap.catalog_search(db, 'FeatureClass', 'Polygon', 177, 177)
+            self.assertEqual(est, [self.t_fc])
+            self.assertEqual(ap.catalog_index(self.testingfolder, db)['added'], 0)
+        finally:
+            if os.path.exists(db):
+                os.remove(db)
+        pass
+
+    def testscan_data(self):
+        cache = os.path.join(self.testingfolder, 'scan_cache.json')
+        try:
+            obs = sorted(ap.list_data(self.testingfolder))
+            est = sorted(ap.scan_data(self.testingfolder, cache))
+            self.assertEqual(est, obs)
+            est = sorted(ap.scan_data(self.testingfolder, cache))
+            self.assertEqual(est, obs)
+        finally:
+            if os.path.exists(cache):
+                os.remove(cache)
+        pass
+
     def testrequest_text(self):
         """Basic test to get a page as text"""
         d = ap.request('http://google.com')
@@ -628,6 +1077,260 @@ class TestGlobalFunctions(unittest.TestCase):
 
         self.assertEqual(tg, tp)
 
+    def testrequest_keepalive(self):
+        """Requests to one host reuse one connection"""
+        server = _test_server()
+        try:
+            ap.connection_pool(4, 60)
+            for i in range(5):
+                d = ap.request(server.url + '/json?i=%s' % i, None, 'json')
+                self.assertEqual(d['path'], '/json?i=%s' % i)
+            d = ap.request(server.url + '/post', {'a': 1}, 'json')
+            self.assertEqual((d['method'], d['body']), ('POST', 'a=1'))
+            d = ap.request(server.url + '/redirect', None, 'json')
+            self.assertEqual(d['path'], '/json?redirected=1')
+            self.assertEqual(len(server.clients), 1)
+            # a dropped GET on a reused connection is sent again, a POST is not
+            self.assertEqual(ap.request(server.url + '/drop?g', None, 'json')['path'], '/drop?g')
+            self.assertEqual(server.hits['/drop?g'], 2)
+            ap.request(server.url + '/json')
+            self.assertRaises(Exception, ap.request, server.url + '/drop?p', {'a': 1})
+            self.assertEqual(server.hits['/drop?p'], 1)
+            server.clients.clear()
+            # without the pool, every request opens a new connection
+            ap.connection_pool(0)
+            for i in range(3):
+                ap.request(server.url + '/json')
+            self.assertEqual(len(server.clients), 3)
+        finally:
+            ap.connection_pool(4)
+            server.shutdown()
+            server.server_close()
+        pass
+
+    def testrequest_many(self):
+        server = _test_server()
+        try:
+            urls = [server.url + '/slow?i=%s' % i for i in range(12)]
+            est = ap.request_many(urls, 6, per_host=2)
+            self.assertEqual([e[0] for e in est], range(12))
+            self.assertEqual([e[1] for e in est], [ap.request(u) for u in urls])
+            self.assertTrue(server.maxactive <= 2)
+            # results as they complete
+            specs = [(server.url + '/json', {'i': i}, 'json') for i in range(6)]
+            est = sorted(ap.request_many(specs, 3, ordered=False))
+            self.assertEqual([e[1]['body'] for e in est], ['i=%s' % i for i in range(6)])
+            # rate limit
+            t = time.time()
+            ap.request_many([server.url + '/json'] * 8, 8, rate=5)
+            self.assertTrue(time.time() - t >= 0.5)
+            # retries
+            est = ap.request_many([server.url + '/flaky?a', {'url': server.url + '/flaky?b'}], retries=3, backoff=0.01)
+            self.assertEqual([e[2] for e in est], [None, None])
+            est = ap.request_many([server.url + '/flaky?c'], retries=1, backoff=0.01)
+            self.assertTrue('503' in est[0][2])
+            # POST requests are retried only on request
+            est = ap.request_many([(server.url + '/flaky?d', {'a': 1})], backoff=0.01)
+            self.assertTrue('503' in est[0][2])
+            self.assertEqual(server.hits['/flaky?d'], 1)
+            est = ap.request_many([(server.url + '/flaky?e', {'a': 1}), {'url': server.url + '/flaky?f', 'data': {'a': 1}, 'retry': True}],
+                                  backoff=0.01, retry_post=True)
+            self.assertEqual([e[2] for e in est], [None, None])
+            est = ap.request_many([{'url': server.url + '/flaky?g', 'retry': False}], backoff=0.01)
+            self.assertEqual(server.hits['/flaky?g'], 1)
+        finally:
+            ap.connection_pool()
+            server.shutdown()
+            server.server_close()
+        pass
+
+    def testrequest_many_https(self):
+        server = _test_server(tls=True)
+        try:
+            with _unverified_https():
+                est = ap.request_many([(server.url + '/flaky?a', None, 'json')], retries=3, backoff=0.01)
+                self.assertEqual(est, [(0, {'path': '/flaky?a', 'method': 'GET'}, None)])
+                self.assertEqual(server.hits['/flaky?a'], 3)
+                est = ap.request_many([server.url + '/flaky?b'], retries=1, backoff=0.01)
+                self.assertTrue('503' in est[0][2])
+                # request_https itself returns the body unless strict
+                self.assertEqual(ap.request_https(server.url + '/flaky?c'), '')
+        finally:
+            ap.connection_pool()
+            server.shutdown()
+            server.server_close()
+        pass
+
+    def testhttp_cache(self):
+        import shutil
+        import tempfile
+        server = _test_server()
+        folder = tempfile.mkdtemp()
+        try:
+            ap.http_cache(folder, 60)
+            est = [ap.request(server.url + '/json?a', None, 'json') for i in range(3)]
+            self.assertEqual(est, [est[0]] * 3)
+            self.assertEqual(server.requests, ['/json?a'])
+            self.assertEqual(ap.request(server.url + '/json?a'), json.dumps(est[0]))
+            # POST requests are not cached by default
+            ap.request(server.url + '/json?a', {'b': 1})
+            ap.request(server.url + '/json?a', {'b': 1})
+            self.assertEqual(len(server.requests), 3)
+            # when enabled, POST requests are keyed on the body too
+            ap.http_cache(folder, 60, post=True)
+            ap.request(server.url + '/json?a', {'b': 1})
+            ap.request(server.url + '/json?a', {'b': 2})
+            ap.request(server.url + '/json?a', {'b': 1})
+            self.assertEqual(len(server.requests), 5)
+            # ArcGIS REST errors are not cached
+            est = [ap.request(server.url + '/error', None, 'json') for i in range(2)]
+            self.assertTrue('error' in est[0])
+            self.assertEqual(len(server.requests), 7)
+            # expired responses are revalidated
+            ap.http_cache(folder, 0)
+            est = [ap.request(server.url + '/etag', None, 'json') for i in range(3)]
+            self.assertEqual(est, [{'path': '/etag', 'etag': 'v1'}] * 3)
+            self.assertEqual(len(server.requests), 10)
+            # least recently used responses are evicted
+            ap.http_cache(folder, 60, 0.001, True)
+            for i in range(20):
+                ap.request(server.url + '/json?%s' % i)
+            size = sum([os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)])
+            self.assertTrue(0 < size <= 1024 * 1.1)
+        finally:
+            ap.http_cache()
+            ap.connection_pool()
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(folder, True)
+        pass
+
+    def testrequest_stream(self):
+        import tempfile
+        server = _test_server()
+        out = tempfile.mktemp('.json')
+        try:
+            url = server.url + '/features'
+            chunks = list(ap.request_stream(url, chunk_size=1000))
+            self.assertTrue(max([len(c) for c in chunks]) <= 1000)
+            self.assertEqual(''.join(chunks), ap.request(url))
+            self.assertEqual(ap.request_stream(url, out_file=out), out)
+            with open(out, 'rb') as f:
+                self.assertEqual(f.read(), ap.request(url))
+            est = [ft['attributes']['OBJECTID'] for ft in ap.json_items(ap.request_stream(url), 'features')]
+            self.assertEqual(est, range(5000))
+            with open(out, 'rb') as f:
+                self.assertEqual(len(list(ap.json_items(f))), 5000)
+            self.assertEqual(list(ap.json_items('{"a": {"b": [1, 2.5, "]"]}}', 'a.b')), [1, 2.5, ']'])
+            # connections are reused after the body was read
+            self.assertEqual(len(server.clients), 1)
+        finally:
+            ap.connection_pool()
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(out):
+                os.remove(out)
+        pass
+
+    def testdownload_features(self):
+        import datetime
+        server = _test_server()
+        out = os.path.join('in_memory', 'downloaded')
+        try:
+            est = ap.download_features(server.url + '/rest/layer', out, page_size=300, workers=4)
+            self.assertEqual(ap.names(est)[1:], ['SRC_OID', 'NAME', 'VAL', 'DT'])
+            vals = ap.values(est, ['SRC_OID', 'NAME', 'VAL', 'DT'])
+            self.assertEqual(len(vals), 2500)
+            self.assertEqual([v[0] for v in vals], range(1, 2501))
+            self.assertEqual(vals[9], (10, 'n10', None, datetime.datetime(1970, 1, 11)))
+            self.assertEqual(vals[10][2], 5.5)
+            # 2500 ids in pages of 300, one request for schema and one for ids
+            self.assertEqual(len(server.requests), 9 + 2)
+            arcpy.Delete_management(est)
+            est = ap.download_features(server.url + '/rest/layer', out, 'OBJECTID <= 5')
+            self.assertEqual(ap.values(est, 'SRC_OID'), [1, 2, 3, 4, 5])
+            arcpy.Delete_management(est)
+            # geometry derived fields are skipped, others get valid names
+            est = ap.download_features(server.url + '/rest/hosted', out, 'OBJECTID <= 3')
+            self.assertEqual(ap.names(est)[1:], ['SRC_OID', 'NAME', 'VAL', 'DT', 'POP_EST', 'Shape_Area_sqkm'])
+            self.assertEqual(ap.values(est, 'POP_EST'), [2, 4, 6])
+            self.assertEqual(ap.values(est, 'Shape_Area_sqkm'), [0.5] * 3)
+            arcpy.Delete_management(est)
+            with self.assertRaises(ap.ArcapiError):
+                ap.download_features(server.url + '/rest/layer', out, page_size=10, params={'fail': 1})
+            self.assertEqual(ap.nrow(out), 2490)
+        finally:
+            ap.connection_pool()
+            server.shutdown()
+            server.server_close()
+            if arcpy.Exists(out):
+                arcpy.Delete_management(out)
+        pass
+
+    def testhttp_compression(self):
+        server = _test_server()
+        try:
+            obs = {'path': '/gzip', 'items': range(1000)}
+            self.assertEqual(ap.request(server.url + '/gzip', None, 'json'), obs)
+            self.assertEqual(server.encodings, ['gzip, deflate'])
+            obs['path'] = '/deflate'
+            self.assertEqual(ap.request(server.url + '/deflate', None, 'json'), obs)
+            est = list(ap.request_stream(server.url + '/gzip', chunk_size=10))
+            self.assertEqual(json.loads(''.join(est))['items'], range(1000))
+            est = list(ap.json_items(ap.request_stream(server.url + '/gzip?i', chunk_size=100), 'items'))
+            self.assertEqual(est, range(1000))
+            # large POST bodies are compressed
+            ap.http_compression(True, 100)
+            data = {'a': 'x' * 200}
+            self.assertEqual(ap.request(server.url + '/post', data, 'json')['body'], 'a=' + 'x' * 200)
+            self.assertEqual(ap.request(server.url + '/post', {'a': 1}, 'json')['body'], 'a=1')
+            self.assertEqual(server.encodings[-2:], ['gzip', None])
+            ap.http_compression(False)
+            ap.request(server.url + '/gzip?j')
+            self.assertFalse('gzip' in str(server.encodings[-1]))
+        finally:
+            ap.http_compression()
+            ap.connection_pool()
+            server.shutdown()
+            server.server_close()
+        pass
+
+    def testepsg(self):
+        self.assertTrue(ap.epsg(4326).startswith('GEOGCS['))
+        self.assertTrue(ap.epsg(27700) is ap.epsg(27700))
+        pass
+
+    def testsrs_catalog(self):
+        import tempfile
+        server = _test_server()
+        url = ap._epsg_url
+        ap._epsg_url = server.url + '/epsg/%s.%s'
+        catalog = tempfile.mktemp('.json')
+        try:
+            ap.srs_catalog(catalog)
+            self.assertEqual(ap.epsg(99901, 'proj4'), 'SRS 99901.proj4')
+            self.assertEqual(ap.epsg(99901, 'proj4'), 'SRS 99901.proj4')
+            self.assertEqual(len(server.requests), 1)
+            est = ap.epsg_prefetch([99901, 99902, 99903], ['proj4', 'wkt'])
+            self.assertEqual(est, [])
+            self.assertEqual(len(server.requests), 6)
+            # another process reads the catalog
+            ap._srs.clear()
+            self.assertEqual(ap.srs_catalog(catalog, True), 6)
+            self.assertEqual(ap.epsg(99903, 'wkt'), 'SRS 99903.wkt')
+            self.assertEqual(len(server.requests), 6)
+            with self.assertRaises(ap.ArcapiError):
+                ap.epsg(99904, 'proj4')
+        finally:
+            ap.srs_catalog()
+            ap._epsg_url = url
+            ap.connection_pool()
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(catalog):
+                os.remove(catalog)
+        pass
+
     def testarctype_to_ptype(self):
         """Converting from ArcGIS type strings to python types"""
         self.assertTrue(ap.arctype_to_ptype("SHORT") is int)
@@ -664,6 +1367,45 @@ class TestGlobalFunctions(unittest.TestCase):
         self.assertEqual(observed, expected)
         pass
 
+    def testprofile_report(self):
+        ap.profile_reset()
+        ap.profile_start()
+        ap.values(self.t_fc, 'OBJECTID')
+        ap.distinct(self.t_fc, 'OBJECTID')
+        ap.profile_stop()
+        ap.values(self.t_fc, 'OBJECTID') # not recorded
+        report = dict([(r[0], r) for r in ap.profile_report()])
+        self.assertEqual(report['values'][1], 2)
+        self.assertEqual(report['values'][5], 2 * ap.nrow(self.t_fc))
+        self.assertEqual(report['distinct'][1], 1)
+        self.assertEqual(report['distinct'][5], 0)
+        self.assertTrue(report['distinct'][2] >= 0)
+        ap.profile_reset()
+        self.assertEqual(ap.profile_report(), [])
+        pass
+
+    def testtrace_arcpy(self):
+        fc = os.path.join(self.testing_gdb, 'Illinois')
+        with ap.trace_arcpy() as t:
+            ap.create_field_name(fc, 'NAME')
+            arcpy.Describe(fc) # not called from arcapi, not recorded
+        self.assertEqual(t.calls('arcpy.Describe'), 2)
+        self.assertEqual(t.calls('arcpy.ListFields'), 1)
+        self.assertTrue(all([r[0] == 'create_field_name' for r in t.report()]))
+        self.assertTrue(ap.arcpy is arcpy)
+
+        # tracing works over ArcpyMockup too
+        from ArcpyMockup import ArcpyMockup
+        mockup = ArcpyMockup()
+        mockup.ListFields = lambda x: arcpy.ListFields(x)
+        with ap.trace_arcpy(mockup) as t:
+            ap.names(fc)
+            ap.types(fc)
+        est = [r[:3] for r in t.report('calls')]
+        obs = [('names', 'arcpy.ListFields', 1), ('types', 'arcpy.ListFields', 1)]
+        self.assertEqual(est, obs)
+        pass
+
 
 if __name__ == '__main__':
     unittest.main(verbosity = 2)